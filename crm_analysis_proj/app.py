@@ -1,3 +1,6 @@
+import io
+import os
+
 import streamlit as st
 import pandas as pd
 
@@ -7,40 +10,109 @@ import pages.rfm_analysis as rfm_analysis
 import pages.churn_prediction as churn_prediction
 import pages.customer_segmentation as customer_segmentation
 import pages.future_predictions as future_predictions
+from utils.dataset import prepare_dataset
+from utils.incremental import IncrementalStore
+from utils.ingest import ValidationError, content_hash, ingest_files, format_report
+from utils import instrumentation, parquet_dataset, precompute
+from utils.page_cache import PAGE_CACHE
 
 # Set page configuration
 st.set_page_config(page_title="CRM Dashboard", layout="wide")
 
-# Required columns for the dataset
-REQUIRED_COLUMNS = ['CustomerID', 'InvoiceDate', 'Quantity', 'UnitPrice']
+# Pages work on views of one shared Dataset; copy-on-write keeps their writes local
+pd.set_option("mode.copy_on_write", True)
+
+# Times, peak memory and cache counters of this script run, for the debug panel and the metrics log
+rerun = instrumentation.Rerun()
 
-@st.cache_data
-def load_data(uploaded_file):
-    """Load and preprocess the uploaded dataset."""
-    if uploaded_file is None:
-        return None
+# Where the line items live: in memory (fastest for files that fit) or on disk, queried by DuckDB
+PANDAS_BACKEND = "pandas (in memory)"
+PARQUET_BACKEND = "DuckDB on Parquet (out-of-core)"
+
+@instrumentation.tracked_cache("load_data", st.cache_resource(max_entries=2))
+def load_data(uploaded_files):
+    """Load and preprocess the uploaded files as one dataset."""
+    if not uploaded_files:
+        return None, None
 
     try:
-        df = pd.read_csv(uploaded_file, encoding="ISO-8859-1")
+        # Typed ingest, one worker per file; re-uploads of the same files are served from the Arrow cache
+        with instrumentation.span("ingest", backend="pandas", files=len(uploaded_files)) as fields:
+            df, report = ingest_files([uploaded_file.getvalue() for uploaded_file in uploaded_files])
+            fields.update(rows=report['rows'], cache_hit=report['cache_hit'])
+
+        # Derive Revenue/Profit/MonthKey once; pages only read the shared Dataset
+        dataset = prepare_dataset(df, report['fingerprint'])
+        dataset.cube  # build the overview cube at ingest
 
-        # Ensure required columns exist
-        missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
-        if missing_cols:
-            st.error(f"🚨 Missing required columns: {', '.join(missing_cols)}.")
-            return None
+        st.success("✅ Data loaded successfully.")
+        return dataset, report
+
+    except ValidationError as e:
+        # Rejected from the header and first rows, before the file was parsed
+        st.error(f"🚨 File rejected: {e}")
+        return None, None
 
-        # Convert InvoiceDate
-        df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
+    except Exception as e:
+        st.error(f"🚨 Error loading data: {e}")
+        return None, None
 
-        # Compute Revenue
-        df['Revenue'] = df['UnitPrice'] * df['Quantity']
+@instrumentation.tracked_cache("load_parquet", st.cache_resource(max_entries=2))
+def load_parquet(_source, fingerprint):
+    """Convert a CSV (uploaded bytes or a local path) to partitioned Parquet and open it with DuckDB.
+
+    Cached by fingerprint alone, so the file contents are not re-hashed by Streamlit on every rerun.
+    """
+    try:
+        source = io.BytesIO(_source) if isinstance(_source, bytes) else _source
+        dataset, report = parquet_dataset.open_csv(source, fingerprint)
+        dataset.cube  # build the overview cube at ingest
 
         st.success("✅ Data loaded successfully.")
-        return df
+        return dataset, report
+
+    except ValidationError as e:
+        # Rejected from the header and first rows, before the file was parsed
+        st.error(f"🚨 File rejected: {e}")
+        return None, None
 
     except Exception as e:
         st.error(f"🚨 Error loading data: {e}")
-        return None
+        return None, None
+
+@st.cache_resource
+def get_incremental_store():
+    """Open the on-disk incremental history shared by all sessions."""
+    return IncrementalStore()
+
+@instrumentation.tracked_cache("load_history", st.cache_resource(max_entries=2))
+def load_history(fingerprint):
+    """Open the incremental history from its checkpoint (one cache entry per set of applied batches)."""
+    return get_incremental_store().dataset()
+
+def append_data(uploaded_files):
+    """Append the uploaded files, as one batch, to the incremental history and return the updated dataset."""
+    store = get_incremental_store()
+    report = None
+
+    if uploaded_files:
+        try:
+            with instrumentation.span("ingest", backend="incremental", files=len(uploaded_files)) as fields:
+                df, report = ingest_files([uploaded_file.getvalue() for uploaded_file in uploaded_files])
+                fields.update(rows=report['rows'], cache_hit=report['cache_hit'])
+
+            if store.append(df, report['fingerprint']):
+                st.success(f"✅ Batch appended to history ({len(store.batches)} batches).")
+
+        except ValidationError as e:
+            st.error(f"🚨 File rejected: {e}")
+
+        except Exception as e:
+            st.error(f"🚨 Error appending data: {e}")
+
+    if not store.batches:
+        return None, report
+    return load_history(store.fingerprint), report
 
 # Sidebar: File upload
 st.sidebar.header("📂 Upload Your Dataset")
@@ -52,35 +124,119 @@ st.sidebar.markdown("""
 - `UnitPrice`
 """)
 
-uploaded_file = st.sidebar.file_uploader("Upload a CSV file", type=["csv"])
+uploaded_files = st.sidebar.file_uploader(
+    "Upload CSV, gzip/zstd-compressed CSV or Parquet files", type=["csv", "gz", "zst", "zstd", "parquet"],
+    accept_multiple_files=True,
+    help="Several files (e.g. monthly exports) are combined into one dataset; lines repeated across files are kept once."
+)
+incremental_mode = st.sidebar.checkbox(
+    "➕ Append to saved history",
+    help="Add the upload to the on-disk invoice history and update its aggregates instead of replacing the data."
+)
+
+backend = st.sidebar.selectbox(
+    "🗄 Backend", [PANDAS_BACKEND, PARQUET_BACKEND], disabled=incremental_mode,
+    help="DuckDB on Parquet keeps the line items on disk and only loads aggregates, for files larger than memory."
+)
+local_path = ""
+if backend == PARQUET_BACKEND and not incremental_mode:
+    local_path = st.sidebar.text_input(
+        "…or a local CSV path", help="Read a large file from disk instead of uploading it."
+    ).strip()
 
 # Load and preprocess the data
-df = load_data(uploaded_file)
+if incremental_mode:
+    dataset, ingest_report = append_data(uploaded_files)
+elif backend == PARQUET_BACKEND and local_path:
+    if os.path.isfile(local_path):
+        dataset, ingest_report = load_parquet(local_path, parquet_dataset.file_hash(local_path))
+    else:
+        st.sidebar.error(f"🚨 File not found: {local_path}")
+        dataset, ingest_report = None, None
+elif backend == PARQUET_BACKEND and uploaded_files:
+    if len(uploaded_files) > 1:
+        st.sidebar.info(f"ℹ The DuckDB backend converts one file; using {uploaded_files[0].name}.")
+    data = uploaded_files[0].getvalue()
+    dataset, ingest_report = load_parquet(data, content_hash(data))
+else:
+    dataset, ingest_report = load_data(uploaded_files)
+if ingest_report is not None:
+    summary = parquet_dataset.format_report if isinstance(dataset, parquet_dataset.ParquetDataset) else format_report
+    st.sidebar.caption(f"⏱ {summary(ingest_report)}")
+    if ingest_report.get('quarantined'):
+        st.sidebar.warning(f"⚠ {ingest_report['quarantined']:,} malformed rows were left out and saved, "
+                           f"with reasons, to {ingest_report['quarantine_path']}.")
+
+# Every page's default view is computed in the background as soon as the data is loaded
+PRECOMPUTE_JOBS = {
+    "Overview": overview.precompute,
+    "RFM Analysis": rfm_analysis.precompute,
+    "Churn Prediction": churn_prediction.precompute,
+    "Customer Segmentation": customer_segmentation.precompute,
+    "Future Predictions": future_predictions.precompute,
+}
+
+if dataset is not None and not dataset.empty:
+    precompute.schedule(dataset, PRECOMPUTE_JOBS)
+
+    # Polls until the jobs finish without rerunning the rest of the page, then reruns once to stop polling
+    polling = bool(precompute.progress(dataset.fingerprint)['running'])
+
+    @st.fragment(run_every=1 if polling else None)
+    def show_precompute_progress():
+        status = precompute.progress(dataset.fingerprint)
+        if polling and not status['running']:
+            st.rerun()
+        if status['running']:
+            st.progress(status['done'] / status['total'],
+                        text=f"⚙ Preparing pages {status['done']}/{status['total']}: {', '.join(status['running'])}")
+        else:
+            st.caption(f"✅ All {status['total']} pages ready.")
+        for name, error in status['failed'].items():
+            st.caption(f"⚠ {name} could not be prepared: {error}")
+
+    with st.sidebar:
+        show_precompute_progress()
 
 # Sidebar: Navigation
 st.sidebar.header("📊 CRM Dashboard Pages")
 page = st.sidebar.radio(
     "Choose a page:",
-    [
-        "Overview",
-        "RFM Analysis",
-        "Churn Prediction",
-        "Customer Segmentation",
-        "Future Predictions"
-    ]
+    list(PRECOMPUTE_JOBS)
 )
+rerun.page = page
 
 # Route to the selected page
-if df is not None and not df.empty:
+if dataset is not None and not dataset.empty:
     if page == "Overview":
-        overview.show(df)
+        overview.show(dataset)
     elif page == "RFM Analysis":
-        rfm_analysis.show(df)
+        rfm_analysis.show(dataset)
     elif page == "Churn Prediction":
-        churn_prediction.show(df)
+        churn_prediction.show(dataset)
     elif page == "Customer Segmentation":
-        customer_segmentation.show(df)
+        customer_segmentation.show(dataset)
     elif page == "Future Predictions":
-        future_predictions.show(df)
+        future_predictions.show(dataset)
 else:
     st.warning("⚠ Please upload a valid dataset to proceed.")
+
+# Sidebar: optional instrumentation panel for this run (runs are also logged as JSON lines when CRM_METRICS_LOG is set)
+run_summary, spans = rerun.finish(PAGE_CACHE)
+if st.sidebar.checkbox("🛠 Debug panel", help="Timings, memory and cache counters of the last run."):
+    with st.sidebar.expander("🛠 Instrumentation", expanded=True):
+        col1, col2 = st.columns(2)
+        col1.metric("Run time", f"{run_summary['seconds']:.2f}s")
+        col2.metric("Peak memory", f"{run_summary['peak_rss_mb']:,.0f} MiB",
+                    help="Peak RSS during this run" if run_summary['peak_scope'] == 'rerun'
+                    else "Peak RSS of the process (other sessions' runs overlapped this one, or the peak can't be reset)")
+        if spans:
+            st.dataframe(
+                pd.DataFrame(spans).drop(columns=['ts', 'event', 'seq']).sort_values('seconds', ascending=False),
+                hide_index=True, use_container_width=True,
+            )
+        else:
+            st.caption("No timed stages ran; everything was served from cache.")
+        st.dataframe(pd.DataFrame(run_summary['cache']).T, use_container_width=True)
+        if instrumentation.METRICS_LOG:
+            st.caption(f"JSON lines: {instrumentation.METRICS_LOG}")
@@ -0,0 +1,95 @@
+"""Benchmark: pandas Dataset vs. DuckDB-on-Parquet ParquetDataset, checking both give the same page outputs.
+
+Run from crm_analysis_proj:
+    python benchmarks/bench_backends.py --rows 1000000 10000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_csv
+from benchmarks.harness import peak_rss_mb
+from utils.dataset import prepare_dataset
+from utils.ingest import apply_schema
+from utils.parquet_dataset import file_hash, open_csv
+
+import pages.churn_prediction as churn_prediction
+import pages.overview as overview
+import pages.rfm_analysis as rfm_analysis
+
+AGGREGATES = ['customer_facts', 'customer_months', 'customer_days', 'monthly_totals', 'product_totals']
+
+
+def assert_same(left, right, name):
+    """Compares two aggregates or page tables, ignoring categorical-vs-object and integer width differences."""
+    if isinstance(left, pd.Series):
+        pd.testing.assert_series_equal(left, right, check_dtype=False, check_index_type=False,
+                                       check_categorical=False, check_names=False, rtol=1e-5, obj=name)
+    elif isinstance(left, pd.DataFrame):
+        pd.testing.assert_frame_equal(left.reset_index(drop=True), right.reset_index(drop=True), check_dtype=False,
+                                      check_categorical=False, check_index_type=False, rtol=1e-5, obj=name)
+    elif hasattr(left, 'frame'):
+        assert_same(left.frame, right.frame, name)
+    elif isinstance(left, dict):
+        for key in left:
+            assert_same(left[key], right[key], f"{name}.{key}")
+    elif isinstance(left, np.ndarray):
+        np.testing.assert_allclose(left, right, rtol=1e-5, err_msg=name)
+    elif isinstance(left, float):
+        assert abs(left - right) <= 1e-6 * max(abs(left), 1), (name, left, right)
+    else:
+        assert left == right, (name, left, right)
+
+
+def run(dataset):
+    """Builds every backend-served aggregate and page table; returns them with the elapsed time."""
+    start = time.perf_counter()
+    results = {name: getattr(dataset, name) for name in AGGREGATES}
+    results['cube.cells'] = dataset.cube.cells
+    results['reference_date'] = dataset.reference_date
+    # Exact distinct counts: the backends hash differently, so their sketch estimates differ slightly
+    results['overview'] = overview.compute(dataset, exact=True)
+    results['rfm_analysis'] = rfm_analysis.compute(dataset)
+    results['churn_prediction'] = churn_prediction.compute(dataset, 90, [180, 365])
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'backend':<8} {'load s':>8} {'pages s':>8} {'peak MiB':>9}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, "data.csv")
+            write_csv(csv_path, rows)
+
+            start = time.perf_counter()
+            parquet, _ = open_csv(csv_path, file_hash(csv_path), directory=os.path.join(directory, "parquet"))
+            parquet_load = time.perf_counter() - start
+            parquet_results, parquet_seconds = run(parquet)
+            parquet_peak = peak_rss_mb()
+
+            start = time.perf_counter()
+            df = apply_schema(pd.read_csv(csv_path, encoding="ISO-8859-1"))
+            dataset = prepare_dataset(df, "pandas")
+            pandas_load = time.perf_counter() - start
+            pandas_results, pandas_seconds = run(dataset)
+
+            for name in pandas_results:
+                assert_same(pandas_results[name], parquet_results[name], name)
+
+            print(f"{rows:>12,} {'duckdb':<8} {parquet_load:>8.2f} {parquet_seconds:>8.2f} {parquet_peak:>9.0f}")
+            print(f"{rows:>12,} {'pandas':<8} {pandas_load:>8.2f} {pandas_seconds:>8.2f} {peak_rss_mb():>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark: Plotly payload size of the wide/long page charts before and after chart preparation.
+
+Run from crm_analysis_proj:
+    python benchmarks/bench_charts.py --keys 5000 --points 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.visuals import downsample, figure_bytes, top_n
+
+
+def make_tables(keys, points, seed=42):
+    """Wide category tables with keys distinct labels and long series of points observations."""
+    rng = np.random.default_rng(seed)
+    categories = ['Beauty', 'Clothing', 'Electronics', 'Home & Kitchen', 'Sports']
+    revenue = rng.pareto(1.2, keys) * 1000
+    dates = pd.date_range('2000-01-01', periods=points, freq='D')
+    return {
+        'country_summary': pd.DataFrame({
+            'Country': [f"Country {i}" for i in range(keys)], 'Revenue': revenue, 'Profit': revenue * 0.3,
+        }),
+        'manufacturer_category_summary': pd.DataFrame({
+            'Manufacturer': np.repeat([f"Maker {i}" for i in range(keys)], len(categories)),
+            'Category': np.tile(categories, keys),
+            'Quantity': rng.integers(1, 1000, keys * len(categories)),
+        }),
+        'inventory_turnover': pd.DataFrame({
+            'Description': [f"Product {i}" for i in range(keys)],
+            'Quantity': (revenue / 10).astype('int64'),
+        }).assign(**{'Turnover Rate': lambda d: d['Quantity'] / d['Quantity'].max() * 5}),
+        'churn_per_month': pd.DataFrame({
+            'InvoiceMonth': np.tile(dates, 3),
+            'Threshold': np.repeat(['90 days', '180 days', '365 days'], points),
+            'Churned': rng.uniform(0, 100, points * 3),
+        }),
+        'revenue_time_series': pd.DataFrame({
+            'InvoiceDate': dates, 'Revenue': np.cumsum(rng.normal(0, 100, points)) + 10_000,
+        }),
+    }
+
+
+def charts(tables, prepared):
+    """Builds each chart the way the pages do, with or without the preparation step."""
+    prep = (lambda func, *args, **kwargs: func(*args, **kwargs)) if prepared else (lambda func, df, *args, **kwargs: df)
+    series = tables['revenue_time_series']
+    revenue = px.line(prep(downsample, series, 'InvoiceDate', 'Revenue'), x='InvoiceDate', y='Revenue', render_mode='svg')
+    revenue.add_scatter(x=series['InvoiceDate'].iloc[-6:], y=series['Revenue'].iloc[-6:], mode='lines+markers')
+    return {
+        'country': px.bar(prep(top_n, tables['country_summary'], 'Country', 'Revenue'),
+                          x='Country', y=['Revenue', 'Profit'], barmode='group'),
+        'manufacturer_category': px.bar(prep(top_n, tables['manufacturer_category_summary'], 'Manufacturer', 'Quantity',
+                                             by=['Category']), x='Manufacturer', y='Quantity', color='Category'),
+        'inventory_turnover': px.bar(prep(top_n, tables['inventory_turnover'], 'Description', 'Quantity', n=10,
+                                          aggregations={'Quantity': 'sum', 'Turnover Rate': 'mean'}),
+                                     x='Description', y='Turnover Rate', color='Turnover Rate'),
+        'churn_rate': px.line(prep(downsample, tables['churn_per_month'], 'InvoiceMonth', 'Churned', by='Threshold'),
+                              x='InvoiceMonth', y='Churned', color='Threshold', render_mode='svg'),
+        'revenue_forecast': revenue,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, default=5000, help="distinct countries/manufacturers/products")
+    parser.add_argument('--points', type=int, default=20000, help="observations per time series")
+    args = parser.parse_args()
+
+    tables = make_tables(args.keys, args.points)
+    start = time.perf_counter()
+    before = charts(tables, prepared=False)
+    before_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    after = charts(tables, prepared=True)
+    after_seconds = time.perf_counter() - start
+
+    print(f"{'chart':<24} {'before KiB':>11} {'after KiB':>10} {'ratio':>7}  traces")
+    for name in before:
+        raw, prepared = figure_bytes(before[name]), figure_bytes(after[name])
+        trace_types = sorted({trace.type for trace in after[name].data})
+        print(f"{name:<24} {raw / 1024:>11,.1f} {prepared / 1024:>10,.1f} {raw / prepared:>6.1f}x  {','.join(trace_types)}")
+    print(f"build seconds: {before_seconds:.2f} before, {after_seconds:.2f} after")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark: churn-risk throughput (features, model fit, batched scoring) and its accuracy on simulated customers.
+
+Customers are simulated at the purchase-day level, the input the churn
+features read, rather than as line items, so millions of customers fit in
+memory: each one buys at their own rate from a random start until a hidden
+churn day, spending less as it nears. The run times the training features
+and fit (cold, then from the persisted fit) and the scoring of every
+customer (features plus one predict_proba call), and fails when the risk
+scores don't separate the customers who have in truth churned (AUC below
+MIN_AUC).
+
+Run from crm_analysis_proj:
+    python benchmarks/bench_churn.py --customers 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.harness import peak_rss_mb
+from utils.churn import DEFAULT_CHURN_THRESHOLD
+from utils.churn_model import churn_features, churn_model, score_churn
+
+START_DATE = np.datetime64('2023-01-01', 'D')
+DAYS = 730
+FIRST_CUSTOMER_ID = 1000
+CATEGORIES = 8
+
+# Lowest accepted AUC of the risk scores against the simulated churn
+MIN_AUC = 0.75
+
+
+def simulate(customers, seed=42):
+    """Returns customer_purchase_days and customer_category_firsts tables and whether each customer churned."""
+    rng = np.random.default_rng(seed)
+    start = rng.integers(0, DAYS - 30, customers)
+    gap = np.exp(rng.normal(np.log(30), 0.8, customers))
+    lifetime = rng.exponential(365, customers)
+    end = np.minimum(start + lifetime, DAYS)
+    churned = start + lifetime < DAYS
+
+    # A Poisson process of purchases over each customer's active days, plus the first purchase
+    counts = rng.poisson((end - start) / gap) + 1
+    owner = np.repeat(np.arange(customers), counts)
+    offset = rng.random(len(owner)) * (end - start)[owner]
+    offset[np.r_[0, np.cumsum(counts)[:-1]]] = 0
+    day = start[owner] + offset.astype(np.int64)
+    # Spend fades towards the churn day
+    spend = np.exp(rng.normal(4, 1, len(owner))) * (1 - 0.8 * offset / lifetime[owner])
+
+    keys, inverse = np.unique(owner.astype(np.int64) * DAYS + day, return_inverse=True)
+    days = pd.DataFrame({
+        'CustomerID': (keys // DAYS + FIRST_CUSTOMER_ID).astype(np.int32),
+        'Day': START_DATE + (keys % DAYS).astype('timedelta64[D]'),
+        'Revenue': np.bincount(inverse, spend, len(keys)),
+    })
+    days['Day'] = days['Day'].astype('datetime64[ns]')
+
+    # Each category's first purchase is one of the customer's purchase days
+    purchases = np.bincount(keys // DAYS, minlength=customers)
+    first_row = np.r_[0, np.cumsum(purchases)[:-1]]
+    breadth = np.minimum(1 + rng.binomial(CATEGORIES - 1, 0.3, customers), purchases)
+    category_owner = np.repeat(np.arange(customers), breadth)
+    row = first_row[category_owner] + (rng.random(len(category_owner)) * purchases[category_owner]).astype(np.int64)
+    categories = pd.DataFrame({
+        'CustomerID': (category_owner + FIRST_CUSTOMER_ID).astype(np.int32),
+        'Category': np.arange(len(category_owner)) - np.repeat(np.r_[0, np.cumsum(breadth)[:-1]], breadth),
+        'FirstPurchase': days['Day'].to_numpy()[row],
+    })
+    return days, categories, pd.Series(churned, index=np.arange(customers) + FIRST_CUSTOMER_ID)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=1_000_000)
+    parser.add_argument('--horizon', type=int, default=DEFAULT_CHURN_THRESHOLD, help="churn horizon in days")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    days, categories, churned = simulate(args.customers)
+    reference_date = days['Day'].max()
+    print(f"{args.customers:,} customers, {len(days):,} purchase days simulated in {time.perf_counter() - start:.1f}s")
+
+    with tempfile.TemporaryDirectory(prefix="bench_churn_") as cache_dir:
+        timings = {}
+        for run in ['fit', 'cached']:
+            start = time.perf_counter()
+            fit = churn_model(days, categories, reference_date, args.horizon, cache_dir=cache_dir)
+            timings[run] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    features = churn_features(days, categories, reference_date)
+    timings['features'] = time.perf_counter() - start
+    start = time.perf_counter()
+    risk = score_churn(fit, features)
+    timings['inference'] = time.perf_counter() - start
+    scoring = timings['features'] + timings['inference']
+
+    auc = roc_auc_score(churned.reindex(risk.index).to_numpy(), risk['ChurnRisk'].to_numpy())
+    print(f"model: {fit['customers']:,} training customers, {fit['churned']:,} churned, training AUC {fit['auc']:.3f}")
+    print(f"fit {timings['fit']:.2f}s (from the persisted fit {timings['cached']:.2f}s); scoring {scoring:.2f}s "
+          f"= features {timings['features']:.2f}s + inference {timings['inference']:.2f}s, "
+          f"{len(risk) / scoring:,.0f} customers/s; peak {peak_rss_mb():,.0f} MiB")
+    print(f"at risk: {risk['RiskLevel'].value_counts().to_dict()}")
+    print(f"AUC against the simulated churn: {auc:.3f} ({'ok' if auc >= MIN_AUC else 'FAIL'}, minimum {MIN_AUC})")
+    sys.exit(0 if auc >= MIN_AUC else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Benchmark: format-sniffing DateParser vs. the previous pd.to_datetime calls on invoice date strings.
+
+Run from crm_analysis_proj:
+    python benchmarks/bench_dates.py --rows 10000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.dates import parse_dates
+
+
+def make_dates(rows, days=730, fmt="%d-%m-%Y", seed=42):
+    """rows date strings in fmt (the bundled data's day-first format) over days distinct dates."""
+    rng = np.random.default_rng(seed)
+    distinct = pd.date_range('2023-01-01', periods=days, freq='D').strftime(fmt).to_numpy(dtype=object)
+    return pd.Series(distinct[rng.integers(0, days, rows)], name='InvoiceDate')
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--days', type=int, default=730, help="distinct dates in the column")
+    args = parser.parse_args()
+
+    values = make_dates(args.rows, args.days)
+    # The previous ingest paths: inferred format (app), and a fixed format with a time the data lacks (loaders)
+    candidates = {
+        "to_datetime (inferred)": lambda: pd.to_datetime(values, errors='coerce'),
+        "to_datetime (%d-%m-%Y %H:%M)": lambda: pd.to_datetime(values, format="%d-%m-%Y %H:%M", errors='coerce'),
+        "DateParser": lambda: parse_dates(values)[0],
+    }
+    expected = pd.to_datetime(values, format="%d-%m-%Y")
+
+    print(f"{args.rows:,} rows, {args.days:,} distinct dates")
+    print(f"{'parser':<30} {'seconds':>8} {'NaT':>12} {'wrong':>12}")
+    for name, func in candidates.items():
+        parsed, seconds = timed(func)
+        wrong = int((parsed.notna() & (parsed != expected)).sum())
+        print(f"{name:<30} {seconds:>8.2f} {int(parsed.isna().sum()):>12,} {wrong:>12,}")
+
+
+if __name__ == '__main__':
+    main()
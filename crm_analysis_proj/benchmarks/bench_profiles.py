@@ -0,0 +1,190 @@
+"""Benchmark: load test of the profile lookup service, reporting p50/p99 latency and requests/sec.
+
+Without --url a synthetic CSV of --rows line items is written, profile_server.py
+is started on it in its own process, and after the lookup run the file is
+replaced by a different dataset and a refresh is forced while clients keep
+sending lookups; the run fails if any request errors or the fingerprint
+doesn't change. With --url a running service is targeted and only the
+lookups run. Each of --clients threads keeps one connection open and looks
+up random ids from the service's id range, one per GET or --batch per POST.
+
+Run from crm_analysis_proj:
+    python benchmarks/bench_profiles.py --rows 1000000 --clients 4 --seconds 10
+    python benchmarks/bench_profiles.py --url http://127.0.0.1:8600 --batch 100
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_csv
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profile_server.py")
+
+# Seconds to wait for a started server to load its profiles
+STARTUP_TIMEOUT = 600
+
+
+def request(connection, method, path, body=None):
+    """Sends one request on a kept-alive connection; returns the status and decoded JSON."""
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    connection.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(path, port):
+    """Starts profile_server.py on path and waits until it answers /health."""
+    process = subprocess.Popen([sys.executable, SERVER, path, "--port", str(port), "--refresh", "0"],
+                               env={**os.environ, 'CRM_METRICS_LOG': ""})
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"profile_server.py exited with status {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            status, health = request(connection, "GET", "/health")
+            connection.close()
+            if status == 200 and health.get('fingerprint'):
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    sys.exit("profile_server.py did not start in time")
+
+
+def run_clients(host, port, id_range, clients, seconds, batch, seed=42):
+    """Sends lookups from clients threads for seconds; returns latencies (s), statuses and errors."""
+    latencies, statuses, errors = [], [], []
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def client(index):
+        rng = np.random.default_rng(seed + index)
+        connection = http.client.HTTPConnection(host, port, timeout=10)
+        mine, codes = [], []
+        while time.perf_counter() < stop:
+            ids = rng.integers(id_range[0], id_range[1] + 1, max(batch, 1)).tolist()
+            start = time.perf_counter()
+            try:
+                if batch:
+                    status, _ = request(connection, "POST", "/customers", {'ids': ids})
+                else:
+                    status, _ = request(connection, "GET", f"/customers/{ids[0]}")
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                connection.close()
+                connection = http.client.HTTPConnection(host, port, timeout=10)
+                continue
+            mine.append(time.perf_counter() - start)
+            codes.append(status)
+        connection.close()
+        with lock:
+            latencies.extend(mine)
+            statuses.extend(codes)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), np.array(statuses), errors
+
+
+def report(name, latencies, statuses, errors, seconds, batch):
+    """Prints one run's latency percentiles and throughput; returns the requests that failed."""
+    failed = int(np.sum(statuses >= 500)) + len(errors)
+    if not len(latencies):
+        print(f"{name:<10} no completed requests, {failed} failed")
+        return failed
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    rate = len(latencies) / seconds
+    hits = np.mean(statuses == 200) if not batch else np.nan
+    print(f"{name:<10} {len(latencies):>9,} {p50:>9.3f} {p99:>9.3f} {latencies.max() * 1000:>9.2f} "
+          f"{rate:>10,.0f} {rate * max(batch, 1):>12,.0f} {hits:>7.0%} {failed:>7}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help="a running service (default: start one on synthetic data)")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="synthetic line items when starting a service")
+    parser.add_argument('--clients', type=int, default=4, help="concurrent connections")
+    parser.add_argument('--seconds', type=float, default=10.0, help="length of each run")
+    parser.add_argument('--batch', type=int, default=0, help="ids per POST request; 0 sends single GETs")
+    args = parser.parse_args()
+
+    process = directory = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        directory = tempfile.TemporaryDirectory(prefix="bench_profiles_")
+        path = os.path.join(directory.name, "data.csv")
+        write_csv(path, args.rows)
+        host, port = "127.0.0.1", free_port()
+        start = time.perf_counter()
+        process = start_server(path, port)
+        print(f"{args.rows:,} rows: service started in {time.perf_counter() - start:.1f}s")
+
+    failed = 0
+    try:
+        connection = http.client.HTTPConnection(host, port, timeout=10)
+        _, health = request(connection, "GET", "/health")
+        print(f"{health['customers']:,} profiles, {health['index']} index, {health['bytes'] / 2**20:,.1f} MiB; "
+              f"{args.clients} clients, {'GET' if not args.batch else f'POST of {args.batch}'} lookups")
+        print(f"{'run':<10} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>10} "
+              f"{'lookups/s':>12} {'found':>7} {'failed':>7}")
+        results = run_clients(host, port, health['id_range'], args.clients, args.seconds, args.batch)
+        failed += report("lookups", *results, args.seconds, args.batch)
+
+        if process is not None:
+            # Replace the file with another dataset and refresh while the clients keep going
+            write_csv(path + ".tmp", args.rows, seed=7)
+            os.replace(path + ".tmp", path)
+            refreshed = {}
+
+            def refresh():
+                start = time.perf_counter()
+                refreshed['status'], refreshed['health'] = request(
+                    http.client.HTTPConnection(host, port, timeout=STARTUP_TIMEOUT), "POST", "/refresh")
+                refreshed['seconds'] = time.perf_counter() - start
+
+            thread = threading.Thread(target=refresh)
+            thread.start()
+            results = run_clients(host, port, health['id_range'], args.clients, args.seconds, args.batch, seed=99)
+            thread.join()
+            failed += report("refresh", *results, args.seconds, args.batch)
+            swapped = refreshed['status'] == 200 and refreshed['health']['fingerprint'] != health['fingerprint']
+            print(f"refresh took {refreshed['seconds']:.1f}s under load; "
+                  f"store {'swapped' if swapped else 'NOT swapped'} to {refreshed['health'].get('fingerprint')}")
+            failed += not swapped
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            directory.cleanup()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
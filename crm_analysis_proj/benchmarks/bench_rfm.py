@@ -0,0 +1,90 @@
+"""Benchmark: RFM engine vs. the original per-customer lambda / row-wise apply code.
+
+Run from crm_analysis_proj:
+    python benchmarks/bench_rfm.py --rows 1000000 10000000 50000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generate
+from utils.customer_facts import build_customer_facts
+from utils.dataset import add_derived_columns
+from utils.rfm import rfm_table, score_rfm, segment_labels, churn_flags
+
+
+def make_frame(rows, seed=42):
+    """Synthetic line items (see synthetic.py) with the derived Revenue column."""
+    df = generate(rows, seed)
+    add_derived_columns(df)
+    return df
+
+
+def legacy_rfm(df, churn_threshold=90):
+    """The pre-engine rfm_analysis/churn_prediction code path."""
+    reference_date = df['InvoiceDate'].max()
+    rfm = df.groupby(['CustomerID', 'CustomerName'], observed=True).agg({
+        'InvoiceDate': lambda x: (reference_date - x.max()).days,
+        'InvoiceNo': 'nunique',
+        'Revenue': 'sum'
+    }).reset_index()
+    rfm.columns = ['CustomerID', 'CustomerName', 'Recency', 'Frequency', 'Monetary']
+    rfm['R'] = pd.qcut(rfm['Recency'], q=4, labels=[4, 3, 2, 1]).astype(int)
+    rfm['F'] = pd.qcut(rfm['Frequency'].rank(method="first"), q=4, labels=[1, 2, 3, 4]).astype(int)
+    rfm['M'] = pd.qcut(rfm['Monetary'].rank(method="first"), q=4, labels=[1, 2, 3, 4]).astype(int)
+    rfm['RFM Score'] = rfm[['R', 'F', 'M']].sum(axis=1)
+
+    def segment_customer(score):
+        if score >= 9:
+            return "Loyal Customers"
+        elif score >= 6:
+            return "New Customers"
+        elif score >= 4:
+            return "Hibernating"
+        else:
+            return "Churned"
+
+    rfm['Segment'] = rfm['RFM Score'].apply(segment_customer)
+    rfm['Churned'] = rfm['Recency'].apply(lambda x: 1 if x > churn_threshold else 0)
+    return rfm
+
+
+def engine_rfm(df, churn_threshold=90):
+    rfm = score_rfm(rfm_table(build_customer_facts(df)))
+    rfm['Segment'] = segment_labels(rfm['RFM Score'])
+    rfm['Churned'] = churn_flags(rfm['Recency'], churn_threshold)
+    return rfm
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000, 50_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'customers':>10} {'legacy s':>10} {'engine s':>10} {'speedup':>8}")
+    for rows in args.rows:
+        df = make_frame(rows)
+        legacy, legacy_seconds = timed(legacy_rfm, df)
+        engine, engine_seconds = timed(engine_rfm, df)
+
+        columns = ['CustomerID', 'CustomerName', 'Recency', 'Frequency', 'Monetary',
+                   'R', 'F', 'M', 'RFM Score', 'Segment', 'Churned']
+        pd.testing.assert_frame_equal(legacy[columns], engine[columns], check_dtype=False, check_categorical=False)
+
+        print(f"{rows:>12,} {len(engine):>10,} {legacy_seconds:>10.2f} {engine_seconds:>10.2f} "
+              f"{legacy_seconds / engine_seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
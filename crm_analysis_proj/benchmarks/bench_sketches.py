@@ -0,0 +1,158 @@
+"""Benchmark: HyperLogLog distinct counts and KLL quantiles vs. exact answers, checking their documented error.
+
+The first part sketches random values at several cardinalities; the second
+answers random cube filters (months, countries, categories) over synthetic
+line items both ways. The run fails when the root-mean-square relative error
+exceeds 1.5x the standard error, or more than 1% of estimates land outside
+three standard errors. The third part merges the per-cohort RFM sketches of
+the same data into quartile boundaries and fails when a boundary's true rank
+is off its quartile by more than MAX_RANK_ERROR.
+
+Run from crm_analysis_proj:
+    python benchmarks/bench_sketches.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generate
+import utils.cube
+from utils.cube import build_cube
+from utils.customer_facts import build_customer_facts
+from utils.dataset import add_derived_columns
+from utils.rfm import build_rfm_sketches, rfm_table, score_rfm
+from utils.sketches import HLLSketches, standard_error
+
+CARDINALITIES = [10, 100, 1_000, 10_000, 100_000, 1_000_000]
+
+# Largest accepted distance between a sketched quartile boundary's rank and its quartile
+MAX_RANK_ERROR = 0.01
+
+
+def check(errors, name):
+    """Prints and checks the relative errors of one set of estimates; returns whether they are within bounds."""
+    errors = np.asarray(errors)
+    bound = standard_error()
+    rms = float(np.sqrt(np.mean(errors ** 2)))
+    outside = float(np.mean(np.abs(errors) > 3 * bound))
+    ok = rms <= 1.5 * bound and outside <= 0.01
+    print(f"{name:<28} {len(errors):>6} {rms:>9.2%} {np.abs(errors).max():>9.2%} {outside:>9.1%}  {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def random_values(trials, seed=42):
+    """Relative errors of sketching random 64-bit ids, per cardinality."""
+    rng = np.random.default_rng(seed)
+    keys = pd.DataFrame({'Partition': [0]})
+    errors = {}
+    for cardinality in CARDINALITIES:
+        errors[cardinality] = []
+        for _ in range(trials):
+            values = pd.Series(rng.integers(0, 2**62, cardinality))
+            exact = values.nunique()
+            estimate = HLLSketches.from_values(keys, np.zeros(cardinality, dtype='int64'), values).count()
+            errors[cardinality].append(estimate / exact - 1)
+    return errors
+
+
+def random_filters(cube, queries, seed=42):
+    """Random month/country/category filters over the cube's sketch dimensions."""
+    rng = np.random.default_rng(seed)
+    months = np.sort(cube.cells['MonthKey'].unique())
+    for _ in range(queries):
+        start = rng.integers(0, len(months))
+        filters = {'MonthKey': list(months[start:start + rng.integers(1, 13)])}
+        if rng.random() < 0.5:
+            filters['Country'] = rng.choice(cube.cells['Country'].cat.categories)
+        if rng.random() < 0.5:
+            filters['Category'] = rng.choice(cube.cells['Category'].cat.categories)
+        yield filters
+
+
+def check_boundaries(df):
+    """Checks the sketched RFM quartile boundaries against the customers' true ranks; returns whether they pass."""
+    facts = build_customer_facts(df)
+    reference_date = facts['LastPurchase'].max()
+    rfm = rfm_table(facts, reference_date).dropna()
+
+    start = time.perf_counter()
+    sketches = build_rfm_sketches(facts)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    boundaries = sketches.boundaries(reference_date)
+    merge_seconds = time.perf_counter() - start
+
+    ok = True
+    print(f"\n{'boundary':<28} {'value':>12} {'rank':>9} {'target':>9}")
+    for metric, values in boundaries.items():
+        column = rfm[metric].to_numpy()
+        for quartile, value in enumerate(values, start=1):
+            # A boundary may sit inside a run of ties; it is right if its tie range covers the quartile
+            low, high = np.mean(column < value), np.mean(column <= value)
+            target = quartile / 4
+            error = max(low - target, target - high, 0)
+            ok &= error <= MAX_RANK_ERROR
+            print(f"{metric + ' Q' + str(quartile):<28} {value:>12,.1f} {low:>4.0%}-{high:<4.0%} {target:>9.0%}"
+                  f"  {'ok' if error <= MAX_RANK_ERROR else 'FAIL'}")
+
+    start = time.perf_counter()
+    score_rfm(rfm.copy())
+    exact_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    score_rfm(rfm.copy(), boundaries=boundaries)
+    sketch_seconds = time.perf_counter() - start
+    print(f"{len(rfm):,} customers in {len(sketches.cohorts)} cohorts: sketches built in {build_seconds:.3f}s, "
+          f"merged in {merge_seconds * 1000:.1f} ms; scoring {sketch_seconds * 1000:.1f} ms vs "
+          f"{exact_seconds * 1000:.1f} ms with qcut")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--trials', type=int, default=20, help="sketches per cardinality")
+    parser.add_argument('--queries', type=int, default=100, help="random cube filters")
+    args = parser.parse_args()
+
+    print(f"standard error {standard_error():.2%}")
+    print(f"{'estimates':<28} {'n':>6} {'rms err':>9} {'max err':>9} {'>3 SE':>9}")
+    ok = True
+    for cardinality, errors in random_values(args.trials).items():
+        ok &= check(errors, f"random ids, {cardinality:,}")
+
+    # Merge the sketches whatever the size of the data, so their error is what gets measured
+    utils.cube.EXACT_DISTINCT_LINES = 0
+    df = add_derived_columns(generate(args.rows))
+    start = time.perf_counter()
+    cube = build_cube(df)
+    build_seconds = time.perf_counter() - start
+
+    timings = {'sketch': 0.0, 'exact': 0.0}
+    for column in ['CustomerID', 'InvoiceNo']:
+        errors = []
+        for filters in random_filters(cube, args.queries):
+            start = time.perf_counter()
+            estimate = cube.distinct(column, filters)
+            timings['sketch'] += time.perf_counter() - start
+            start = time.perf_counter()
+            exact = cube.distinct(column, filters, exact=True)
+            timings['exact'] += time.perf_counter() - start
+            if exact:
+                errors.append(estimate / exact - 1)
+        ok &= check(errors, f"cube filters, {column}")
+
+    queries = 2 * args.queries
+    print(f"\n{args.rows:,} rows: cube with sketches built in {build_seconds:.2f}s; per filter "
+          f"{timings['sketch'] / queries * 1000:.2f} ms merged vs {timings['exact'] / queries * 1000:.2f} ms exact")
+    ok &= check_boundaries(df)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Headless page benchmarks: wall time, peak RSS and rows/sec of each page's computation.
+
+Each scale is generated once (benchmarks/synthetic.py) and written as an
+Arrow file; every page then runs its compute() in a fresh process with its
+own empty cache directory, so timings are cold (aggregates built, clusters
+and forecasts fitted) and peak RSS belongs to that page alone.
+
+Run from crm_analysis_proj:
+    python benchmarks/harness.py --rows 100000 1000000 10000000 --output results.json
+    python benchmarks/harness.py --rows 100000 --baseline baseline.json
+
+With --baseline the run exits non-zero when a page got slower or bigger than
+the stored result by more than --tolerance.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAGES = ['overview', 'rfm_analysis', 'churn_prediction', 'customer_segmentation', 'future_predictions']
+
+# Differences below these are noise, whatever the relative change
+MIN_SECONDS = 0.05
+MIN_RSS_MB = 16
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def run_page(path, page):
+    """Loads the Arrow file and times one page's compute(); runs inside the worker process."""
+    import pandas as pd
+
+    from utils.dataset import prepare_dataset
+    from utils.ingest import read_arrow
+
+    pd.set_option("mode.copy_on_write", True)
+    module = importlib.import_module(f"pages.{page}")
+
+    start = time.perf_counter()
+    dataset = prepare_dataset(read_arrow(path), os.path.basename(path))
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Block on forecast fits so the page's full cost is measured
+    module.compute(dataset, wait=None) if page == 'future_predictions' else module.compute(dataset)
+    seconds = time.perf_counter() - start
+
+    return {
+        'page': page,
+        'rows': len(dataset),
+        'load_seconds': load_seconds,
+        'seconds': seconds,
+        'rows_per_second': len(dataset) / seconds if seconds else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def write_scale(rows, seed, directory):
+    """Generates rows synthetic line items with their derived columns into an Arrow file."""
+    from benchmarks.synthetic import generate
+    from utils.dataset import add_derived_columns
+    from utils.ingest import write_arrow
+
+    path = os.path.join(directory, f"synthetic-{rows}.arrow")
+    df = generate(rows, seed)
+    add_derived_columns(df)
+    write_arrow(df, path)
+    return path
+
+
+def measure(path, page):
+    """Runs run_page in a fresh interpreter with an empty cache root and returns its result."""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, CRM_CACHE_DIR=cache_dir, PYTHONWARNINGS="ignore")
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', path, page],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def regressions(results, baseline, tolerance):
+    """Lists the (rows, page) results that exceed the baseline by more than tolerance."""
+    stored = {(r['rows'], r['page']): r for r in baseline['results']}
+    found = []
+    for result in results:
+        previous = stored.get((result['rows'], result['page']))
+        if previous is None:
+            continue
+        for metric, floor in [('seconds', MIN_SECONDS), ('peak_rss_mb', MIN_RSS_MB)]:
+            limit = previous[metric] * (1 + tolerance)
+            if result[metric] > limit and result[metric] - previous[metric] > floor:
+                found.append(f"{result['page']} @ {result['rows']:,} rows: {metric} "
+                             f"{result[metric]:.2f} > {previous[metric]:.2f} (+{tolerance:.0%})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--pages', nargs='+', default=PAGES, choices=PAGES)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write the results as JSON to this path")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to check against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--worker', nargs=2, metavar=('PATH', 'PAGE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_page(*args.worker)))
+        return
+
+    results = []
+    print(f"{'rows':>12} {'page':<22} {'seconds':>9} {'rows/s':>12} {'peak MiB':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            path = write_scale(rows, args.seed, directory)
+            for page in args.pages:
+                result = measure(path, page)
+                results.append(result)
+                print(f"{rows:>12,} {page:<22} {result['seconds']:>9.3f} "
+                      f"{result['rows_per_second']:>12,.0f} {result['peak_rss_mb']:>9.0f}")
+            os.remove(path)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Seeded synthetic line items in the data/data.csv schema, for benchmarks at 1e5-1e8 rows.
+
+Customers and products are drawn with Zipf-like skew (a few heavy buyers and
+best sellers, a long tail of both), each customer lives in one country, and
+every invoice belongs to one customer on one day. Rows are generated chunk by
+chunk with invoices never spanning two chunks, so a chunk is also a valid
+append batch for the incremental store.
+
+Run from crm_analysis_proj to write a CSV:
+    python benchmarks/synthetic.py data/synthetic-1m.csv --rows 1000000
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ingest import concat_typed
+
+# The products and countries of data/data.csv; larger catalogues add numbered variants
+PRODUCTS = [
+    ('B401', 'Face Cream', 'Beauty'), ('B402', 'Shampoo', 'Beauty'),
+    ('B403', 'Lipstick', 'Beauty'), ('B404', 'Perfume', 'Beauty'),
+    ('C201', 'T-Shirt', 'Clothing'), ('C202', 'Jeans', 'Clothing'),
+    ('C203', 'Jacket', 'Clothing'), ('C204', 'Sneakers', 'Clothing'),
+    ('E101', 'Smartphone', 'Electronics'), ('E102', 'Laptop', 'Electronics'),
+    ('E103', 'Wireless Earbuds', 'Electronics'), ('E104', 'Smartwatch', 'Electronics'),
+    ('H301', 'Blender', 'Home & Kitchen'), ('H302', 'Microwave', 'Home & Kitchen'),
+    ('H303', 'Vacuum Cleaner', 'Home & Kitchen'), ('H304', 'Air Fryer', 'Home & Kitchen'),
+    ('S501', 'Football', 'Sports'), ('S502', 'Yoga Mat', 'Sports'),
+    ('S503', 'Dumbbells', 'Sports'), ('S504', 'Running Shoes', 'Sports'),
+]
+COUNTRIES = ['France', 'Canada', 'India', 'Japan', 'Germany', 'UK', 'Australia', 'USA']
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda',
+               'David', 'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+              'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas']
+
+START_DATE = np.datetime64('2023-01-01', 'D')
+DAYS = 730
+LINES_PER_INVOICE = 3
+CUSTOMER_SKEW = 1.1
+PRODUCT_SKEW = 1.2
+FIRST_CUSTOMER_ID = 1000
+FIRST_INVOICE_NO = 10000
+
+CSV_COLUMNS = ['InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate',
+               'UnitPrice', 'CustomerID', 'Country', 'CustomerName', 'Category']
+
+
+def zipf_weights(n, skew, rng):
+    """Normalized 1/rank**skew weights, shuffled so ids don't follow popularity."""
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+class Catalogue:
+    """The customers and products shared by every chunk of one synthetic dataset."""
+
+    def __init__(self, customers, products, seed):
+        rng = np.random.default_rng(seed)
+        self.customer_weights = zipf_weights(customers, CUSTOMER_SKEW, rng)
+        self.customer_country = rng.integers(0, len(COUNTRIES), customers).astype('int8')
+        names = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+        self.customer_names = pd.Index([
+            names[i % len(names)] + (f" {i // len(names)}" if i >= len(names) else "") for i in range(customers)
+        ])
+
+        base = [PRODUCTS[i % len(PRODUCTS)] for i in range(products)]
+        self.stock_codes = pd.Index([
+            code if i < len(PRODUCTS) else f"{code}-{i // len(PRODUCTS)}" for i, (code, _, _) in enumerate(base)
+        ])
+        self.descriptions = pd.Index([
+            name if i < len(PRODUCTS) else f"{name} {i // len(PRODUCTS)}" for i, (_, name, _) in enumerate(base)
+        ])
+        categories = [category for _, _, category in base]
+        self.categories = pd.Index(sorted(set(categories)))
+        self.product_category = self.categories.get_indexer(categories).astype('int8')
+        self.product_weights = zipf_weights(products, PRODUCT_SKEW, rng)
+        self.base_price = rng.uniform(10, 500, products)
+
+
+def generate_chunk(catalogue, rows, first_invoice, rng):
+    """Generates one typed chunk; its invoices are numbered from first_invoice."""
+    invoices = max(rows // LINES_PER_INVOICE, 1)
+    invoice_customer = rng.choice(len(catalogue.customer_weights), invoices, p=catalogue.customer_weights)
+    invoice_day = rng.integers(0, DAYS, invoices)
+
+    line_invoice = np.sort(rng.integers(0, invoices, rows))
+    customer = invoice_customer[line_invoice]
+    product = rng.choice(len(catalogue.product_weights), rows, p=catalogue.product_weights)
+    price = catalogue.base_price[product] * rng.lognormal(0.0, 0.1, rows)
+
+    return pd.DataFrame({
+        'InvoiceNo': (first_invoice + line_invoice).astype('int64'),
+        'StockCode': pd.Categorical.from_codes(product, categories=catalogue.stock_codes),
+        'Description': pd.Categorical.from_codes(product, categories=catalogue.descriptions),
+        'Quantity': rng.integers(1, 11, rows).astype('int32'),
+        'InvoiceDate': (START_DATE + invoice_day[line_invoice]).astype('datetime64[ns]'),
+        'UnitPrice': np.round(price, 2).astype('float32'),
+        'CustomerID': (FIRST_CUSTOMER_ID + customer).astype('int32'),
+        'Country': pd.Categorical.from_codes(catalogue.customer_country[customer], categories=COUNTRIES),
+        'CustomerName': pd.Categorical.from_codes(customer, categories=catalogue.customer_names),
+        'Category': pd.Categorical.from_codes(catalogue.product_category[product], categories=catalogue.categories),
+    })
+
+
+def iter_chunks(rows, seed=42, chunk_rows=1_000_000, customers=None, products=None):
+    """Yields typed chunks totalling rows line items, reproducible for a given seed.
+
+    InvoiceNo is kept as its integer part (FIRST_INVOICE_NO upwards) in the
+    typed frames; write_csv renders it as "INV-<n>" like data/data.csv.
+    """
+    customers = customers or max(rows // 20, 100)
+    products = products or max(len(PRODUCTS), min(rows // 5000, 5000))
+    catalogue = Catalogue(customers, products, seed)
+
+    first_invoice = FIRST_INVOICE_NO
+    for index, start in enumerate(range(0, rows, chunk_rows)):
+        rng = np.random.default_rng([seed, index])
+        chunk = generate_chunk(catalogue, min(chunk_rows, rows - start), first_invoice, rng)
+        first_invoice = int(chunk['InvoiceNo'].iloc[-1]) + 1
+        yield chunk
+
+
+def generate(rows, seed=42, chunk_rows=1_000_000, customers=None, products=None):
+    """Returns rows synthetic line items as one typed DataFrame (see iter_chunks)."""
+    return concat_typed(list(iter_chunks(rows, seed, chunk_rows, customers, products)))
+
+
+def write_csv(path, rows, seed=42, chunk_rows=1_000_000):
+    """Writes a synthetic dataset as CSV in the data/data.csv format, one chunk at a time."""
+    with open(path, "w", newline="") as f:
+        for index, chunk in enumerate(iter_chunks(rows, seed, chunk_rows)):
+            chunk['InvoiceNo'] = "INV-" + chunk['InvoiceNo'].astype(str)
+            chunk['InvoiceDate'] = chunk['InvoiceDate'].dt.strftime('%d-%m-%Y')
+            chunk[CSV_COLUMNS].to_csv(f, header=index == 0, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    write_csv(args.path, args.rows, args.seed)
+
+
+if __name__ == '__main__':
+    main()
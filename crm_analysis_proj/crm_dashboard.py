@@ -1,42 +1,52 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
-import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+from utils.clustering import cluster_customers
+from utils.customer_facts import build_customer_facts
+from utils.dataset import prepare_dataset
+from utils.ingest import ingest_csv
+from utils.instrumentation import span
+from utils.rfm import quantile_scores, rfm_table
+from utils.time_index import TimeIndex
+
+# Views of the shared, date-sorted frame; copy-on-write keeps any write local
+pd.set_option("mode.copy_on_write", True)
 
 # Load Data
-@st.cache_data  # Cache to improve performance
+@st.cache_resource  # Parsed, typed and date-indexed once per process
 def load_data():
-    return pd.read_csv("data/data.csv")
-
-df = load_data()
+    with open("data/data.csv", "rb") as f, span("ingest", backend="pandas") as fields:
+        df, report = ingest_csv(f.read())
+        fields.update(rows=report['rows'], cache_hit=report['cache_hit'])
+    dataset = prepare_dataset(df, report['fingerprint'])
+    return dataset, TimeIndex(dataset.frame), report
 
-# Fix Date Parsing
-df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], format="%d-%m-%Y %H:%M", errors='coerce')
+dataset, time_index, ingest_report = load_data()
+if ingest_report.get('quarantined'):
+    st.sidebar.warning(f"⚠ {ingest_report['quarantined']:,} malformed rows (e.g. unparseable dates) were left out; "
+                       f"see {ingest_report['quarantine_path']}.")
 
 # Sidebar - Date and Country Selection
 st.sidebar.header("📅 Select Date Range and Country")
-start_date = st.sidebar.date_input("Start Date", df["InvoiceDate"].min().date())
-end_date = st.sidebar.date_input("End Date", df["InvoiceDate"].max().date())
+start_date = st.sidebar.date_input("Start Date", time_index.min_date.date())
+end_date = st.sidebar.date_input("End Date", time_index.max_date.date())
 
 # Country Selection Dropdown
-country_list = df['Country'].dropna().unique().tolist()
+country_list = time_index.countries
 selected_country = st.sidebar.selectbox("Select Country", ["All"] + country_list)
 
-# Filter Data by Date Range and Country
-df_filtered = df[(df["InvoiceDate"].dt.date >= start_date) & (df["InvoiceDate"].dt.date <= end_date)]
-if selected_country != "All":
-    df_filtered = df_filtered[df_filtered['Country'] == selected_country]
+# Filter Data by Date Range and Country (binary search on the sorted dates, no full-frame masks)
+df_filtered = time_index.select(start_date, end_date, None if selected_country == "All" else selected_country)
 
 # KPI Metrics
-df_filtered['Revenue'] = df_filtered['UnitPrice'] * df_filtered['Quantity']
 total_revenue = df_filtered['Revenue'].sum()
+# Counted exactly: the churn rate below is a difference against the exact total, which an estimate's error swamps
 new_customers = df_filtered['CustomerID'].nunique()
 avg_order_value = df_filtered['Revenue'].mean()
 
 # Corrected Churn Rate Calculation
-total_customers = df['CustomerID'].nunique()
+total_customers = len(dataset.customer_facts)
 churn_rate = round(((total_customers - new_customers) / total_customers) * 100, 1) if total_customers > 0 else 0
 
 # Header
@@ -62,13 +72,13 @@ with tabs[0]:
     col4.metric("📉 Churn Rate", f"{churn_rate}%")
 
     # Revenue Overview Bar Chart
-    category_revenue = df_filtered.groupby('Category')['Revenue'].sum().reset_index()
+    category_revenue = df_filtered.groupby('Category', observed=True)['Revenue'].sum().reset_index()
     revenue_chart = px.bar(category_revenue, x='Category', y='Revenue', title="Revenue Overview",
                            color_discrete_sequence=["#7ED321"], labels={"Revenue": "$ Revenue"})
     st.plotly_chart(revenue_chart, use_container_width=True)
 
     # Country Overview Bar Chart
-    country_revenue = df_filtered.groupby('Country')['Revenue'].sum().reset_index()
+    country_revenue = df_filtered.groupby('Country', observed=True)['Revenue'].sum().reset_index()
     country_chart = px.bar(country_revenue, x='Country', y='Revenue', title="Revenue by Country",
                            color_discrete_sequence=["#F39C12"], labels={"Revenue": "$ Revenue"})
     st.plotly_chart(country_chart, use_container_width=True)
@@ -82,26 +92,15 @@ with tabs[0]:
 with tabs[1]:
     today = pd.to_datetime("today")
 
-    # Calculate RFM Metrics
-    df_filtered['Recency'] = (today - df_filtered.groupby('CustomerID')['InvoiceDate'].transform('max')).dt.days
-    frequency = df_filtered.groupby('CustomerID')['InvoiceNo'].nunique()
-    monetary = df_filtered.groupby('CustomerID')['Revenue'].sum()
+    # Calculate RFM Metrics (one grouped pass over the filtered rows)
+    filtered_facts = build_customer_facts(df_filtered)
+    rfm_df = rfm_table(filtered_facts, today)[['CustomerID', 'Recency', 'Frequency', 'Monetary']]
 
-    rfm_df = pd.DataFrame({
-        'Recency': df_filtered.groupby('CustomerID')['Recency'].min(),
-        'Frequency': frequency,
-        'Monetary': monetary
-    }).reset_index()
-
-    # Dynamic Binning Function
+    # Dynamic Binning Function: exact quantile boundaries of the filtered customers (the cohort
+    # sketches cover the whole history, not a date range), repeated boundaries collapsing into fewer bins
     def dynamic_qcut(column, num_bins=4):
-        unique_values = column.nunique()
-        bins = min(num_bins, unique_values)
-        labels = list(range(1, bins + 1))
-        try:
-            return pd.qcut(column, bins, labels=labels, duplicates='drop')
-        except ValueError:
-            return pd.Series([1] * len(column), index=column.index)
+        boundaries = np.unique(column.quantile(np.arange(1, num_bins) / num_bins).to_numpy(dtype='float64'))
+        return pd.Series(quantile_scores(column, boundaries[~np.isnan(boundaries)]), index=column.index)
 
     # Apply binning
     rfm_df['R'] = dynamic_qcut(rfm_df['Recency'])
@@ -120,13 +119,12 @@ with tabs[1]:
 with tabs[2]:
     st.header("📉 Churn Prediction")
     churn_threshold = 90
-    df_filtered['Days_Since_Last_Purchase'] = (today - df_filtered['InvoiceDate']).dt.days
-    churned_customers = df_filtered[df_filtered['Days_Since_Last_Purchase'] > churn_threshold]['CustomerID'].nunique()
+    # Each customer's oldest purchase in range has the most days since purchase
+    churn_data = (today - filtered_facts['FirstPurchase']).dt.days.rename('Days_Since_Last_Purchase').reset_index()
+    churn_data['Churn'] = churn_data['Days_Since_Last_Purchase'] > churn_threshold
+    churned_customers = int(churn_data['Churn'].sum())
 
     st.metric("🚨 Churned Customers", churned_customers)
-
-    churn_data = df_filtered.groupby('CustomerID')['Days_Since_Last_Purchase'].max().reset_index()
-    churn_data['Churn'] = churn_data['Days_Since_Last_Purchase'] > churn_threshold
     churn_pie = px.pie(churn_data, names='Churn', title="Churn Distribution")
     st.plotly_chart(churn_pie, use_container_width=True)
 
@@ -134,16 +132,14 @@ with tabs[2]:
 with tabs[3]:
     st.header("👥 Customer Segmentation")
 
-    rfm_scaled = StandardScaler().fit_transform(rfm_df[['Recency', 'Frequency', 'Monetary']])
-    kmeans = KMeans(n_clusters=4, random_state=42, n_init=10)
-    rfm_df['Cluster'] = kmeans.fit_predict(rfm_scaled)
+    rfm_df['Cluster'], _ = cluster_customers(rfm_df, n_clusters=4, family="dashboard")
 
     cluster_distribution = rfm_df['Cluster'].value_counts().reset_index()
     cluster_distribution.columns = ['Cluster', 'Count']
     cluster_pie = px.pie(cluster_distribution, names='Cluster', values='Count', title="Customer Segmentation Clusters")
     st.plotly_chart(cluster_pie, use_container_width=True)
 
-    cluster_characteristics = rfm_df.groupby('Cluster').mean().reset_index()
+    cluster_characteristics = rfm_df.groupby('Cluster')[['Recency', 'Frequency', 'Monetary']].mean().reset_index()
     st.subheader("📊 Cluster Characteristics")
     st.table(cluster_characteristics)
 
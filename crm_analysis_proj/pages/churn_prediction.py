@@ -1,75 +1,132 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+from utils.churn import DEFAULT_CHURN_THRESHOLD, monthly_churn
+from utils.churn_model import RISK_LEVELS, churn_features, churn_model, score_churn
+from utils.dataset import month_label
+from utils.page_cache import cached_page, load_figure
+from utils.rfm import churn_flags
+from utils.tables import PagedTable, show_paged_table
+from utils.visuals import downsample
+
+def compute(dataset, churn_threshold=DEFAULT_CHURN_THRESHOLD, compare_thresholds=()):
+    """Monthly churn rates, modelled churn risk and the at-risk customers, without rendering.
+
+    The churn model learns from the customers' behaviour churn_threshold
+    days before the latest purchase whether they went on to buy again
+    within that many days, and scores every customer's current behaviour in
+    one batch. The at-risk customers are those with a risk level and those
+    already past the threshold, whatever their score; without enough history
+    to learn from, only the latter, with no risk scores.
+    """
+    reference_date = dataset.reference_date
+    facts = dataset.customer_facts
+    customer_last_purchase = facts['LastPurchase'].rename('InvoiceDate').reset_index()
+    customer_last_purchase['DaysSinceLastPurchase'] = (reference_date - customer_last_purchase['InvoiceDate']).dt.days
+    customer_last_purchase['Churned'] = churn_flags(customer_last_purchase['DaysSinceLastPurchase'], churn_threshold)
 
-def show(df):
-    st.title("📉 Churn Analysis")
-
-    if df is None or df.empty:
-        st.warning("⚠ No data available.")
-        return
-
-    required_columns = ['CustomerID', 'InvoiceDate', 'Quantity', 'UnitPrice', 'CustomerName']
-    missing_columns = [col for col in required_columns if col not in df.columns]
-
-    if missing_columns:
-        st.error(f"🚨 Missing columns: {missing_columns}. Please check the dataset.")
-        return
-
-    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
-    df['InvoiceMonth'] = df['InvoiceDate'].dt.to_period('M').astype(str)
-    df['Revenue'] = df['UnitPrice'] * df['Quantity']
-
-    reference_date = df['InvoiceDate'].max()
-    churn_threshold = 90
+    thresholds = [churn_threshold] + [t for t in compare_thresholds if t != churn_threshold]
+    churn_rates = monthly_churn(facts, dataset.customer_months, reference_date, thresholds)
+    churn_per_month = churn_rates.rename(columns=lambda t: f"{t} days").reset_index(drop=True)
+    churn_per_month.insert(0, 'InvoiceMonth', month_label(churn_rates.index).to_numpy())
+    churn_per_month = churn_per_month.melt(id_vars='InvoiceMonth', var_name='Threshold', value_name='Churned')
 
-    customer_last_purchase = df.groupby('CustomerID')['InvoiceDate'].max().reset_index()
-    customer_last_purchase['DaysSinceLastPurchase'] = (reference_date - customer_last_purchase['InvoiceDate']).dt.days
-    customer_last_purchase['Churned'] = customer_last_purchase['DaysSinceLastPurchase'].apply(lambda x: 1 if x > churn_threshold else 0)
+    customers = customer_last_purchase.assign(
+        CustomerName=facts['CustomerName'].to_numpy(),
+        LifetimeValue=facts['Revenue'].to_numpy()
+    )
+    columns = ['CustomerID', 'CustomerName', 'InvoiceDate', 'DaysSinceLastPurchase', 'LifetimeValue']
+    levels = [level for _, level in RISK_LEVELS]
+    days, categories = dataset.customer_days, dataset.customer_categories
+    model = churn_model(days, categories, reference_date, horizon=churn_threshold)
+
+    if model is not None:
+        risk = score_churn(model, churn_features(days, categories, reference_date))
+        customers = customers.join(risk, on='CustomerID')
+        at_risk = customers.loc[customers['RiskLevel'].notna() | (customers['Churned'] == 1), columns + ['ChurnRisk', 'RiskLevel', 'RiskFactor']]
+        sort_by = 'ChurnRisk'
+        risk_factors = pd.crosstab(at_risk['RiskFactor'], at_risk['RiskLevel']).reindex(columns=levels, fill_value=0)
+        model = {name: model[name] for name in ['auc', 'customers', 'churned']}
+    else:
+        at_risk = customers.loc[customers['Churned'] == 1, columns]
+        sort_by = 'DaysSinceLastPurchase'
+        risk_factors = pd.DataFrame(columns=levels, dtype='int64')
+    risk_factors = risk_factors.rename_axis(index='Risk Factor', columns=None).reset_index()
+    risk_factors['Customers'] = risk_factors[levels].sum(axis=1)
+
+    at_risk_customers = PagedTable(
+        at_risk, search_columns=['CustomerName', 'CustomerID'], sort_by=sort_by, ascending=False
+    )
 
-    churn_per_month = customer_last_purchase.merge(df[['CustomerID', 'InvoiceMonth']], on='CustomerID', how='left')
-    churn_per_month = churn_per_month.groupby('InvoiceMonth')['Churned'].mean().reset_index()
-    churn_per_month['Churned'] *= 100
+    return {'thresholds': thresholds, 'churn_per_month': churn_per_month, 'at_risk_customers': at_risk_customers,
+            'risk_factors': risk_factors.sort_values('Customers', ascending=False, ignore_index=True), 'model': model}
 
+def figures(results):
+    """Builds the churn charts from compute() results."""
+    # Long histories are downsampled per threshold line (LTTB keeps the peaks)
     fig_churn_rate = px.line(
-        churn_per_month, x="InvoiceMonth", y="Churned", markers=True,
+        downsample(results['churn_per_month'], 'InvoiceMonth', 'Churned', by='Threshold'), x="InvoiceMonth", y="Churned", markers=True,
+        color="Threshold" if len(results['thresholds']) > 1 else None,
         title="📉 Monthly Churn Rate (%)",
         labels={"InvoiceMonth": "Month", "Churned": "Churn Percentage"}
     )
-    st.plotly_chart(fig_churn_rate, use_container_width=True)
-
-    churn_reasons = pd.DataFrame({
-        "Reason": ["Price", "Poor Experience", "Competitor", "Other"],
-        "Count": [30, 25, 20, 25]
-    })
 
+    # Each at-risk customer counts once, under the factor that raises their risk most
     fig_churn_pie = px.pie(
-        churn_reasons, names="Reason", values="Count",
-        title="🔍 Reasons for Churn",
-        color_discrete_map={"Price": "red", "Poor Experience": "orange", "Competitor": "blue", "Other": "gray"}
+        results['risk_factors'], names="Risk Factor", values="Customers",
+        title="🔍 Main Churn Risk Factors",
     )
-    st.plotly_chart(fig_churn_pie, use_container_width=True)
-
-    risk_factors = pd.DataFrame({
-        "Risk Factor": ["High Purchase Drop", "Frequent Returns", "Low Engagement"],
-        "Mild": [15, 10, 20],
-        "Moderate": [25, 15, 30],
-        "Severe": [10, 20, 15]
-    })
 
     fig_risk_factors = px.bar(
-        risk_factors, x="Risk Factor", y=["Mild", "Moderate", "Severe"],
+        results['risk_factors'], x="Risk Factor", y=[level for _, level in RISK_LEVELS],
         title="⚠ Churn Risk Factors",
         labels={"value": "Customer Count", "variable": "Risk Level"},
         barmode="stack"
     )
-    st.plotly_chart(fig_risk_factors, use_container_width=True)
 
-    at_risk_customers = customer_last_purchase.merge(df[['CustomerID', 'CustomerName']], on='CustomerID', how='left')
-    at_risk_customers = at_risk_customers[at_risk_customers['Churned'] == 1].nlargest(5, 'DaysSinceLastPurchase')
+    return {'churn_rate': fig_churn_rate, 'churn_pie': fig_churn_pie, 'risk_factors': fig_risk_factors}
+
+def precompute(dataset):
+    """Fills the page cache for the page's default view, so the first visit is served from it."""
+    params = {'churn_threshold': DEFAULT_CHURN_THRESHOLD, 'compare_thresholds': []}
+    return cached_page(dataset, "churn_prediction", params, compute, figures)
+
+def show(dataset):
+    st.title("📉 Churn Analysis")
+
+    if dataset is None or dataset.empty:
+        st.warning("⚠ No data available.")
+        return
+
+    required_columns = ['CustomerID', 'InvoiceDate', 'Quantity', 'UnitPrice', 'CustomerName']
+    missing_columns = [col for col in required_columns if col not in dataset.columns]
+
+    if missing_columns:
+        st.error(f"🚨 Missing columns: {missing_columns}. Please check the dataset.")
+        return
 
-    at_risk_customers['LifetimeValue'] = df.groupby('CustomerID')['Revenue'].sum().reset_index(drop=True)
-    at_risk_customers['RiskFactors'] = ["High Purchase Drop", "Frequent Returns", "Low Engagement", "Competitor", "Poor Experience"]
+    churn_threshold = st.slider("Churn threshold (days since last purchase)", 30, 365, DEFAULT_CHURN_THRESHOLD, step=15)
+    compare_thresholds = st.multiselect("Compare with other thresholds (days)", [30, 60, 120, 180, 365], default=[])
+
+    params = {'churn_threshold': churn_threshold, 'compare_thresholds': compare_thresholds}
+    entry = cached_page(dataset, "churn_prediction", params, compute, figures)
+    results = entry['tables']
+
+    st.plotly_chart(load_figure(entry, 'churn_rate'), use_container_width=True)
+
+    model = results['model']
+    if model is None:
+        st.info(f"ℹ Not enough purchase history before the last {churn_threshold} days to learn churn risk from; "
+                f"listing the customers past the threshold instead.")
+    else:
+        st.caption(f"Churn risk is the modelled chance of no purchase in the next {churn_threshold} days, learned "
+                   f"from how {model['customers']:,} customers behaved {churn_threshold} days ago "
+                   f"({model['churned']:,} didn't buy again; AUC {model['auc']:.2f}).")
+        if results['risk_factors'].empty:
+            st.success(f"✅ No customer's churn risk reaches {RISK_LEVELS[0][0]:.0%}.")
+        else:
+            st.plotly_chart(load_figure(entry, 'churn_pie'), use_container_width=True)
+            st.plotly_chart(load_figure(entry, 'risk_factors'), use_container_width=True)
 
     st.subheader("⚠ Customers at Risk of Churning")
-    st.dataframe(at_risk_customers[['CustomerID', 'CustomerName', 'InvoiceDate', 'LifetimeValue', 'RiskFactors']])
+    show_paged_table(results['at_risk_customers'], key="churn-at-risk", page_size=10)
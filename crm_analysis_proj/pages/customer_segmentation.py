@@ -1,14 +1,46 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+from utils.clustering import cluster_customers
+from utils.page_cache import cached_page, load_figure
+from utils.rfm import rfm_table
+from utils.tables import PagedTable, show_paged_table
+
+def compute(dataset, n_clusters=4):
+    """Clustered customer features and segment counts, without rendering."""
+    # Recency / Frequency (distinct invoices) / Monetary (revenue) from the shared fact table
+    customer_features = rfm_table(dataset.customer_facts, dataset.reference_date)
+    customer_features = customer_features[['CustomerID', 'Recency', 'Frequency', 'Monetary']]
+    customer_features = customer_features.dropna()
+
+    # Fit persisted per feature fingerprint; segments are named from centroid profiles, stable across refits
+    clusters, fit = cluster_customers(customer_features, n_clusters=n_clusters, family="segmentation")
+    customer_features['Segment'] = fit['names'][clusters]
+
+    segment_counts = customer_features['Segment'].value_counts().reset_index()
+    segment_counts.columns = ['Segment', 'Count']
+
+    customer_table = PagedTable(customer_features, search_columns=['CustomerID', 'Segment'], sort_by='CustomerID')
+
+    return {'customer_features': customer_features, 'segment_counts': segment_counts, 'customer_table': customer_table}
 
-def show(df):
+def figures(results):
+    """Builds the segmentation pie chart from compute() results."""
+    fig_segment_pie = px.pie(
+        results['segment_counts'], names="Segment", values="Count",
+        title="🧩 Customer Segmentation",
+        color_discrete_sequence=px.colors.qualitative.Set2
+    )
+    return {'segment_pie': fig_segment_pie}
+
+def precompute(dataset):
+    """Fills the page cache for the page's default view, so the first visit is served from it."""
+    return cached_page(dataset, "customer_segmentation", {'n_clusters': 4}, compute, figures)
+
+def show(dataset):
     st.title("🧑‍🤝‍🧑 Customer Segmentation")
 
     # ✅ **Step 1: Data Preprocessing**
-    if df is None or df.empty:
+    if dataset is None or dataset.empty:
 
         
         
@@ -16,59 +48,21 @@ def show(df):
         return
 
     required_columns = ['CustomerID', 'InvoiceDate', 'Quantity', 'UnitPrice']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in required_columns if col not in dataset.columns]
 
     if missing_columns:
         st.error(f"🚨 Missing columns: {missing_columns}. Please check the dataset.")
         return
 
-    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
-    df['Revenue'] = df['UnitPrice'] * df['Quantity']
-
-    # ✅ **Step 2: Feature Engineering**
-    reference_date = df['InvoiceDate'].max()
-
-    customer_features = df.groupby('CustomerID').agg({
-        'InvoiceDate': lambda x: (reference_date - x.max()).days,  # Recency
-        'InvoiceNo': 'nunique',  # Frequency
-        'Revenue': 'sum'  # Monetary Value
-    }).reset_index()
-
-    customer_features.columns = ['CustomerID', 'Recency', 'Frequency', 'Monetary']
-
-    # Handle missing values
-    customer_features = customer_features.dropna()
-
-    # ✅ **Step 3: Data Scaling**
-    scaler = StandardScaler()
-    customer_features_scaled = scaler.fit_transform(customer_features[['Recency', 'Frequency', 'Monetary']])
-
-    # ✅ **Step 4: K-Means Clustering**
-    kmeans = KMeans(n_clusters=4, random_state=42)
-    customer_features['Segment'] = kmeans.fit_predict(customer_features_scaled)
-
-    # ✅ **Step 5: Assigning Segment Labels**
-    segment_map = {
-        0: "Loyal Customers",
-        1: "New Customers",
-        2: "Hibernating",
-        3: "High Value"
-    }
-    customer_features['Segment'] = customer_features['Segment'].map(segment_map)
+    # ✅ **Steps 2-5: Feature Engineering, Scaling, K-Means Clustering, Segment Labels**
+    entry = cached_page(dataset, "customer_segmentation", {'n_clusters': 4}, compute, figures)
+    customer_features = entry['tables']['customer_features']
 
     # ✅ **Step 6: Customer Segmentation Pie Chart**
-    segment_counts = customer_features['Segment'].value_counts().reset_index()
-    segment_counts.columns = ['Segment', 'Count']
-
-    fig_segment_pie = px.pie(
-        segment_counts, names="Segment", values="Count",
-        title="🧩 Customer Segmentation",
-        color_discrete_sequence=px.colors.qualitative.Set2
-    )
-    st.plotly_chart(fig_segment_pie, use_container_width=True)
+    st.plotly_chart(load_figure(entry, 'segment_pie'), use_container_width=True)
 
     # ✅ **Step 7: Display Segmented Customers Table**
     st.subheader("📋 Customer Segments Data")
-    st.dataframe(customer_features)
+    show_paged_table(entry['tables']['customer_table'], key="segment-customers")
 
     return customer_features
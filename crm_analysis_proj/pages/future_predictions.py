@@ -1,93 +1,172 @@
+from functools import partial
 import pandas as pd
 import streamlit as st
 import plotly.express as px
-from statsmodels.tsa.arima.model import ARIMA
+from utils.dataset import MISSING_MONTH, month_start
+from utils.forecasting import DEFAULT_ORDER, FIT_WAIT_SECONDS, get_forecast
+from utils.page_cache import cached_page, load_figure
+from utils.visuals import downsample, top_n
 
-def show(df):
-    st.title(" Future Predictions")
+def forecast_status(result, status):
+    """Show where a forecast came from; returns False when there is nothing to plot yet."""
+    if status == "pending":
+        st.info("⏳ Fitting the forecast in the background. Rerun the page to see it.")
+        return False
+    if result['error'] is not None:
+        st.warning(f"⚠ Forecast could not be fitted: {result['error']}")
+        return False
+    if status == "stale":
+        st.info("⏳ Showing the last forecast while the updated one is fitted in the background.")
+    st.caption(f"ARIMA{tuple(result['order'])} on {result['observations']} points, fitted in {result['fit_seconds']:.2f}s.")
+    return True
 
-    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'])
-    revenue_time_series = df.groupby(df['InvoiceDate'].dt.to_period("M")).agg({'UnitPrice': 'sum'}).reset_index()
-    revenue_time_series.rename(columns={'UnitPrice': 'Revenue'}, inplace=True)
-    revenue_time_series['InvoiceDate'] = revenue_time_series['InvoiceDate'].astype(str) + '-01'
-    revenue_time_series['InvoiceDate'] = pd.to_datetime(revenue_time_series['InvoiceDate'])
-# ARIMA MODEL FOR TIME SERIES FORECASTING 
-    best_order = (2, 1, 2)
-    arima_model = ARIMA(revenue_time_series['Revenue'], order=best_order)
-    fitted_arima = arima_model.fit()
-    forecast = fitted_arima.forecast(steps=6)
-
-    future_dates = pd.date_range(start=revenue_time_series['InvoiceDate'].iloc[-1], periods=7, freq='M')[1:]
-    forecast_df = pd.DataFrame({'Date': future_dates, 'Predicted Revenue': forecast})
-    forecast_df['Date'] = pd.to_datetime(forecast_df['Date'])
+def plottable(forecast):
+    """True when a (result, status) forecast pair has values to plot."""
+    result, status = forecast
+    return status != "pending" and result['error'] is None
 
-    st.subheader("📈 Revenue Forecast")
-    fig_forecast = px.line(revenue_time_series, x="InvoiceDate", y="Revenue", markers=True, 
-                           title="Revenue Forecasting (ARIMA)", labels={"InvoiceDate": "Date", "Revenue": "Revenue ($)"})
-    fig_forecast.add_scatter(x=forecast_df['Date'], y=forecast_df['Predicted Revenue'], 
-                             mode='lines+markers', name="Forecasted Revenue (ARIMA)")
-    st.plotly_chart(fig_forecast, use_container_width=True)
+def compute(dataset, wait=FIT_WAIT_SECONDS):
+    """Forecasts and ranking tables behind the page, without rendering.
 
-    st.subheader("📈 Projected Annual Revenue & Profit")
-    projected_revenue = forecast_df['Predicted Revenue'].sum()
-    profit_margin = 0.30
-    projected_profit = projected_revenue * profit_margin
+    Forecasts are (result, status) pairs from get_forecast; wait=None blocks
+    until a new fit finishes instead of falling back to a stale result.
+    """
+    monthly_unit_price = dataset.monthly_totals['UnitPriceTotal'].drop(MISSING_MONTH, errors='ignore')
+    revenue_time_series = pd.DataFrame({
+        'InvoiceDate': month_start(monthly_unit_price.index),
+        'Revenue': monthly_unit_price.to_numpy()
+    })
+    # ARIMA MODEL FOR TIME SERIES FORECASTING (cached per input series, fitted in a worker process)
+    revenue_forecast = get_forecast("revenue", revenue_time_series['Revenue'], DEFAULT_ORDER, steps=6, wait=wait)
 
-    col1, col2 = st.columns(2)
-    col1.metric(label="Estimated Annual Revenue", value=f"${projected_revenue:,.2f}")
-    col2.metric(label="Estimated Annual Profit", value=f"${projected_profit:,.2f}")
+    # Rankings come from the cube, so they never touch the line items
+    category_quantity = dataset.cube.rollup('Category').set_index('Category')['Quantity']
+    top_categories = category_quantity.sort_values(ascending=False).head(5).reset_index()
 
-    st.subheader("📦 Top Demanding Product Categories")
-    top_categories = df.groupby("Category")["Quantity"].sum().sort_values(ascending=False).head(5).reset_index()
-    fig_top_products = px.bar(top_categories, x="Quantity", y="Category", orientation='h', text="Quantity",
+    top_category_by_country = dataset.cube.rollup(['Country', 'Category'])[['Country', 'Category', 'Quantity']]
+    top_category_by_country = top_category_by_country.loc[top_category_by_country.groupby("Country", observed=True)["Quantity"].idxmax()]
+
+    inventory_turnover = dataset.product_totals[['Quantity']].reset_index()
+    inventory_turnover['Turnover Rate'] = inventory_turnover['Quantity'] / inventory_turnover['Quantity'].max() * 5  
+#   if the inventory rate is less than 1 then the stock is not selling or there is overstocking issues 
+#   if the inventory rate is in between 2 - 4 then there is balenced inventory system and the products are selling reasonable pace 
+#   if the inventory rate is 5 then the stock sales are in strong demand 
+
+    # Monthly revenue per active customer: a real time series, unlike the per-customer Monetary column
+    active_customers = dataset.customer_months.groupby(level='MonthKey').size()
+    monthly_revenue = dataset.monthly_totals['Revenue']
+    revenue_per_customer = (monthly_revenue / active_customers).drop(MISSING_MONTH, errors='ignore').dropna()
+    clv_forecast = get_forecast("revenue_per_customer", revenue_per_customer, DEFAULT_ORDER, steps=6, wait=wait)
+
+    return {
+        'revenue_time_series': revenue_time_series,
+        'revenue_forecast': revenue_forecast,
+        'top_categories': top_categories,
+        'top_category_by_country': top_category_by_country,
+        'inventory_turnover': inventory_turnover,
+        'revenue_per_customer': revenue_per_customer,
+        'clv_forecast': clv_forecast,
+    }
+
+def figures(results):
+    """Builds the page's charts from compute() results; forecasts that can't be plotted yet are None."""
+    fig_forecast = None
+    if plottable(results['revenue_forecast']):
+        revenue_time_series = results['revenue_time_series']
+        revenue_result, _ = results['revenue_forecast']
+        future_dates = pd.date_range(start=revenue_time_series['InvoiceDate'].iloc[-1], periods=7, freq='M')[1:]
+        forecast_df = pd.DataFrame({'Date': future_dates, 'Predicted Revenue': revenue_result['forecast']})
+
+        fig_forecast = px.line(downsample(revenue_time_series, "InvoiceDate", "Revenue"), x="InvoiceDate", y="Revenue", markers=True, 
+                               title="Revenue Forecasting (ARIMA)", labels={"InvoiceDate": "Date", "Revenue": "Revenue ($)"})
+        fig_forecast.add_scatter(x=forecast_df['Date'], y=forecast_df['Predicted Revenue'], 
+                                 mode='lines+markers', name="Forecasted Revenue (ARIMA)")
+
+    fig_top_products = px.bar(results['top_categories'], x="Quantity", y="Category", orientation='h', text="Quantity",
                               title="🔥 Top Selling Product Categories",
                               labels={"Quantity": "Total Quantity Sold", "Category": "Product Category"},
                               color="Quantity", color_continuous_scale="blues")
     fig_top_products.update_traces(texttemplate='%{text}', textposition='outside')
-    st.plotly_chart(fig_top_products, use_container_width=True)
 
-    st.subheader("🌍 Top Demanding Category Per Country")
-    top_category_by_country = df.groupby(["Country", "Category"])["Quantity"].sum().reset_index()
-    top_category_by_country = top_category_by_country.loc[top_category_by_country.groupby("Country")["Quantity"].idxmax()]
-    fig_category_country = px.bar(top_category_by_country, x="Country", y="Quantity", color="Category", text="Category",
+    fig_category_country = px.bar(results['top_category_by_country'], x="Country", y="Quantity", color="Category", text="Category",
                                   title="Top Selling Category in Each Country",
                                   labels={"Quantity": "Total Quantity Sold", "Country": "Country"},
                                   barmode="group", color_discrete_sequence=px.colors.qualitative.Set1)
     fig_category_country.update_traces(texttemplate='%{text}', textposition='outside')
-    st.plotly_chart(fig_category_country, use_container_width=True)
-
-    st.subheader("📊 Inventory Turnover Rate")
-    inventory_turnover = df.groupby(["StockCode", "Description"]).agg({'Quantity': 'sum'}).reset_index()
-    inventory_turnover['Turnover Rate'] = inventory_turnover['Quantity'] / inventory_turnover['Quantity'].max() * 5  
-#   if the inventory rate is less than 1 then the stock is not selling or there is overstocking issues 
-#   if the inventory rate is in between 2 - 4 then there is balenced inventory system and the products are selling reasonable pace 
-#   if the inventory rate is 5 then the stock sales are in strong demand 
 
-    fig_inventory_turnover = px.bar(inventory_turnover.head(10), x="Description", y="Turnover Rate",
+    # Top 10 products by quantity; the rest is one "Other" bar at their mean turnover
+    inventory_turnover = top_n(results['inventory_turnover'][['Description', 'Quantity', 'Turnover Rate']], 'Description', 'Quantity',
+                               n=10, aggregations={'Quantity': 'sum', 'Turnover Rate': 'mean'})
+    fig_inventory_turnover = px.bar(inventory_turnover, x="Description", y="Turnover Rate",
                                     title="Inventory Turnover Rate",
                                     labels={"Description": "Product Name", "Turnover Rate": "Turnover Rate"},
                                     text="Turnover Rate", color="Turnover Rate",
                                     color_continuous_scale="viridis")
     fig_inventory_turnover.update_traces(texttemplate='%{text:.2f}', textposition='outside')
-    st.plotly_chart(fig_inventory_turnover, use_container_width=True)
+
+    fig_clv_forecast = None
+    if plottable(results['clv_forecast']):
+        revenue_per_customer = results['revenue_per_customer']
+        clv_result, _ = results['clv_forecast']
+        clv_dates = pd.date_range(start=month_start(revenue_per_customer.index[-1:])[0], periods=7, freq='M')[1:]
+        clv_forecast_df = pd.DataFrame({'Date': clv_dates, 'Predicted CLV': clv_result['forecast']})
+
+        fig_clv_forecast = px.line(clv_forecast_df, x="Date", y="Predicted CLV", markers=True,
+                                   title="Customer Lifetime Value (CLV) Forecast (ARIMA)",
+                                   labels={"Date": "Month", "Predicted CLV": "Projected Revenue per Active Customer ($)"})
+
+    return {
+        'forecast': fig_forecast,
+        'top_products': fig_top_products,
+        'category_country': fig_category_country,
+        'inventory_turnover': fig_inventory_turnover,
+        'clv_forecast': fig_clv_forecast,
+    }
+
+def forecasts_ready(results):
+    """Only cache the page once both forecasts are final, so a stale or pending one is refreshed."""
+    return results['revenue_forecast'][1] == "ready" and results['clv_forecast'][1] == "ready"
+
+def show_revenue_forecast(entry):
+    """Revenue forecast chart and projected annual revenue/profit."""
+    st.subheader("📈 Revenue Forecast")
+    revenue_result, revenue_status = entry['tables']['revenue_forecast']
+    if not forecast_status(revenue_result, revenue_status):
+        return
+
+    st.plotly_chart(load_figure(entry, 'forecast'), use_container_width=True)
+
+    st.subheader("📈 Projected Annual Revenue & Profit")
+    projected_revenue = sum(revenue_result['forecast'])
+    profit_margin = 0.30
+    projected_profit = projected_revenue * profit_margin
+
+    col1, col2 = st.columns(2)
+    col1.metric(label="Estimated Annual Revenue", value=f"${projected_revenue:,.2f}")
+    col2.metric(label="Estimated Annual Profit", value=f"${projected_profit:,.2f}")
+
+def precompute(dataset):
+    """Fills the page cache in the background, waiting for the forecast fits instead of showing stale ones."""
+    return cached_page(dataset, "future_predictions", {}, partial(compute, wait=None), figures, complete=forecasts_ready)
+
+def show(dataset):
+    st.title(" Future Predictions")
+
+    entry = cached_page(dataset, "future_predictions", {}, compute, figures, complete=forecasts_ready)
+    show_revenue_forecast(entry)
+
+    st.subheader("📦 Top Demanding Product Categories")
+    st.plotly_chart(load_figure(entry, 'top_products'), use_container_width=True)
+
+    st.subheader("🌍 Top Demanding Category Per Country")
+    st.plotly_chart(load_figure(entry, 'category_country'), use_container_width=True)
+
+    st.subheader("📊 Inventory Turnover Rate")
+    st.plotly_chart(load_figure(entry, 'inventory_turnover'), use_container_width=True)
 
     st.subheader("🎯 Customer Lifetime Value (CLV) Forecast")
-    customer_lifetime_value = df.groupby("CustomerID").agg({
-        "InvoiceDate": "max",
-        "InvoiceNo": "count",
-        "UnitPrice": "sum"
-    }).reset_index()
-    customer_lifetime_value.rename(columns={"InvoiceNo": "Frequency", "UnitPrice": "Monetary"}, inplace=True)
-
-    clv_best_order = (2, 1, 2)
-    clv_arima_model = ARIMA(customer_lifetime_value['Monetary'], order=clv_best_order)
-    fitted_clv_arima = clv_arima_model.fit()
-    clv_forecast = fitted_clv_arima.forecast(steps=6)
-
-    clv_dates = pd.date_range(start=pd.to_datetime("today"), periods=6, freq='M')
-    clv_forecast_df = pd.DataFrame({'Date': clv_dates, 'Predicted CLV': clv_forecast})
-
-    fig_clv_forecast = px.line(clv_forecast_df, x="Date", y="Predicted CLV", markers=True,
-                               title="Customer Lifetime Value (CLV) Forecast (ARIMA)",
-                               labels={"Date": "Month", "Predicted CLV": "Projected CLV ($)"})
-    st.plotly_chart(fig_clv_forecast, use_container_width=True)
+    clv_result, clv_status = entry['tables']['clv_forecast']
+    if not forecast_status(clv_result, clv_status):
+        return
+
+    st.plotly_chart(load_figure(entry, 'clv_forecast'), use_container_width=True)
@@ -1,121 +1,176 @@
 import streamlit as st
 import plotly.express as px
-import pandas as pd
+from utils.cube import DISTINCT_COLUMNS
+from utils.dataset import MISSING_MONTH, month_label
+from utils.page_cache import cached_page, load_figure
+from utils.sketches import standard_error
+from utils.visuals import top_n
+
+def compute(dataset, exact=False):
+    """Tables behind the overview KPIs and charts, without rendering.
+
+    Every value is answered from the pre-aggregated cube, not the line items;
+    on large data distinct customers and orders are sketch estimates unless
+    exact is set ('estimated' says which). Charts whose dimensions are
+    missing from the data come back as None.
+    """
+    cube = dataset.cube
+    totals = cube.totals(exact=exact)
+    results = {
+        'totals': totals,
+        'estimated': any(cube.estimates(column, exact=exact) for column in DISTINCT_COLUMNS.values()),
+        'avg_order_value': totals['Revenue'] / totals['Lines'] if totals['Lines'] else float('nan'),
+        'category_revenue': None,
+        'monthly_category_summary': None,
+        'country_summary': cube.rollup('Country')[['Country', 'Revenue', 'Profit']],
+        'manufacturer_category_summary': None,
+    }
+
+    if 'Category' in cube.dimensions:
+        results['category_revenue'] = cube.rollup('Category')[['Category', 'Revenue']]
+
+        monthly_category_summary = cube.rollup(['MonthKey', 'Category'])[['MonthKey', 'Category', 'Revenue', 'Profit']]
+        monthly_category_summary = monthly_category_summary[monthly_category_summary['MonthKey'] != MISSING_MONTH]
+        monthly_category_summary.insert(0, 'Month', month_label(monthly_category_summary['MonthKey']).to_numpy())
+        results['monthly_category_summary'] = monthly_category_summary
+
+    if 'Manufacturer' in cube.dimensions and 'Category' in cube.dimensions:
+        results['manufacturer_category_summary'] = cube.rollup(['Manufacturer', 'Category'])[['Manufacturer', 'Category', 'Quantity']]
+
+    return results
+
+def figures(results):
+    """Builds the overview charts from compute() results; charts without data are None."""
+    revenue_chart = None
+    if results['category_revenue'] is not None:
+        revenue_chart = px.bar(
+            results['category_revenue'],
+            x='Category',
+            y='Revenue',
+            title="Revenue by Category",
+            color_discrete_sequence=["#7ED321"]
+        )
+
+    fig_monthly_category = fig_monthly_profit = None
+    monthly_category_summary = results['monthly_category_summary']
+    if monthly_category_summary is not None and not monthly_category_summary.empty:
+        fig_monthly_category = px.bar(
+            monthly_category_summary,
+            x='Month',
+            y='Revenue',
+            color='Category',
+            title="📆 Monthly Revenue by Category",
+            labels={'Revenue': 'Amount ($)'},
+            barmode='stack'
+        )
+
+        fig_monthly_profit = px.bar(
+            monthly_category_summary,
+            x='Month',
+            y='Profit',
+            color='Category',
+            title="📆 Monthly Profit by Category",
+            labels={'Profit': 'Amount ($)'},
+            barmode='stack'
+        )
+
+    fig_country = None
+    if not results['country_summary'].empty:
+        # Beyond the top countries by revenue the tail is one "Other" bar
+        fig_country = px.bar(
+            top_n(results['country_summary'], 'Country', 'Revenue'),
+            x='Country',
+            y=['Revenue', 'Profit'],
+            title="🌍 Revenue & Profit by Country",
+            labels={'value': 'Amount ($)', 'variable': 'Metric'},
+            barmode='group',
+            color_discrete_map={'Revenue': '#e74c3c', 'Profit': '#f1c40f'}
+        )
+
+    # New graph: Total products by manufacturer and category (color by category instead of country)
+    fig_manufacturer_category = None
+    manufacturer_category_summary = results['manufacturer_category_summary']
+    if manufacturer_category_summary is not None and not manufacturer_category_summary.empty:
+        fig_manufacturer_category = px.bar(
+            top_n(manufacturer_category_summary, 'Manufacturer', 'Quantity', by=['Category']),
+            x='Manufacturer',
+            y='Quantity',
+            color='Category',  # Legend now shows Category instead of Country
+            title="🏭 Total Products by Manufacturer and Category",
+            labels={'Quantity': 'Total Products'},
+            barmode='stack'
+        )
+
+        # Optional: rotate x-axis labels for readability
+        fig_manufacturer_category.update_layout(xaxis_tickangle=45)
+
+    return {
+        'revenue_chart': revenue_chart,
+        'monthly_category': fig_monthly_category,
+        'monthly_profit': fig_monthly_profit,
+        'country': fig_country,
+        'manufacturer_category': fig_manufacturer_category,
+    }
 
-def show(df):
+def precompute(dataset):
+    """Fills the page cache for the page's default view, so the first visit is served from it."""
+    return cached_page(dataset, "overview", {'exact': False}, compute, figures)
+
+def show(dataset):
     st.title("📊 Overview - CRM Analysis")
 
-    if df is None or df.empty:
+    if dataset is None or dataset.empty:
         st.warning("⚠ No data available. Please upload a valid dataset.")
         return
 
     required_columns = ['CustomerID', 'UnitPrice', 'Quantity', 'InvoiceDate', 'Country']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in required_columns if col not in dataset.columns]
 
     if missing_columns:
         st.error(f"🚨 Missing columns: {missing_columns}. Please check the dataset.")
         return
 
-    try:
-        df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'])
-    except Exception as e:
-        st.error(f"Error converting InvoiceDate to datetime: {e}")
-        return
-
-    if 'Revenue' not in df.columns:
-        df['Revenue'] = df['UnitPrice'] * df['Quantity']
+    exact = st.checkbox("Exact distinct counts", value=False,
+                        help="On large data, counts customers and orders exactly instead of merging the HyperLogLog sketches.")
 
-    if 'Profit' not in df.columns:
-        df['Profit'] = df['Revenue'] * 0.3
+    # Tables and figure JSON are cached per dataset, so revisiting the page skips both steps
+    entry = cached_page(dataset, "overview", {'exact': exact}, compute, figures)
+    results = entry['tables']
+    totals = results['totals']
 
-    total_revenue = df['Revenue'].sum()
-    new_customers = df['CustomerID'].nunique()
-    avg_order_value = df['Revenue'].mean()
+    total_revenue = totals['Revenue']
+    new_customers = totals['Customers']
+    avg_order_value = results['avg_order_value']
+    count_help = f"Estimated; relative standard error {standard_error():.1%}." if results['estimated'] else None
 
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     col1.metric("💰 Total Revenue", f"${total_revenue:,.2f}")
-    col2.metric("🧑‍💼 New Customers", f"{new_customers}")
-    col3.metric("📦 Avg Order Value", f"${avg_order_value:.2f}")
+    col2.metric("🧑‍💼 New Customers", f"{new_customers:,}", help=count_help)
+    col3.metric("🧾 Orders", f"{totals['Orders']:,}" if 'Orders' in totals else "n/a", help=count_help)
+    col4.metric("📦 Avg Order Value", f"${avg_order_value:.2f}")
 
-    if 'Category' in df.columns:
-        category_revenue = df.groupby('Category')['Revenue'].sum().reset_index()
-        revenue_chart = px.bar(
-            category_revenue,
-            x='Category',
-            y='Revenue',
-            title="Revenue by Category",
-            color_discrete_sequence=["#7ED321"]
-        )
-        st.plotly_chart(revenue_chart, use_container_width=True)
+    if results['category_revenue'] is not None:
+        st.plotly_chart(load_figure(entry, 'revenue_chart'), use_container_width=True)
     else:
         st.warning("⚠ 'Category' column not found. Skipping Revenue by Category chart.")
 
-    if 'Category' in df.columns:
-        df['Month'] = df['InvoiceDate'].dt.strftime('%Y-%m')
-        monthly_category_summary = df.groupby(['Month', 'Category']).agg({'Revenue': 'sum', 'Profit': 'sum'}).reset_index()
-
-        if not monthly_category_summary.empty:
-            fig_monthly_category = px.bar(
-                monthly_category_summary,
-                x='Month',
-                y='Revenue',
-                color='Category',
-                title="📆 Monthly Revenue by Category",
-                labels={'Revenue': 'Amount ($)'},
-                barmode='stack'
-            )
-            st.plotly_chart(fig_monthly_category, use_container_width=True)
-
-            fig_monthly_profit = px.bar(
-                monthly_category_summary,
-                x='Month',
-                y='Profit',
-                color='Category',
-                title="📆 Monthly Profit by Category",
-                labels={'Profit': 'Amount ($)'},
-                barmode='stack'
-            )
-            st.plotly_chart(fig_monthly_profit, use_container_width=True)
+    if results['monthly_category_summary'] is not None:
+        if not results['monthly_category_summary'].empty:
+            st.plotly_chart(load_figure(entry, 'monthly_category'), use_container_width=True)
+            st.plotly_chart(load_figure(entry, 'monthly_profit'), use_container_width=True)
         else:
             st.warning("⚠ No data available for Monthly Revenue & Profit by Category.")
     else:
         st.warning("⚠ 'Category' column not found. Skipping Monthly Revenue & Profit by Category.")
 
-    country_summary = df.groupby('Country').agg({'Revenue': 'sum', 'Profit': 'sum'}).reset_index()
-
-    if not country_summary.empty:
-        fig_country = px.bar(
-            country_summary,
-            x='Country',
-            y=['Revenue', 'Profit'],
-            title="🌍 Revenue & Profit by Country",
-            labels={'value': 'Amount ($)', 'variable': 'Metric'},
-            barmode='group',
-            color_discrete_map={'Revenue': '#e74c3c', 'Profit': '#f1c40f'}
-        )
-        st.plotly_chart(fig_country, use_container_width=True)
+    if not results['country_summary'].empty:
+        st.plotly_chart(load_figure(entry, 'country'), use_container_width=True)
     else:
         st.warning("⚠ No data available for Revenue & Profit by Country.")
 
-    # New graph: Total products by manufacturer and category (color by category instead of country)
-    if 'Manufacturer' in df.columns and 'Category' in df.columns:
-        manufacturer_category_summary = df.groupby(['Manufacturer', 'Category']).agg({'Quantity': 'sum'}).reset_index()
-
-        if not manufacturer_category_summary.empty:
-            fig_manufacturer_category = px.bar(
-                manufacturer_category_summary,
-                x='Manufacturer',
-                y='Quantity',
-                color='Category',  # Legend now shows Category instead of Country
-                title="🏭 Total Products by Manufacturer and Category",
-                labels={'Quantity': 'Total Products'},
-                barmode='stack'
-            )
-
-            # Optional: rotate x-axis labels for readability
-            fig_manufacturer_category.update_layout(xaxis_tickangle=45)
-
-            st.plotly_chart(fig_manufacturer_category, use_container_width=True)
+    if results['manufacturer_category_summary'] is not None:
+        if not results['manufacturer_category_summary'].empty:
+            st.plotly_chart(load_figure(entry, 'manufacturer_category'), use_container_width=True)
         else:
             st.warning("⚠ No data available for Total Products by Manufacturer and Category.")
     else:
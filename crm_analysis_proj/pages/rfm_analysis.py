@@ -1,76 +1,91 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
+from utils.page_cache import cached_page, load_figure
+from utils.rfm import rfm_table, score_rfm, segment_labels
+from utils.tables import PagedTable, show_paged_table
 
-def show(df):
+def compute(dataset, exact=False):
+    """Scored RFM table and the chart/table inputs, without rendering.
+
+    Customers are scored against quartile boundaries merged from the
+    dataset's RFM sketches, or, with exact, against pd.qcut quartiles of the
+    whole table. Raises ValueError when exact scores can't be split into quartiles.
+    """
+    rfm = rfm_table(dataset.customer_facts, dataset.reference_date)
+    rfm = rfm.dropna()
+    boundaries = None if exact else dataset.rfm_sketches.boundaries(dataset.reference_date)
+    rfm = score_rfm(rfm, boundaries=boundaries)
+    rfm['Segment'] = segment_labels(rfm['RFM Score'])
+
+    avg_rfm = rfm.groupby("Segment")[["Recency", "Frequency", "Monetary"]].mean().reset_index()
+
+    segment_counts = rfm['Segment'].value_counts().reset_index()
+    segment_counts.columns = ['Segment', 'Count']
+
+    # Sorted and searched server-side, one page at a time
+    top_customers = PagedTable(
+        rfm[['CustomerID', 'CustomerName', 'Recency', 'Frequency', 'Monetary', 'Segment', 'RFM Score']],
+        search_columns=['CustomerName', 'CustomerID', 'Segment'], sort_by="RFM Score", ascending=False
+    )
+
+    return {'rfm': rfm, 'avg_rfm': avg_rfm, 'segment_counts': segment_counts, 'top_customers': top_customers,
+            'boundaries': boundaries}
+
+def figures(results):
+    """Builds the RFM charts from compute() results."""
+    fig_rfm_bar = px.bar(
+        results['avg_rfm'].melt(id_vars=["Segment"], var_name="RFM Metric", value_name="Average Value"),
+        x="Segment", y="Average Value", color="RFM Metric",
+        title="📊 RFM Value Distribution (Stacked Bar Chart)",
+        barmode="stack"
+    )
+    fig_segment_pie = px.pie(results['segment_counts'], names="Segment", values="Count", title="📌 Customer Segmentation Breakdown")
+    return {'rfm_bar': fig_rfm_bar, 'segment_pie': fig_segment_pie}
+
+def precompute(dataset):
+    """Fills the page cache for the page's default view, so the first visit is served from it."""
+    return cached_page(dataset, "rfm_analysis", {'exact': False}, compute, figures)
+
+def show(dataset):
     st.title("📊 RFM Analysis & Customer Segmentation")
 
-    if df is None or df.empty:
+    if dataset is None or dataset.empty:
         st.warning("⚠ No data available.")
         return
 
     required_columns = ['CustomerID', 'CustomerName', 'InvoiceDate', 'Quantity', 'UnitPrice']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in required_columns if col not in dataset.columns]
 
     if missing_columns:
         st.error(f"🚨 Missing columns: {missing_columns}. Please check the dataset.")
         return
 
-    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
-    df['Revenue'] = df['UnitPrice'] * df['Quantity']
-
-    reference_date = df['InvoiceDate'].max()
-    rfm = df.groupby(['CustomerID', 'CustomerName']).agg({
-        'InvoiceDate': lambda x: (reference_date - x.max()).days,
-        'InvoiceNo': 'nunique',
-        'Revenue': 'sum'
-    }).reset_index()
-
-    rfm.columns = ['CustomerID', 'CustomerName', 'Recency', 'Frequency', 'Monetary']
-    rfm = rfm.dropna()
+    exact = st.checkbox("Exact quartiles", value=False,
+                        help="Bins on the sorted customer table instead of the boundaries merged from the quantile sketches.")
 
     try:
-        rfm['R'] = pd.qcut(rfm['Recency'], q=4, labels=[4, 3, 2, 1]).astype(int)
-        rfm['F'] = pd.qcut(rfm['Frequency'].rank(method="first"), q=4, labels=[1, 2, 3, 4]).astype(int)
-        rfm['M'] = pd.qcut(rfm['Monetary'].rank(method="first"), q=4, labels=[1, 2, 3, 4]).astype(int)
-        rfm['RFM Score'] = rfm[['R', 'F', 'M']].sum(axis=1)
+        entry = cached_page(dataset, "rfm_analysis", {'exact': exact}, compute, figures)
     except ValueError as e:
         st.error(f"🚨 Error in RFM segmentation: {e}")
         return
 
-    def segment_customer(score):
-        if score >= 9:
-            return "Loyal Customers"
-        elif score >= 6:
-            return "New Customers"
-        elif score >= 4:
-            return "Hibernating"
-        else:
-            return "Churned"
-
-    rfm['Segment'] = rfm['RFM Score'].apply(segment_customer)
+    results = entry['tables']
+    rfm = results['rfm']
 
     st.write("### 🔍 RFM Data")
     st.dataframe(rfm.head())
 
-    avg_rfm = rfm.groupby("Segment")[["Recency", "Frequency", "Monetary"]].mean().reset_index()
-    fig_rfm_bar = px.bar(
-        avg_rfm.melt(id_vars=["Segment"], var_name="RFM Metric", value_name="Average Value"),
-        x="Segment", y="Average Value", color="RFM Metric",
-        title="📊 RFM Value Distribution (Stacked Bar Chart)",
-        barmode="stack"
-    )
-    st.plotly_chart(fig_rfm_bar, use_container_width=True)
+    if results['boundaries'] is not None:
+        st.caption("Quartile boundaries (approximate): " + "; ".join(
+            f"{metric} {', '.join(f'{value:,.0f}' for value in values)}" for metric, values in results['boundaries'].items()
+        ))
 
-    segment_counts = rfm['Segment'].value_counts().reset_index()
-    segment_counts.columns = ['Segment', 'Count']
-    fig_segment_pie = px.pie(segment_counts, names="Segment", values="Count", title="📌 Customer Segmentation Breakdown")
-    st.plotly_chart(fig_segment_pie, use_container_width=True)
+    st.plotly_chart(load_figure(entry, 'rfm_bar'), use_container_width=True)
+    st.plotly_chart(load_figure(entry, 'segment_pie'), use_container_width=True)
 
     if 'RFM Score' in rfm.columns:
-        top_customers = rfm[['CustomerID', 'CustomerName', 'Recency', 'Frequency', 'Monetary', 'Segment', 'RFM Score']].sort_values(by="RFM Score", ascending=False)
         st.subheader("🏆 Top Customers Based on RFM Score")
-        st.dataframe(top_customers.head(10))
+        show_paged_table(results['top_customers'], key="rfm-top-customers", page_size=10)
     else:
         st.warning("⚠ 'RFM Score' is missing. Check dataset calculations.")
 
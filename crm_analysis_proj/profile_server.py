@@ -0,0 +1,150 @@
+"""Customer profile lookup service: RFM scores, segment, days since last purchase and lifetime value as JSON.
+
+Profiles are precomputed from the line items into an in-memory store
+indexed by CustomerID (utils/profiles.py), so a lookup doesn't touch the
+dataset. The source is checked every --refresh seconds and the store is
+rebuilt and swapped in atomically when it changed.
+
+Run from crm_analysis_proj:
+    python profile_server.py data/data.csv --port 8600
+    python profile_server.py --history          # the dashboard's appended history
+Endpoints:
+    GET  /customers/<id>            one profile; 404 when unknown
+    GET  /customers?ids=1,2,3       profiles in the given order, null for unknown ids
+    POST /customers {"ids": [...]}  the same, for longer batches
+    GET  /health                    fingerprint, customers and reference date of the store
+    POST /refresh                   rebuild now instead of at the next check
+"""
+import argparse
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.churn import DEFAULT_CHURN_THRESHOLD
+from utils.incremental import STORE_DIR
+from utils.ingest import ValidationError
+from utils.profiles import REFRESH_INTERVAL, FileSource, HistorySource, ProfileService
+
+# Most ids accepted in one batch request
+MAX_BATCH = 10_000
+
+
+class ProfileHandler(BaseHTTPRequestHandler):
+    """Answers lookups from server.service; keeps connections alive between requests."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, the body would wait for a delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _batch(self, store, ids):
+        if len(ids) > MAX_BATCH:
+            return self._send(413, {'error': f"At most {MAX_BATCH:,} ids per request"})
+        profiles = store.lookup(ids)
+        missing = [customer_id for customer_id, profile in zip(ids, profiles) if profile is None]
+        self._send(200, {'profiles': profiles, 'missing': missing})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        # One reference per request, so a refresh in between can't mix two stores
+        store = self.server.service.store
+        try:
+            if parts == ['health']:
+                return self._send(200, self.server.service.health())
+            if store is None:
+                return self._send(503, {'error': "Profiles are still loading"})
+            if len(parts) == 2 and parts[0] == 'customers':
+                profile = store.get(int(parts[1]))
+                if profile is None:
+                    return self._send(404, {'error': f"Unknown customer {parts[1]}"})
+                return self._send(200, profile)
+            if parts == ['customers']:
+                ids = [int(value) for value in ",".join(parse_qs(url.query).get('ids', [])).split(",") if value]
+                return self._batch(store, ids)
+        except (ValueError, OverflowError):
+            return self._send(400, {'error': "Customer ids must be integers"})
+        self._send(404, {'error': f"No endpoint {url.path}"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path.strip("/")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if path == 'refresh':
+            try:
+                refreshed = self.server.service.refresh(force=True)
+            except (ValidationError, ValueError, OSError) as e:
+                return self._send(500, {'error': str(e)})
+            return self._send(200, {'refreshed': refreshed, **self.server.service.health()})
+        if path != 'customers':
+            return self._send(404, {'error': f"No endpoint /{path}"})
+        store = self.server.service.store
+        if store is None:
+            return self._send(503, {'error': "Profiles are still loading"})
+        try:
+            ids = [int(value) for value in json.loads(body)['ids']]
+        except (ValueError, OverflowError, TypeError, KeyError):
+            return self._send(400, {'error': 'Expected {"ids": [integers]}'})
+        self._batch(store, ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='*', help="CSV, gzip/zstd CSV or Parquet files, read as one dataset")
+    parser.add_argument('--history', nargs='?', const=STORE_DIR,
+                        help="serve the incremental history at this directory (default: the dashboard's)")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--refresh', type=float, default=REFRESH_INTERVAL,
+                        help="seconds between checks of the source for changes; 0 turns them off")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes reading the files")
+    parser.add_argument('--churn-threshold', type=int, default=DEFAULT_CHURN_THRESHOLD,
+                        help="days without a purchase after which a customer counts as churned")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    args = parser.parse_args()
+    if bool(args.inputs) == bool(args.history):
+        parser.error("give either input files or --history")
+
+    source = HistorySource(args.history) if args.history else FileSource(args.inputs, args.workers)
+    service = ProfileService(source, args.churn_threshold)
+    try:
+        service.refresh()
+    except ValidationError as e:
+        parser.exit(2, f"File rejected: {e}\n")
+    except ValueError as e:
+        parser.exit(2, f"No profiles to serve: {e}\n")
+    health = service.health()
+    print(f"Loaded {health['customers']:,} profiles ({health['bytes'] / 2**20:,.1f} MiB, {health['index']} index) "
+          f"from {health['fingerprint']}", file=sys.stderr, flush=True)
+    if args.refresh > 0:
+        service.watch(args.refresh)
+
+    server = ThreadingHTTPServer((args.host, args.port), ProfileHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = args.verbose
+    print(f"Serving on http://{args.host}:{server.server_port}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
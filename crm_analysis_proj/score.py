@@ -0,0 +1,96 @@
+"""Headless batch scoring: RFM scores, segments, KMeans clusters and churn flags per customer, as Parquet.
+
+Reads CSV (plain, gzip or zstd) or Parquet line items in parts across a
+process pool, reduces them to one row per customer and scores those rows.
+
+Run from crm_analysis_proj:
+    python score.py data/data.csv --output scores.parquet
+    python score.py exports/*.csv.gz --output scores.parquet --workers 8
+or from the repository root:
+    python -m crm_analysis_proj.score data.parquet --output scores.parquet
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from utils.churn import DEFAULT_CHURN_THRESHOLD
+from utils.ingest import ValidationError
+from utils.instrumentation import rss_mb, span
+from utils.scoring import PART_BYTES, aggregate_files, score_customers, write_scores
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5.0
+
+
+class Progress:
+    """Prints rows read, throughput and memory at most every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, stream=sys.stderr, interval=PROGRESS_INTERVAL):
+        self.stream = stream
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def __call__(self, reducer):
+        now = time.perf_counter()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        seconds = now - self.start
+        rss, _ = rss_mb()
+        memory = f", {rss:,.0f} MiB" if rss is not None else ""
+        print(f"  {reducer.parts:,} parts, {reducer.rows:,} rows in {seconds:.0f}s "
+              f"({reducer.rows / seconds:,.0f} rows/s{memory})", file=self.stream, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help="CSV, gzip/zstd CSV or Parquet files, read as one dataset")
+    parser.add_argument('--output', required=True, help="Parquet file to write the scores to")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--part-mb', type=float, default=PART_BYTES / 2**20, help="CSV megabytes per task")
+    parser.add_argument('--clusters', type=int, default=4, help="KMeans segments")
+    parser.add_argument('--churn-threshold', type=int, default=DEFAULT_CHURN_THRESHOLD,
+                        help="days without a purchase after which a customer counts as churned")
+    parser.add_argument('--reference-date', help="date Recency is measured from (default: the latest purchase)")
+    parser.add_argument('--exact', action='store_true', help="exact quartiles instead of the quantile sketches")
+    parser.add_argument('--quarantine', help="CSV for malformed rows (default: next to the output)")
+    args = parser.parse_args()
+
+    quarantine_path = args.quarantine or f"{os.path.splitext(args.output)[0]}.quarantine.csv"
+    print(f"Reading {len(args.inputs)} file(s) with {args.workers} workers", file=sys.stderr, flush=True)
+    try:
+        with span("score.aggregate", files=len(args.inputs)) as fields:
+            facts, report = aggregate_files(args.inputs, args.workers, int(args.part_mb * 2**20),
+                                            quarantine_path=quarantine_path, progress=Progress())
+            fields.update(rows=report['rows'], customers=report['customers'])
+    except ValidationError as e:
+        parser.exit(2, f"File rejected: {e}\n")
+
+    start = time.perf_counter()
+    with span("score.model", customers=len(facts)):
+        reference_date = pd.Timestamp(args.reference_date) if args.reference_date else None
+        scores = score_customers(facts, reference_date, args.clusters, args.churn_threshold, args.exact)
+    model_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with span("score.write", customers=len(scores)):
+        write_scores(scores, args.output)
+    write_seconds = time.perf_counter() - start
+
+    _, peak = rss_mb()
+    print(f"Read {report['rows']:,} rows ({report['parts']:,} parts) in {report['seconds']:.1f}s, "
+          f"{report['rows'] / report['seconds']:,.0f} rows/s; {report['customers']:,} customers.")
+    if report['quarantined']:
+        print(f"Quarantined {report['quarantined']:,} malformed rows to {report['quarantine_path']}.")
+    print(f"Scored in {model_seconds:.1f}s, wrote {len(scores):,} rows to {args.output} in {write_seconds:.1f}s; "
+          f"peak memory {peak:,.0f} MiB (main process).")
+
+
+if __name__ == '__main__':
+    main()
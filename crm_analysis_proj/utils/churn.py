@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from utils.dataset import MISSING_MONTH
+
+DEFAULT_CHURN_THRESHOLD = 90
+
+
+def monthly_churn(facts, activity, reference_date, thresholds=(DEFAULT_CHURN_THRESHOLD,)):
+    """Computes the monthly churn rate (%) for several inactivity thresholds at once.
+
+    A customer counts as churned when their last purchase is more than the
+    threshold number of days before reference_date. Each month's rate is the
+    share of that month's line items belonging to churned customers, so the
+    result matches merging the churn flags back onto the line items without
+    materializing that merge. activity is the per-(CustomerID, MonthKey)
+    line count from customer_month_activity. Returns a frame indexed by
+    MonthKey with one column per threshold.
+    """
+    activity = activity[activity.index.get_level_values('MonthKey') != MISSING_MONTH]
+    thresholds = np.asarray(thresholds)
+    days = (reference_date - facts['LastPurchase']).dt.days.to_numpy(dtype='float64', na_value=np.nan)
+
+    customer_pos = facts.index.get_indexer(activity.index.get_level_values('CustomerID'))
+    month_codes, months = pd.factorize(activity.index.get_level_values('MonthKey'), sort=True)
+    lines = activity.to_numpy(dtype='float64')
+
+    total_lines = np.bincount(month_codes, weights=lines, minlength=len(months))
+    churned = days[customer_pos, None] > thresholds[None, :]
+
+    rates = {
+        threshold: np.bincount(month_codes, weights=lines * churned[:, i], minlength=len(months)) / total_lines * 100
+        for i, threshold in enumerate(thresholds.tolist())
+    }
+    return pd.DataFrame(rates, index=pd.Index(months, name='MonthKey'))
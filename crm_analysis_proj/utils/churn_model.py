@@ -0,0 +1,236 @@
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
+from sklearn.preprocessing import StandardScaler
+
+from utils.churn import DEFAULT_CHURN_THRESHOLD
+from utils.ingest import CACHE_ROOT, content_hash
+from utils.instrumentation import span
+
+CHURN_MODEL_DIR = os.path.join(CACHE_ROOT, "churn_models")
+
+# Part of the persisted fits' fingerprint; bump when the features or the model change
+MODEL_VERSION = 2
+
+# The mean gap between purchases is left out: on a log scale it is Recency minus Overdue, and
+# collinear features would blur which one drives a customer's risk
+FEATURES = ['Recency', 'Tenure', 'Purchases', 'Overdue', 'Irregularity', 'SpendTrend', 'Categories']
+
+# Heavy-tailed features, fitted on a log scale
+LOG_FEATURES = ['Recency', 'Tenure', 'Purchases', 'Overdue', 'Irregularity', 'Categories']
+
+# Days in each of the two windows whose spend SpendTrend compares
+TREND_DAYS = 90
+
+# Most customers a model is fitted on; larger histories are sampled (the fit is persisted anyway)
+MAX_TRAIN_CUSTOMERS = 500_000
+
+# Fewest churned and retained training customers a model is fitted with
+MIN_CLASS_CUSTOMERS = 10
+
+# Risk levels as (lowest churn probability, level) of the class-balanced model; customers below the first are not at risk
+RISK_LEVELS = [(0.5, "Mild"), (0.7, "Moderate"), (0.85, "Severe")]
+
+# Risk factors as feature -> (direction that signals churn, 1 high or -1 low, and its name)
+RISK_FACTORS = {
+    'Recency': (1, "Long since last purchase"),
+    'Tenure': (-1, "New customer"),
+    'Purchases': (-1, "Few purchases"),
+    'Overdue': (1, "Overdue for next purchase"),
+    'Irregularity': (1, "Irregular purchases"),
+    'SpendTrend': (-1, "Falling spend"),
+    'Categories': (-1, "Narrow category range"),
+}
+
+# Factor of an at-risk customer with no feature both raising the risk and pointing the churn way
+OTHER_FACTOR = "Other"
+
+DAY = np.timedelta64(1, 'D')
+
+
+def churn_features(days, categories, as_of, trend_days=TREND_DAYS):
+    """Behavioural features of every customer with a purchase on or before as_of, indexed by CustomerID.
+
+    days is the customer_purchase_days table and categories the
+    customer_category_firsts table; later rows are ignored, so the features
+    of a past date can be built for training. Recency and Tenure are the
+    days from the last and first purchase to as_of. From the days between
+    consecutive purchases (a single purchase has its Tenure as gap), Overdue
+    is Recency over the mean gap, how late the next purchase is against the
+    customer's own rhythm, and Irregularity the gaps' coefficient of
+    variation; SpendTrend compares the spend of the last trend_days with the
+    trend_days before, from -1 (all earlier) to 1 (all recent); Categories
+    counts the categories bought. Every feature is one pass of array
+    operations over the purchase rows, with no per-customer Python.
+    """
+    as_of = np.datetime64(pd.Timestamp(as_of), 'ns')
+    dates = days['Day'].to_numpy(dtype='datetime64[ns]')
+    keep = dates <= as_of
+    ids = days['CustomerID'].to_numpy(dtype=np.int64)[keep]
+    ago = (as_of - dates[keep]) / DAY
+    revenue = days['Revenue'].to_numpy(dtype=np.float64, na_value=0.0)[keep]
+
+    # Purchases grouped by customer, oldest first (the aggregates come sorted)
+    boundary = ids[1:] != ids[:-1]
+    if not ((ids[1:] >= ids[:-1]).all() and (boundary | (ago[1:] <= ago[:-1])).all()):
+        order = np.lexsort((-ago, ids))
+        ids, ago, revenue = ids[order], ago[order], revenue[order]
+        boundary = ids[1:] != ids[:-1]
+    starts = np.flatnonzero(np.r_[True, boundary]) if len(ids) else np.empty(0, dtype=np.int64)
+    customers = ids[starts]
+    counts = np.diff(np.r_[starts, len(ids)])
+    codes = np.repeat(np.arange(len(starts)), counts)
+    n = len(starts)
+
+    recency = ago[starts + counts - 1]
+    tenure = ago[starts]
+    gaps = (ago[:-1] - ago[1:])[~boundary]
+    gap_codes = codes[1:][~boundary]
+    n_gaps = counts - 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gap_mean = np.where(n_gaps > 0, np.bincount(gap_codes, gaps, n) / n_gaps, tenure)
+        gap_variance = np.bincount(gap_codes, gaps ** 2, n) / n_gaps - gap_mean ** 2
+    gap_std = np.where(n_gaps > 0, np.sqrt(np.maximum(gap_variance, 0.0)), 0.0)
+
+    recent = np.bincount(codes, revenue * (ago < trend_days), n)
+    prior = np.bincount(codes, revenue * ((ago >= trend_days) & (ago < 2 * trend_days)), n)
+    total = recent + prior
+    trend = np.clip(np.divide(recent - prior, total, out=np.zeros(n), where=total > 0), -1.0, 1.0)
+
+    category_ids = categories['CustomerID'].to_numpy(dtype=np.int64)[
+        categories['FirstPurchase'].to_numpy(dtype='datetime64[ns]') <= as_of
+    ]
+    positions = np.minimum(np.searchsorted(customers, category_ids), max(n - 1, 0))
+    known = customers[positions] == category_ids if n else np.zeros(len(category_ids), dtype=bool)
+    breadth = np.bincount(positions[known], minlength=n)
+
+    return pd.DataFrame({
+        'Recency': recency,
+        'Tenure': tenure,
+        'Purchases': counts,
+        'Overdue': recency / np.maximum(gap_mean, 1.0),
+        'Irregularity': gap_std / np.maximum(gap_mean, 1.0),
+        'SpendTrend': trend,
+        'Categories': breadth,
+    }, index=pd.Index(customers, name='CustomerID'))
+
+
+def training_set(days, categories, reference_date, horizon=DEFAULT_CHURN_THRESHOLD):
+    """Features as of horizon days before reference_date, and whether each customer then went without a purchase.
+
+    The label is 1 for customers with no purchase in the horizon days that
+    followed, so the model learns the look of a customer about to churn.
+    """
+    cutoff = pd.Timestamp(reference_date) - pd.Timedelta(days=horizon)
+    features = churn_features(days, categories, cutoff)
+    later = days['Day'].to_numpy(dtype='datetime64[ns]') > np.datetime64(cutoff, 'ns')
+    returned = np.unique(days['CustomerID'].to_numpy(dtype=np.int64)[later])
+    labels = (~np.isin(features.index.to_numpy(), returned)).astype(np.int8)
+    return features, labels
+
+
+def _matrix(features):
+    values = features[FEATURES].to_numpy(dtype=np.float64, copy=True)
+    logged = [FEATURES.index(name) for name in LOG_FEATURES]
+    values[:, logged] = np.log1p(np.maximum(values[:, logged], 0.0))
+    return values
+
+
+def fit_churn_model(features, labels, random_state=42):
+    """Fits the scaler and logistic regression on training features and labels.
+
+    Above MAX_TRAIN_CUSTOMERS a random sample is fitted on. The classes are
+    weighted to balance, so with few churners the probabilities still spread
+    over RISK_LEVELS instead of staying near the base rate. The AUC is
+    measured on all training customers.
+    """
+    start = time.perf_counter()
+    values = _matrix(features)
+    sample = np.arange(len(values))
+    if len(values) > MAX_TRAIN_CUSTOMERS:
+        sample = np.random.default_rng(random_state).choice(len(values), MAX_TRAIN_CUSTOMERS, replace=False)
+
+    scaler = StandardScaler().fit(values[sample])
+    model = LogisticRegression(max_iter=1000, class_weight='balanced').fit(scaler.transform(values[sample]), labels[sample])
+    risk = model.predict_proba(scaler.transform(values))[:, 1]
+    return {
+        'scaler': scaler,
+        'model': model,
+        'auc': float(roc_auc_score(labels, risk)),
+        'customers': len(values),
+        'churned': int(labels.sum()),
+        'fit_seconds': time.perf_counter() - start,
+    }
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _save(fit, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(fit, f)
+    os.replace(tmp_path, path)
+
+
+def churn_model(days, categories, reference_date, horizon=DEFAULT_CHURN_THRESHOLD, cache_dir=CHURN_MODEL_DIR):
+    """The churn model for a purchase history, fitted once per training set and persisted.
+
+    Fits are stored under the fingerprint of the training features and
+    labels, so reopening the same data, or data that leaves the training
+    window unchanged, reuses the fit. Returns None when the history before
+    the horizon has too few churned or retained customers to learn from.
+    """
+    with span("churn_model", horizon=horizon) as fields:
+        features, labels = training_set(days, categories, reference_date, horizon)
+        fields['customers'] = len(labels)
+        churned = int(labels.sum())
+        if min(churned, len(labels) - churned) < MIN_CLASS_CUSTOMERS:
+            fields['fitted'] = False
+            return None
+
+        values = np.ascontiguousarray(_matrix(features))
+        fingerprint = content_hash(values.tobytes() + labels.tobytes() + f"|{horizon}|{MODEL_VERSION}".encode())
+        path = os.path.join(cache_dir, f"{fingerprint}.pkl")
+        fit = _load(path)
+        fields['cached'] = fit is not None
+        if fit is None:
+            fit = fit_churn_model(features, labels)
+            _save(fit, path)
+    return fit
+
+
+def score_churn(fit, features):
+    """Churn probability, risk level and main risk factor per customer, from one batched predict_proba call.
+
+    The main factor is the feature adding most to the customer's log-odds
+    (coefficient times standardized value) among those off the average in
+    their churn direction (RISK_FACTORS), so a factor always names what is
+    worrying about the customer; customers below the first of RISK_LEVELS
+    get neither.
+    """
+    scaled = fit['scaler'].transform(_matrix(features))
+    risk = fit['model'].predict_proba(scaled)[:, 1]
+
+    directions = np.array([RISK_FACTORS[name][0] for name in FEATURES])
+    contributions = scaled * fit['model'].coef_[0]
+    contributions[(contributions <= 0) | (scaled * directions <= 0)] = -np.inf
+    top = contributions.argmax(axis=1)
+    names = np.array([RISK_FACTORS[name][1] for name in FEATURES] + [OTHER_FACTOR], dtype=object)
+    factors = names[np.where(np.isinf(contributions[np.arange(len(top)), top]), len(FEATURES), top)]
+
+    thresholds = [threshold for threshold, _ in RISK_LEVELS]
+    levels = np.array([None] + [level for _, level in RISK_LEVELS], dtype=object)
+    level = np.searchsorted(thresholds, risk, side='right')
+    factors[level == 0] = None
+    return pd.DataFrame({'ChurnRisk': risk, 'RiskLevel': levels[level], 'RiskFactor': factors}, index=features.index)
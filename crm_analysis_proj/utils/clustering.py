@@ -0,0 +1,162 @@
+import os
+import pickle
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import pairwise_distances_argmin
+from sklearn.preprocessing import StandardScaler
+
+from utils.ingest import CACHE_ROOT, content_hash
+from utils.instrumentation import span
+
+CLUSTER_DIR = os.path.join(CACHE_ROOT, "clusters")
+
+FEATURES = ['Recency', 'Frequency', 'Monetary']
+
+# Above this many customers, fit with MiniBatchKMeans instead of full-batch KMeans
+MINIBATCH_THRESHOLD = 100_000
+MINIBATCH_SIZE = 4096
+
+# Reuse the previous centroids as the starting point when every feature's
+# mean and standard deviation moved by less than this fraction
+WARM_START_TOLERANCE = 0.1
+
+# Persisted fits kept in the cluster directory; the least recently used go first
+MAX_CACHED_FITS = 256
+
+# What a persisted fit keeps: enough to assign customers to the nearest centroid, not the KMeans model
+PERSISTED_KEYS = ['scaler', 'centers', 'names', 'warm_start', 'fit_seconds']
+
+
+def feature_fingerprint(features, n_clusters):
+    """Hashes the clustering inputs so an identical feature table reuses its persisted fit."""
+    values = np.ascontiguousarray(features[FEATURES].to_numpy(dtype='float64'))
+    return content_hash(values.tobytes() + f"|{n_clusters}".encode())
+
+
+def label_clusters(centers):
+    """Names clusters from their centroid profile, so labels don't depend on KMeans' arbitrary numbering.
+
+    Highest Monetary -> "High Value", then highest Recency -> "Hibernating",
+    highest Frequency -> "Loyal Customers", the rest -> "New Customers".
+    """
+    recency, frequency, monetary = (centers[:, i] for i in range(3))
+    names = {}
+    remaining = list(range(len(centers)))
+    for name, key in [("High Value", monetary), ("Hibernating", recency), ("Loyal Customers", frequency)]:
+        if len(remaining) <= 1:
+            break
+        best = max(remaining, key=lambda c: key[c])
+        names[best] = name
+        remaining.remove(best)
+    for i, cluster in enumerate(sorted(remaining, key=lambda c: monetary[c])):
+        names[cluster] = "New Customers" if i == 0 else f"New Customers {i + 1}"
+    return np.array([names[c] for c in range(len(centers))], dtype=object)
+
+
+def _close_enough(previous, scaler):
+    if previous is None or len(previous['scaler'].mean_) != len(scaler.mean_):
+        return False
+    scale = np.maximum(np.abs(previous['scaler'].mean_), previous['scaler'].scale_)
+    mean_shift = np.abs(previous['scaler'].mean_ - scaler.mean_) / scale
+    scale_shift = np.abs(previous['scaler'].scale_ - scaler.scale_) / previous['scaler'].scale_
+    return bool((mean_shift < WARM_START_TOLERANCE).all() and (scale_shift < WARM_START_TOLERANCE).all())
+
+
+def fit_clusters(features, n_clusters=4, previous=None, random_state=42):
+    """Fits the scaler and KMeans centroids on customer RFM features.
+
+    Uses MiniBatchKMeans above MINIBATCH_THRESHOLD customers, and warm-starts
+    from previous (an earlier fit) when the feature distribution barely moved.
+    """
+    values = features[FEATURES].to_numpy(dtype='float64')
+    start = time.perf_counter()
+
+    scaler = StandardScaler().fit(values)
+    scaled = scaler.transform(values)
+
+    warm = _close_enough(previous, scaler) and len(previous['centers']) == n_clusters
+    init = scaler.transform(previous['centers']) if warm else 'k-means++'
+    n_init = 1 if warm else 10
+
+    if len(values) > MINIBATCH_THRESHOLD:
+        model = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=n_init,
+                                batch_size=MINIBATCH_SIZE, random_state=random_state)
+    else:
+        model = KMeans(n_clusters=n_clusters, init=init, n_init=n_init, random_state=random_state)
+    model.fit(scaled)
+
+    centers = scaler.inverse_transform(model.cluster_centers_)
+    return {
+        'scaler': scaler,
+        'model': model,
+        'centers': centers,
+        'names': label_clusters(centers),
+        'warm_start': warm,
+        'fit_seconds': time.perf_counter() - start,
+    }
+
+
+def _load(path):
+    try:
+        with open(path, "rb") as f:
+            fit = pickle.load(f)
+        os.utime(path)  # a hit counts as a use for _prune
+    except FileNotFoundError:
+        return None
+    return fit
+
+
+def _save(fit, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(fit, f)
+    os.replace(tmp_path, path)
+
+
+def _prune(cache_dir, max_fits=MAX_CACHED_FITS):
+    """Removes the least recently used persisted fits beyond max_fits."""
+    fits = []
+    for entry in os.scandir(cache_dir):
+        try:
+            if entry.name.endswith(".pkl"):
+                fits.append((entry.stat().st_mtime_ns, entry.path))
+        except FileNotFoundError:  # removed by another session meanwhile
+            continue
+    fits.sort()
+    for _, path in fits[:max(len(fits) - max_fits, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+
+
+def cluster_customers(features, n_clusters=4, family="default", cache_dir=CLUSTER_DIR):
+    """Assigns each customer to its nearest centroid, reusing a persisted fit for identical features.
+
+    A new fit warm-starts from the latest fit of the same family, so callers
+    clustering different populations (the full customer base, a filtered
+    slice) name their own family and don't overwrite each other's starting
+    point. Returns the cluster number per row and the fit (scaler,
+    centroids and the stable cluster -> segment name array under 'names').
+    """
+    with span("clustering", customers=len(features), n_clusters=n_clusters) as fields:
+        fingerprint = feature_fingerprint(features, n_clusters)
+        fit = _load(os.path.join(cache_dir, f"{fingerprint}.pkl"))
+        fields['cached'] = fit is not None
+
+        if fit is None:
+            latest_path = os.path.join(cache_dir, f"latest-{family}-k{n_clusters}.pkl")
+            fitted = fit_clusters(features, n_clusters, previous=_load(latest_path))
+            fit = {key: fitted[key] for key in PERSISTED_KEYS}
+            _save(fit, os.path.join(cache_dir, f"{fingerprint}.pkl"))
+            _save(fit, latest_path)
+            _prune(cache_dir)
+            fields['warm_start'] = fit['warm_start']
+
+        scaler = fit['scaler']
+        values = features[FEATURES].to_numpy(dtype='float64')
+        clusters = pairwise_distances_argmin(scaler.transform(values), scaler.transform(fit['centers']))
+    return clusters, fit
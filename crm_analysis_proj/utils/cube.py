@@ -0,0 +1,218 @@
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from utils.ingest import concat_typed
+from utils.sketches import HLLSketches
+
+CUBE_DIMENSIONS = ['MonthKey', 'Country', 'Category', 'Manufacturer']
+CUBE_MEASURES = ['Revenue', 'Profit', 'Quantity', 'Lines']
+
+# Dimensions the distinct-count sketches are partitioned by; filters on other
+# dimensions are counted exactly
+SKETCH_DIMENSIONS = ['MonthKey', 'Country', 'Category']
+
+# Sketched columns, by the name totals() reports their distinct count under
+DISTINCT_COLUMNS = {'Customers': 'CustomerID', 'Orders': 'InvoiceNo'}
+
+# Up to this many line items distinct counts are exact by default: counting
+# is cheap at that size, and a sketch's error would show in small counts
+EXACT_DISTINCT_LINES = 1_000_000
+
+
+def _mask(frame, filters):
+    mask = np.ones(len(frame), dtype=bool)
+    for dimension, values in (filters or {}).items():
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        mask &= frame[dimension].isin(values).to_numpy()
+    return mask
+
+
+class Cube:
+    """Pre-aggregated measures per (month, country, category, manufacturer) cell.
+
+    cells holds one row per non-empty cell with the dimension values and the
+    summed measures (Lines counts line items with a revenue). cell_customers
+    holds the distinct (Cell, CustomerID) pairs so exact distinct-customer
+    counts for any set of cells can be answered without touching the line
+    items; cell_orders, when given, does the same for invoices. sketches
+    maps each sketched column to its HLLSketches per (month, country,
+    category) partition, which answer approximate distinct counts by
+    merging; count_distinct(column, filters) counts exactly against the
+    line items, for the columns without pairs.
+    """
+
+    def __init__(self, cells, cell_customers, dimensions, sketches=None, count_distinct=None, cell_orders=None):
+        self.cells = cells
+        self.cell_customers = cell_customers
+        self.cell_orders = cell_orders
+        self.dimensions = dimensions
+        self.sketches = sketches or {}
+        self.count_distinct = count_distinct
+        self._rollups = {}
+        self._all_distinct = {}
+
+    def __getstate__(self):
+        # The exact counter reads the line items the cube was built from; whoever loads a pickled cube supplies one
+        return dict(self.__dict__, count_distinct=None, _rollups={}, _all_distinct={})
+
+    def _cell_mask(self, filters):
+        return _mask(self.cells, filters)
+
+    def rollup(self, by, filters=None):
+        """Sums the measures over the cells matching filters ({dimension: value(s)}), grouped by dimensions.
+
+        Unfiltered rollups are memoized, so repeated page renders are served without regrouping.
+        """
+        key = tuple(by) if isinstance(by, (list, tuple)) else (by,)
+        if not filters and key in self._rollups:
+            return self._rollups[key]
+
+        cells = self.cells[self._cell_mask(filters)] if filters else self.cells
+        result = cells.groupby(list(key), observed=True)[CUBE_MEASURES].sum().reset_index()
+        if not filters:
+            self._rollups[key] = result
+        return result
+
+    def estimates(self, column, filters=None, exact=False):
+        """Whether distinct() answers column over filters with a sketch estimate rather than exactly."""
+        sketch = self.sketches.get(column)
+        return (not exact and sketch is not None and set(filters or {}) <= set(sketch.keys.columns)
+                and self._lines > EXACT_DISTINCT_LINES)
+
+    def distinct(self, column, filters=None, exact=False):
+        """Counts distinct values of a sketched column across the cells matching filters.
+
+        Beyond EXACT_DISTINCT_LINES line items the count merges the column's
+        sketches, an estimate with the relative standard error of
+        utils.sketches.standard_error (1.6%). Smaller cubes, exact=True, or a
+        filter on a dimension the sketches are not partitioned by count
+        exactly: from the column's (Cell, value) pairs where the cube keeps
+        them, otherwise against the line items.
+        """
+        if self.estimates(column, filters, exact):
+            sketch = self.sketches[column]
+            return sketch.count(_mask(sketch.keys, filters) if filters else None)
+        pairs = self._pairs(column)
+        if pairs is not None:
+            return self._exact(pairs, column, filters)
+        return self.count_distinct(column, filters)
+
+    def distinct_customers(self, filters=None, exact=False):
+        """Counts distinct customers across the cells matching filters (see distinct)."""
+        return self.distinct('CustomerID', filters, exact)
+
+    def distinct_orders(self, filters=None, exact=False):
+        """Counts distinct invoices across the cells matching filters (see distinct)."""
+        return self.distinct('InvoiceNo', filters, exact)
+
+    def _pairs(self, column):
+        return {'CustomerID': self.cell_customers, 'InvoiceNo': self.cell_orders}.get(column)
+
+    def _exact(self, pairs, column, filters):
+        if not filters:
+            # Unfiltered counts are memoized like the unfiltered rollups
+            if column not in self._all_distinct:
+                self._all_distinct[column] = int(pairs[column].nunique())
+            return self._all_distinct[column]
+        cells = np.flatnonzero(self._cell_mask(filters))
+        return int(pairs.loc[pairs['Cell'].isin(cells), column].nunique())
+
+    def totals(self, filters=None, exact=False):
+        """Returns the summed measures plus the distinct customer and order counts for the matching cells.
+
+        Orders is only present when the data has invoice numbers.
+        """
+        cells = self.cells[self._cell_mask(filters)] if filters else self.cells
+        totals = {measure: cells[measure].sum() for measure in CUBE_MEASURES}
+        for name, column in DISTINCT_COLUMNS.items():
+            if column in self.sketches:
+                totals[name] = self.distinct(column, filters, exact)
+        return totals
+
+    @cached_property
+    def _lines(self):
+        return int(self.cells['Lines'].sum())
+
+
+def build_sketches(df, dimensions):
+    """HLLSketches of each sketched column in df, partitioned by the sketch dimensions among dimensions."""
+    partitioned = [dimension for dimension in SKETCH_DIMENSIONS if dimension in dimensions]
+    grouped = df.groupby(partitioned, observed=True, dropna=False, sort=True)
+    keys = grouped.size().reset_index()[partitioned]
+    partitions = grouped.ngroup().to_numpy()
+    return {
+        column: HLLSketches.from_values(keys, partitions, df[column])
+        for column in DISTINCT_COLUMNS.values()
+        if column in df.columns
+    }
+
+
+def distinct_values(df, column, filters=None):
+    """Distinct non-null values of column over the line items matching filters ({dimension: value(s)})."""
+    return df.loc[_mask(df, filters), column].dropna().unique()
+
+
+def build_cube(df, order_pairs=False):
+    """Aggregates the line items into a Cube over the dimensions present in df.
+
+    order_pairs also keeps the (Cell, InvoiceNo) pairs, for an owner that
+    can't count invoices against the line items.
+    """
+    dimensions = [dimension for dimension in CUBE_DIMENSIONS if dimension in df.columns]
+    grouped = df.groupby(dimensions, observed=True, dropna=False, sort=True)
+
+    cells = grouped.agg(
+        Revenue=('Revenue', 'sum'),
+        Profit=('Profit', 'sum'),
+        Quantity=('Quantity', 'sum'),
+        Lines=('Revenue', 'count'),
+    ).reset_index()
+
+    cell = grouped.ngroup().to_numpy()
+    cell_customers = pd.DataFrame({'Cell': cell, 'CustomerID': df['CustomerID'].to_numpy()}).drop_duplicates()
+    cell_orders = None
+    if order_pairs and 'InvoiceNo' in df.columns:
+        cell_orders = pd.DataFrame({'Cell': cell, 'InvoiceNo': df['InvoiceNo'].to_numpy()}).dropna().drop_duplicates()
+
+    def count_distinct(column, filters=None):
+        return len(distinct_values(df, column, filters))
+
+    return Cube(cells, cell_customers, dimensions, build_sketches(df, dimensions), count_distinct, cell_orders)
+
+
+def _merge_pairs(renumbered, offset, pairs, delta_pairs):
+    # Renumbers both sides' (Cell, value) pairs onto the merged cells and deduplicates
+    parts = [
+        frame.assign(Cell=renumbered[start + frame['Cell'].to_numpy()])
+        for frame, start in [(pairs, 0), (delta_pairs, offset)]
+        if frame is not None
+    ]
+    return pd.concat(parts, ignore_index=True).drop_duplicates() if parts else None
+
+
+def merge_cubes(cube, delta):
+    """Folds a batch's Cube into an existing one, touching only cell-sized tables and sketches.
+
+    Measures add up per cell, the (Cell, CustomerID) and (Cell, InvoiceNo)
+    pairs are renumbered onto the merged cells and deduplicated, and the
+    sketches are unioned partition by partition. The merged cube has no
+    count_distinct, so it counts exactly only the columns it keeps pairs of.
+    """
+    if cube is None:
+        return delta
+    dimensions = [dimension for dimension in CUBE_DIMENSIONS
+                  if dimension in cube.dimensions or dimension in delta.dimensions]
+    cells = concat_typed([cube.cells, delta.cells]).reset_index(drop=True)
+    grouped = cells.groupby(dimensions, observed=True, dropna=False, sort=True)
+    renumbered = grouped.ngroup().to_numpy()
+    cell_customers = _merge_pairs(renumbered, len(cube.cells), cube.cell_customers, delta.cell_customers)
+    cell_orders = _merge_pairs(renumbered, len(cube.cells), cube.cell_orders, delta.cell_orders)
+    sketches = {
+        column: HLLSketches.union([cube.sketches.get(column), delta.sketches.get(column)])
+        for column in DISTINCT_COLUMNS.values()
+        if column in cube.sketches or column in delta.sketches
+    }
+    return Cube(grouped[CUBE_MEASURES].sum().reset_index(), cell_customers, dimensions, sketches,
+                cell_orders=cell_orders)
@@ -0,0 +1,114 @@
+import pandas as pd
+
+from utils.ingest import concat_typed
+
+# Per-customer reductions, as (output column, source column, aggregation)
+FACT_AGGREGATIONS = [
+    ('FirstPurchase', 'InvoiceDate', 'min'),
+    ('LastPurchase', 'InvoiceDate', 'max'),
+    ('Invoices', 'InvoiceNo', 'nunique'),
+    ('Lines', 'InvoiceDate', 'size'),
+    ('Revenue', 'Revenue', 'sum'),
+    ('Quantity', 'Quantity', 'sum'),
+    ('UnitPriceTotal', 'UnitPrice', 'sum'),
+    ('CustomerName', 'CustomerName', 'first'),
+]
+
+# How two CustomerFacts rows for the same customer combine
+FACT_MERGE = {
+    'FirstPurchase': 'min',
+    'LastPurchase': 'max',
+    'Invoices': 'sum',
+    'Lines': 'sum',
+    'Revenue': 'sum',
+    'Quantity': 'sum',
+    'UnitPriceTotal': 'sum',
+    'CustomerName': 'first',
+}
+
+
+def build_customer_facts(df):
+    """Builds the CustomerFacts table (one row per CustomerID) in a single grouped pass."""
+    aggregations = {
+        name: (source, func)
+        for name, source, func in FACT_AGGREGATIONS
+        if source in df.columns
+    }
+    return df.groupby('CustomerID', observed=True).agg(**aggregations)
+
+
+def merge_customer_facts(facts, delta):
+    """Folds a batch's CustomerFacts into existing facts, touching only the batch's customers.
+
+    Invoices are summed, which assumes an invoice never spans two batches.
+    """
+    if facts is None:
+        return delta
+    affected = facts.index.intersection(delta.index)
+    combined = pd.concat([facts.loc[affected], delta])
+    if 'CustomerName' in combined.columns:
+        combined['CustomerName'] = combined['CustomerName'].astype(object)
+    merged = combined.groupby(level=0).agg({col: FACT_MERGE[col] for col in combined.columns})
+    return pd.concat([facts.drop(affected), merged]).sort_index()
+
+
+def combine_customer_facts(parts):
+    """Combines the CustomerFacts of disjoint slices of the line items (e.g. chunks of one file).
+
+    Invoices are summed, which assumes an invoice never spans two slices.
+    """
+    combined = pd.concat(parts)
+    if 'CustomerName' in combined.columns:
+        combined['CustomerName'] = combined['CustomerName'].astype(object)
+    return combined.groupby(level=0).agg({col: FACT_MERGE[col] for col in combined.columns})
+
+
+def customer_month_activity(df):
+    """Returns the number of line items per (CustomerID, MonthKey)."""
+    return df.groupby(['CustomerID', 'MonthKey'], observed=True).size()
+
+
+def customer_purchase_days(df):
+    """Revenue per (CustomerID, Day) with a purchase, sorted by customer and day; several invoices of a day count once."""
+    days = df['InvoiceDate'].dt.normalize().rename('Day')
+    return df['Revenue'].groupby([df['CustomerID'], days], observed=True).sum().reset_index()
+
+
+def customer_category_firsts(df):
+    """First purchase per (CustomerID, Category), so the categories a customer had bought by any date can be counted."""
+    if 'Category' not in df.columns:
+        return pd.DataFrame({'CustomerID': pd.Series(dtype='int64'), 'Category': pd.Series(dtype=object),
+                             'FirstPurchase': pd.Series(dtype='datetime64[ns]')})
+    firsts = df.groupby(['CustomerID', 'Category'], observed=True)['InvoiceDate'].min()
+    return firsts.rename('FirstPurchase').reset_index()
+
+
+def _batch_customers(frame, delta):
+    # Rows of frame whose customer appears in the batch delta
+    return frame['CustomerID'].isin(delta['CustomerID'].unique()).to_numpy()
+
+
+def merge_customer_days(days, delta):
+    """Folds a batch's customer_purchase_days into existing ones, regrouping only the batch's customers.
+
+    A day bought on in both batches sums its revenue.
+    """
+    if days is None:
+        return delta
+    affected = _batch_customers(days, delta)
+    combined = pd.concat([days[affected], delta], ignore_index=True)
+    merged = combined.groupby(['CustomerID', 'Day'], observed=True)['Revenue'].sum().reset_index()
+    return pd.concat([days[~affected], merged], ignore_index=True).sort_values(['CustomerID', 'Day'], ignore_index=True)
+
+
+def merge_category_firsts(firsts, delta):
+    """Folds a batch's customer_category_firsts into existing ones, regrouping only the batch's customers.
+
+    The earlier first purchase of a (customer, category) is kept.
+    """
+    if firsts is None:
+        return delta
+    affected = _batch_customers(firsts, delta)
+    combined = concat_typed([firsts[affected], delta])
+    merged = combined.groupby(['CustomerID', 'Category'], observed=True)['FirstPurchase'].min().reset_index()
+    return concat_typed([firsts[~affected], merged]).sort_values(['CustomerID', 'Category'], ignore_index=True)
@@ -1,9 +1,14 @@
 import pandas as pd
 import streamlit as st
+from utils.dates import parse_dates
+from utils.instrumentation import tracked_cache
 
-@st.cache_data
+@tracked_cache("data_loader.load_data", st.cache_data)
 def load_data():
     df = pd.read_csv("data/data.csv")
-    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], format="%d-%m-%Y %H:%M", errors='coerce')
+    # Sniffed format, each distinct date string parsed once (the file has dates without a time)
+    df['InvoiceDate'], date_report = parse_dates(df['InvoiceDate'])
+    if date_report['unparsed']:
+        st.warning(f"⚠ {date_report['unparsed']:,} invoice dates could not be parsed and are missing (NaT).")
     df['Revenue'] = df['UnitPrice'] * df['Quantity']
     return df
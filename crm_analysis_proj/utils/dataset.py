@@ -0,0 +1,152 @@
+import threading
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from utils.cube import build_cube
+from utils.customer_facts import (
+    build_customer_facts, customer_category_firsts, customer_month_activity, customer_purchase_days,
+)
+from utils.instrumentation import span
+from utils.rfm import build_rfm_sketches
+from utils.rollups import build_monthly_totals, build_product_totals
+
+PROFIT_MARGIN = 0.3
+
+# MonthKey value for rows whose InvoiceDate could not be parsed
+MISSING_MONTH = -1
+
+
+def month_key(dates):
+    """Encodes datetimes as int32 months since year 0 (year * 12 + month - 1)."""
+    keys = dates.dt.year * 12 + dates.dt.month - 1
+    return keys.fillna(MISSING_MONTH).astype('int32')
+
+
+def month_start(keys):
+    """Returns the first-of-month timestamps for an array of month keys."""
+    keys = np.asarray(keys, dtype='int64')
+    return pd.to_datetime(pd.DataFrame({'year': keys // 12, 'month': keys % 12 + 1, 'day': 1}))
+
+
+def month_label(keys):
+    """Returns 'YYYY-MM' labels for an array of month keys."""
+    return month_start(keys).dt.strftime('%Y-%m')
+
+
+@dataclass(frozen=True, eq=False)
+class Dataset:
+    """Preprocessed invoice data shared, read-only, by every page.
+
+    Derived columns (Revenue, Profit, MonthKey) are computed once in
+    prepare_dataset, which also sorts the rows by InvoiceDate so date
+    filters can binary-search the frame itself; pages read them through
+    ``frame`` and never write back.
+    Aggregates are built on first use, unless they were supplied already
+    computed. Concurrent readers of an aggregate that is still being built
+    wait for it instead of rebuilding it.
+    """
+    _frame: pd.DataFrame = field(repr=False)
+    fingerprint: str
+    _aggregates: dict = field(default_factory=dict, repr=False)
+    _building: dict = field(default_factory=dict, repr=False)
+
+    @property
+    def frame(self):
+        """A shallow copy-on-write view of the data; writes to it never reach the shared frame."""
+        return self._frame.copy(deep=False)
+
+    @property
+    def columns(self):
+        return self._frame.columns
+
+    @property
+    def empty(self):
+        return self._frame.empty
+
+    def __len__(self):
+        return len(self._frame)
+
+    def _aggregate(self, name, build):
+        if name not in self._aggregates:
+            with self._building.setdefault(name, threading.Lock()):
+                if name not in self._aggregates:
+                    with span(f"aggregate.{name}", rows=len(self._frame)):
+                        self._aggregates[name] = build(self._frame)
+        return self._aggregates[name]
+
+    @cached_property
+    def reference_date(self):
+        """Latest invoice date in the dataset."""
+        return self._frame['InvoiceDate'].max()
+
+    @property
+    def customer_facts(self):
+        """The per-customer fact table."""
+        return self._aggregate('customer_facts', build_customer_facts)
+
+    @property
+    def customer_months(self):
+        """Line-item counts per (CustomerID, MonthKey)."""
+        return self._aggregate('customer_months', customer_month_activity)
+
+    @property
+    def customer_days(self):
+        """Revenue per (CustomerID, Day) with a purchase, the purchase history behind the churn features."""
+        return self._aggregate('customer_days', customer_purchase_days)
+
+    @property
+    def customer_categories(self):
+        """First purchase per (CustomerID, Category)."""
+        return self._aggregate('customer_categories', customer_category_firsts)
+
+    @property
+    def monthly_totals(self):
+        """Revenue, quantity, unit-price and line totals per MonthKey."""
+        return self._aggregate('monthly_totals', build_monthly_totals)
+
+    @property
+    def product_totals(self):
+        """Quantity, revenue and line totals per (StockCode, Description)."""
+        return self._aggregate('product_totals', build_product_totals)
+
+    @property
+    def cube(self):
+        """Month x country x category x manufacturer cube serving the overview."""
+        return self._aggregate('cube', build_cube)
+
+    @property
+    def rfm_sketches(self):
+        """Per-cohort quantile sketches of the RFM inputs, built from the customer facts."""
+        return self._aggregate('rfm_sketches', lambda df: build_rfm_sketches(self.customer_facts))
+
+
+def add_derived_columns(df):
+    """Adds Revenue, Profit and MonthKey to a typed ingest frame in place."""
+    df['Revenue'] = df['UnitPrice'].astype('float64') * df['Quantity']
+    df['Profit'] = df['Revenue'] * PROFIT_MARGIN
+    df['MonthKey'] = month_key(df['InvoiceDate'])
+    return df
+
+
+def date_order(dates):
+    """Row positions that sort datetime64 values stably, missing ones last; None when already sorted."""
+    dated = dates[:len(dates) - int(np.isnat(dates).sum())]
+    if not np.isnat(dated).any() and (dated[1:] >= dated[:-1]).all():
+        return None
+    return np.argsort(dates, kind='stable')
+
+
+def sort_by_date(df):
+    """Rows in InvoiceDate order; df itself when already in that order."""
+    order = date_order(df['InvoiceDate'].to_numpy())
+    return df if order is None else df.take(order).reset_index(drop=True)
+
+
+def prepare_dataset(df, fingerprint, aggregates=None):
+    """Adds the derived columns to a typed ingest frame, sorts it by date and wraps it in a Dataset."""
+    if 'MonthKey' not in df.columns:
+        add_derived_columns(df)
+    return Dataset(sort_by_date(df), fingerprint, dict(aggregates or {}))
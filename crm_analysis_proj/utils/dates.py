@@ -0,0 +1,126 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+# Formats tried, in order, when sniffing a date column; day-first forms come
+# before month-first ones because the bundled data is day-first
+CANDIDATE_FORMATS = [
+    "%d-%m-%Y",
+    "%d-%m-%Y %H:%M",
+    "%d-%m-%Y %H:%M:%S",
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%d/%m/%Y",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%m/%d/%Y",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %H:%M:%S",
+    "%d.%m.%Y",
+    "%d.%m.%Y %H:%M",
+]
+
+# Distinct values the format is sniffed from
+SAMPLE_SIZE = 1000
+
+
+def _parse(values, fmt):
+    return pd.to_datetime(pd.Index(values), format=fmt, errors='coerce')
+
+
+def sniff_format(values, formats=CANDIDATE_FORMATS, sample_size=SAMPLE_SIZE):
+    """Returns the format parsing the most of a sample of distinct date strings, or None.
+
+    The sample is spread evenly over values, so a day > 12 somewhere in it
+    settles day-first vs month-first. Ties go to the earlier format.
+    """
+    values = pd.Index(values).dropna()
+    if len(values) > sample_size:
+        values = values[np.linspace(0, len(values) - 1, sample_size).astype('int64')]
+    if values.empty:
+        return None
+
+    best, best_parsed = None, 0
+    for fmt in formats:
+        parsed = int(_parse(values, fmt).notna().sum())
+        if parsed > best_parsed:
+            best, best_parsed = fmt, parsed
+            if parsed == len(values):
+                break
+    return best
+
+
+class DateParser:
+    """Parses date strings with a sniffed format, converting each distinct string only once.
+
+    The format is sniffed on the first call and reused for later ones, so
+    the chunks of one file are read alike (per-chunk inference can flip
+    between day-first and month-first). Strings that don't match it become
+    NaT rather than being retried against the other candidates, which would
+    silently read a mixed day-first/month-first column; they are counted as
+    unparsed so the caller can warn. Counts accumulate across calls, so a
+    chunked load reports its unparsed dates in total.
+    """
+
+    def __init__(self, formats=CANDIDATE_FORMATS, sample_size=SAMPLE_SIZE):
+        self.formats = formats
+        self.sample_size = sample_size
+        self.format = None
+        self.rows = 0
+        self.missing = 0
+        self.unparsed = 0
+        self.seconds = 0.0
+
+    def _parse_unique(self, uniques):
+        if self.format is None:
+            # Nothing matched the candidates: fall back to per-value inference, still once per distinct string
+            parsed = pd.to_datetime(uniques, format='mixed', errors='coerce')
+            return np.asarray(parsed, dtype='datetime64[ns]')
+
+        return np.asarray(_parse(uniques, self.format), dtype='datetime64[ns]')
+
+    def parse(self, values):
+        """Returns values (a Series of strings) as a datetime64[ns] Series; unparseable strings become NaT."""
+        start = time.perf_counter()
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            self.rows += len(values)
+            self.missing += int(values.isna().sum())
+            return values
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, uniques = pd.factorize(values)
+        uniques = pd.Index(uniques).astype(str)
+        if self.format is None:
+            self.format = sniff_format(uniques, self.formats, self.sample_size)
+
+        parsed = self._parse_unique(uniques)
+        # Code -1 (a missing value) maps to the trailing NaT
+        dates = np.append(parsed, np.datetime64('NaT'))[codes]
+
+        missing = int((codes == -1).sum())
+        self.rows += len(values)
+        self.missing += missing
+        self.unparsed += int(np.isnat(dates).sum()) - missing
+        self.seconds += time.perf_counter() - start
+        return pd.Series(dates, index=values.index, name=values.name)
+
+    def report(self):
+        """Returns the format used and the row, missing, unparsed (NaT from a non-empty string) and time totals."""
+        return {
+            'format': self.format,
+            'rows': self.rows,
+            'missing': self.missing,
+            'unparsed': self.unparsed,
+            'seconds': self.seconds,
+        }
+
+
+def parse_dates(values, formats=CANDIDATE_FORMATS):
+    """Parses one Series of date strings; returns the datetime Series and the DateParser report."""
+    parser = DateParser(formats)
+    return parser.parse(values), parser.report()
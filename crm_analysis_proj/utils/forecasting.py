@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from utils.ingest import CACHE_ROOT, content_hash
+from utils.instrumentation import emit, span
+
+FORECAST_DIR = os.path.join(CACHE_ROOT, "forecasts")
+
+DEFAULT_ORDER = (2, 1, 2)
+
+# How long a page waits for a new fit before falling back to the last cached forecast
+FIT_WAIT_SECONDS = 2.0
+
+_executor = None
+_pending = {}
+_lock = threading.RLock()
+
+
+def forecast_key(values, order, steps):
+    """Hashes an input series together with the model order and horizon."""
+    values = np.ascontiguousarray(values, dtype='float64')
+    return content_hash(values.tobytes() + f"|{tuple(order)}|{steps}".encode())
+
+
+def fit_arima(values, order, steps):
+    """Fits ARIMA(order) on values and forecasts steps ahead. Runs inside the worker pool."""
+    from statsmodels.tsa.arima.model import ARIMA
+
+    start = time.perf_counter()
+    try:
+        fitted = ARIMA(np.asarray(values, dtype='float64'), order=order).fit()
+        forecast = fitted.forecast(steps=steps).tolist()
+        error = None
+    except Exception as e:
+        forecast = None
+        error = str(e)
+
+    return {
+        'forecast': forecast,
+        'error': error,
+        'order': list(order),
+        'steps': steps,
+        'observations': len(values),
+        'fit_seconds': time.perf_counter() - start,
+        'fitted_at': time.time(),
+    }
+
+
+def _path(name):
+    return os.path.join(FORECAST_DIR, f"{name}.json")
+
+
+def _read(name):
+    if not os.path.exists(_path(name)):
+        return None
+    with open(_path(name)) as f:
+        return json.load(f)
+
+
+def _write(name, result):
+    os.makedirs(FORECAST_DIR, exist_ok=True)
+    tmp_path = f"{_path(name)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(result, f)
+    os.replace(tmp_path, _path(name))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=2)
+    return _executor
+
+
+def _reset_executor():
+    """Drops a pool broken by a dead worker, so the next fit starts a fresh one."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        emit('forecast_pool_reset')
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _fallback(series_name, error):
+    """The last forecast of series_name as "stale", or an error result when there is none."""
+    latest = _read(f"latest-{series_name}")
+    if latest is not None:
+        return latest, "stale"
+    return {'forecast': None, 'error': error}, "error"
+
+
+def _persist(key, series_name, future):
+    with _lock:
+        _pending.pop(key, None)
+    if future.exception() is not None:
+        return
+    result = dict(future.result(), key=key)
+    # The fit itself ran in a worker process; record its timing here
+    emit('span', name="arima_fit", seconds=result['fit_seconds'], series=series_name,
+         observations=result['observations'], error=result['error'])
+    _write(key, result)
+    if result['error'] is None:
+        _write(f"latest-{series_name}", result)
+
+
+def get_forecast(series_name, values, order=DEFAULT_ORDER, steps=6, wait=FIT_WAIT_SECONDS):
+    """Returns (result, status) for an ARIMA forecast of values.
+
+    Results are cached on disk by forecast_key, so unchanged inputs never
+    refit, even across restarts. A new fit runs in a process pool; if it takes
+    longer than wait seconds the last forecast stored under series_name is
+    returned with status "stale" (or None with status "pending") while the fit
+    finishes in the background. If a worker dies the pool is replaced for
+    the next call and the last forecast is returned as "stale" (or an error
+    result with status "error"). Otherwise status is "ready". Each result
+    carries its fit timing under 'fit_seconds'.
+    """
+    key = forecast_key(values, order, steps)
+    cached = _read(key)
+    if cached is not None:
+        return cached, "ready"
+
+    with _lock:
+        future = _pending.get(key)
+        if future is None:
+            try:
+                future = _get_executor().submit(fit_arima, [float(v) for v in values], tuple(order), steps)
+            except BrokenProcessPool:
+                _reset_executor()
+                return _fallback(series_name, "The forecasting worker stopped unexpectedly")
+            _pending[key] = future
+            future.add_done_callback(lambda done: _persist(key, series_name, done))
+
+    try:
+        with span("forecast_wait", series=series_name):
+            result = future.result(timeout=wait)
+    except TimeoutError:
+        latest = _read(f"latest-{series_name}")
+        return latest, "stale" if latest is not None else "pending"
+    except BrokenProcessPool:
+        _reset_executor()
+        return _fallback(series_name, "The forecasting worker stopped unexpectedly")
+
+    return dict(result, key=key), "ready"
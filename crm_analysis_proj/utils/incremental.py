@@ -0,0 +1,251 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+from functools import partial
+
+import pandas as pd
+
+from utils.cube import build_cube, merge_cubes
+from utils.customer_facts import (
+    build_customer_facts, customer_category_firsts, customer_month_activity, customer_purchase_days,
+    merge_category_firsts, merge_customer_days, merge_customer_facts,
+)
+from utils.dataset import add_derived_columns
+from utils.ingest import CACHE_ROOT, content_hash, read_arrow, write_arrow
+from utils.rfm import update_rfm_sketches
+from utils.rollups import build_monthly_totals, build_product_totals, merge_totals
+
+STORE_DIR = os.path.join(CACHE_ROOT, "incremental")
+
+# Checkpointed aggregates: name -> (build from one batch, fold into the existing state)
+AGGREGATES = {
+    'customer_facts': (build_customer_facts, merge_customer_facts),
+    'customer_months': (customer_month_activity, merge_totals),
+    'customer_days': (customer_purchase_days, merge_customer_days),
+    'customer_categories': (customer_category_firsts, merge_category_firsts),
+    'monthly_totals': (build_monthly_totals, merge_totals),
+    'product_totals': (build_product_totals, merge_totals),
+    # The cube keeps its (Cell, InvoiceNo) pairs, so exact order counts need no line items
+    'cube': (partial(build_cube, order_pairs=True), merge_cubes),
+}
+
+# Aggregates that are Series rather than DataFrames
+SERIES_AGGREGATES = {'customer_months'}
+
+# Aggregates that are objects rather than frames, checkpointed as pickles; the RFM sketches
+# follow the merged customer facts rather than a batch of their own
+PICKLED_AGGREGATES = {'cube', 'rfm_sketches'}
+
+CHECKPOINTED = [*AGGREGATES, 'rfm_sketches']
+
+
+class IncrementalStore:
+    """Append-only invoice history with checkpointed aggregates on local disk.
+
+    Appending a batch builds its aggregates from the batch alone and folds
+    them into the stored state, so the work scales with the batch (and the
+    size of the aggregates), not with the full history. Every aggregate a
+    page reads is checkpointed, along with the history's columns, row count
+    and latest invoice date, so the history opens as a HistoryDataset
+    without reading the batches back. Layout under path:
+
+        manifest.json               applied batch fingerprints, generation and history summary
+        batches/<fingerprint>.arrow typed line items of each batch
+        gen-<n>/<aggregate>.parquet aggregate state after generation n (.pkl for the cube and sketches)
+    """
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        self._lock = threading.Lock()
+        self.manifest = self._read_manifest()
+        self.aggregates = self._read_aggregates(self.generation)
+        if self.batches and not self._complete():
+            self._rebuild()
+
+    @property
+    def generation(self):
+        return self.manifest['generation']
+
+    @property
+    def batches(self):
+        return self.manifest['batches']
+
+    @property
+    def fingerprint(self):
+        """Identifies the history as the ordered list of applied batches."""
+        return content_hash("\n".join(self.batches).encode())
+
+    def _manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+
+    def _batch_path(self, fingerprint):
+        return os.path.join(self.path, "batches", f"{fingerprint}.arrow")
+
+    def _generation_dir(self, generation):
+        return os.path.join(self.path, f"gen-{generation:06d}")
+
+    def _aggregate_path(self, directory, name):
+        return os.path.join(directory, f"{name}.pkl" if name in PICKLED_AGGREGATES else f"{name}.parquet")
+
+    def _read_manifest(self):
+        if not os.path.exists(self._manifest_path()):
+            return {'generation': 0, 'batches': []}
+        with open(self._manifest_path()) as f:
+            return json.load(f)
+
+    def _read_aggregates(self, generation):
+        aggregates = {}
+        directory = self._generation_dir(generation)
+        for name in CHECKPOINTED:
+            path = self._aggregate_path(directory, name)
+            if not os.path.exists(path):
+                continue
+            if name in PICKLED_AGGREGATES:
+                with open(path, "rb") as f:
+                    aggregates[name] = pickle.load(f)
+            else:
+                value = pd.read_parquet(path)
+                aggregates[name] = value.iloc[:, 0] if name in SERIES_AGGREGATES else value
+        return aggregates
+
+    def _complete(self):
+        """Whether the checkpoint holds everything a HistoryDataset serves (stores from older versions don't)."""
+        return (all(name in self.aggregates for name in CHECKPOINTED) and 'rows' in self.manifest
+                and hasattr(self.aggregates['cube'], 'cell_orders'))
+
+    def _checkpoint(self, aggregates, summary, batches):
+        generation = self.generation + 1
+        directory = self._generation_dir(generation)
+        os.makedirs(directory, exist_ok=True)
+        for name, value in aggregates.items():
+            path = self._aggregate_path(directory, name)
+            if name in PICKLED_AGGREGATES:
+                with open(path, "wb") as f:
+                    pickle.dump(value, f)
+            else:
+                frame = value.to_frame(name) if name in SERIES_AGGREGATES else value
+                frame.to_parquet(path)
+
+        # The manifest switch is the commit point; a crash before it leaves the old generation intact
+        manifest = {'generation': generation, 'batches': batches, **summary}
+        tmp_path = f"{self._manifest_path()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+
+        shutil.rmtree(self._generation_dir(self.generation), ignore_errors=True)
+        self.manifest = manifest
+        self.aggregates = aggregates
+
+    def _summary(self, df, summary=None):
+        """The history's columns, row count and latest invoice date, with the batch df folded in."""
+        summary = summary or {'columns': [], 'rows': 0, 'reference_date': None}
+        latest = [pd.Timestamp(date) for date in [summary['reference_date'], df['InvoiceDate'].max()] if pd.notna(date)]
+        return {
+            'columns': summary['columns'] + [column for column in df.columns if column not in summary['columns']],
+            'rows': summary['rows'] + len(df),
+            'reference_date': max(latest).isoformat() if latest else None,
+        }
+
+    def _fold(self, aggregates, summary, df):
+        """The aggregates and summary with the typed batch df folded in."""
+        if 'MonthKey' not in df.columns:
+            add_derived_columns(df)
+        deltas = {name: build(df) for name, (build, _) in AGGREGATES.items()}
+        merged = {name: merge(aggregates.get(name), deltas[name]) for name, (_, merge) in AGGREGATES.items()}
+        merged['rfm_sketches'] = update_rfm_sketches(
+            aggregates.get('rfm_sketches'), merged['customer_facts'], deltas['customer_facts'].index,
+            aggregates.get('customer_facts'),
+        )
+        return merged, self._summary(df, summary)
+
+    def _rebuild(self):
+        """Refolds every batch into a complete checkpoint, for a store written before some aggregate was kept."""
+        with self._lock:
+            aggregates, summary = {}, None
+            for fingerprint in self.batches:
+                aggregates, summary = self._fold(aggregates, summary, read_arrow(self._batch_path(fingerprint)))
+            self._checkpoint(aggregates, summary, self.batches)
+
+    def append(self, df, fingerprint):
+        """Folds a typed batch into the history. Returns False if the batch was already applied."""
+        with self._lock:
+            if fingerprint in self.batches:
+                return False
+
+            summary = self.manifest if self.batches else None
+            aggregates, summary = self._fold(self.aggregates, summary, df)
+            write_arrow(df, self._batch_path(fingerprint))
+            self._checkpoint(aggregates, summary, self.batches + [fingerprint])
+            return True
+
+    def dataset(self):
+        """Returns the history as a HistoryDataset served from the checkpoint."""
+        return HistoryDataset(self)
+
+
+class HistoryDataset:
+    """The incremental history as pages read a Dataset, served from the store's checkpoint.
+
+    Opening it reads no line items: the aggregates are the checkpointed
+    ones, and the columns, row count and reference date come from the
+    manifest; exact distinct counts come from the cube's (Cell, value)
+    pairs. There is no line-item ``frame``.
+    """
+
+    def __init__(self, store):
+        self.fingerprint = store.fingerprint
+        self.columns = pd.Index(store.manifest.get('columns', []))
+        self._rows = store.manifest.get('rows', 0)
+        reference_date = store.manifest.get('reference_date')
+        self.reference_date = pd.NaT if reference_date is None else pd.Timestamp(reference_date)
+        self._aggregates = store.aggregates
+
+    @property
+    def empty(self):
+        return self._rows == 0
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def customer_facts(self):
+        """The per-customer fact table."""
+        return self._aggregates['customer_facts']
+
+    @property
+    def customer_months(self):
+        """Line-item counts per (CustomerID, MonthKey)."""
+        return self._aggregates['customer_months']
+
+    @property
+    def customer_days(self):
+        """Revenue per (CustomerID, Day) with a purchase."""
+        return self._aggregates['customer_days']
+
+    @property
+    def customer_categories(self):
+        """First purchase per (CustomerID, Category)."""
+        return self._aggregates['customer_categories']
+
+    @property
+    def monthly_totals(self):
+        """Revenue, quantity, unit-price and line totals per MonthKey."""
+        return self._aggregates['monthly_totals']
+
+    @property
+    def product_totals(self):
+        """Quantity, revenue and line totals per (StockCode, Description)."""
+        return self._aggregates['product_totals']
+
+    @property
+    def cube(self):
+        """Month x country x category x manufacturer cube serving the overview."""
+        return self._aggregates['cube']
+
+    @property
+    def rfm_sketches(self):
+        """Per-cohort quantile sketches of the RFM inputs, kept in step with the customer facts."""
+        return self._aggregates['rfm_sketches']
@@ -0,0 +1,544 @@
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from utils.dates import DateParser
+
+# Root of every on-disk cache; CRM_CACHE_DIR points it elsewhere (e.g. for benchmarks)
+CACHE_ROOT = os.environ.get(
+    "CRM_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+)
+
+# Converted uploads live here, one Arrow file per distinct CSV content
+CACHE_DIR = os.path.join(CACHE_ROOT, "ingest")
+
+# Rows that fail validation are written here with their reasons, one CSV per distinct upload
+QUARANTINE_DIR = os.path.join(CACHE_ROOT, "quarantine")
+
+# Bumped whenever typing changes (e.g. date parsing), so files converted by older code are re-parsed
+SCHEMA_VERSION = 3
+
+# Columns a file must have to be loaded at all
+REQUIRED_COLUMNS = ['CustomerID', 'InvoiceDate', 'Quantity', 'UnitPrice']
+
+# Rows parsed and typed per step; bounds the untyped (object) data held at once
+CHUNK_ROWS = 250_000
+
+# Rows read to accept or reject a file before the full parse
+SNIFF_ROWS = 1000
+
+# A file whose sniffed rows are malformed at more than this rate is rejected outright
+REJECT_FRACTION = 0.5
+
+# Leading bytes of the formats accepted besides plain CSV
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+PARQUET_MAGIC = b"PAR1"
+
+# Files parsed at once by ingest_files, one worker per file
+MAX_INGEST_WORKERS = 4
+
+# Fixed ingest schema
+CATEGORY_COLUMNS = ['Country', 'Category', 'StockCode', 'Description', 'CustomerName', 'Manufacturer']
+INT32_COLUMNS = ['CustomerID', 'Quantity']
+FLOAT32_COLUMNS = ['UnitPrice']
+DATETIME_COLUMNS = ['InvoiceDate']
+
+
+def content_hash(data):
+    """Returns the hex digest used to key cached conversions of a file."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def frame_memory(df):
+    """Returns the deep memory footprint of a DataFrame in bytes."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def apply_schema(df, date_parsers=None):
+    """Casts the raw CSV columns to the fixed ingest schema.
+
+    Date columns go through a DateParser per column, taken from (or added
+    to) date_parsers when given, so chunks of one file share a sniffed
+    format and the caller can report their unparsed dates.
+    """
+    date_parsers = {} if date_parsers is None else date_parsers
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    for col in INT32_COLUMNS:
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors='coerce')
+            # Missing IDs/quantities cannot live in a plain int32 column
+            df[col] = values.astype('Int32' if values.isna().any() else 'int32')
+
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+
+    for col in DATETIME_COLUMNS:
+        if col in df.columns:
+            df[col] = date_parsers.setdefault(col, DateParser()).parse(df[col])
+
+    return df
+
+
+def concat_typed(frames):
+    """Concatenates typed frames, unifying categories so categorical columns stay categorical."""
+    frames = [frame for frame in frames if frame is not None]
+    if len(frames) == 1:
+        return frames[0]
+
+    categorical = [col for col in frames[0].columns if isinstance(frames[0][col].dtype, pd.CategoricalDtype)]
+    for col in categorical:
+        columns = [frame[col] for frame in frames if col in frame.columns]
+        dtype = pd.CategoricalDtype(union_categoricals(columns, ignore_order=True).categories)
+        frames = [
+            frame.assign(**{col: frame[col].astype(dtype)}) if col in frame.columns else frame
+            for frame in frames
+        ]
+    return pd.concat(frames, ignore_index=True)
+
+
+class ValidationError(ValueError):
+    """Raised when a file is rejected before it is parsed (wrong columns, mostly malformed rows)."""
+
+
+def _open(source):
+    # Bytes, a path or a seekable file object, ready to read from the start
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def detect_format(source):
+    """Returns "parquet", "gzip", "zstd" or "csv" for bytes, a path or a file object, from its leading bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        magic = bytes(source[:4])
+    elif hasattr(source, "read"):
+        magic = _open(source).read(4)
+        _open(source)
+    else:
+        with open(source, "rb") as f:
+            magic = f.read(4)
+    if magic.startswith(PARQUET_MAGIC):
+        return "parquet"
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return "csv"
+
+
+def read_chunks(source, chunk_rows=CHUNK_ROWS, columns=None):
+    """Iterates over a CSV (plain, gzip or zstd) or Parquet file in chunks of raw, untyped rows.
+
+    source is bytes, a path or a file object. Compressed CSVs are
+    decompressed as they are read. Categorical columns of a CSV are read as
+    strings, so a code like a StockCode is the same value whether or not a
+    given chunk happens to be all digits. With columns, only those of them
+    the file has are parsed.
+    """
+    file_format = detect_format(source)
+    if file_format == "parquet":
+        parquet = pq.ParquetFile(_open(source))
+        if columns is not None:
+            columns = [col for col in parquet.schema_arrow.names if col in columns]
+        return (batch.to_pandas() for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns))
+    return pd.read_csv(_open(source), encoding="ISO-8859-1", chunksize=chunk_rows,
+                       compression=None if file_format == "csv" else file_format,
+                       dtype={col: str for col in CATEGORY_COLUMNS},
+                       usecols=None if columns is None else (lambda col: col in columns))
+
+
+def _flag(reasons, mask, values, message):
+    # Appends "Column: 'value' message" to the reason of each flagged row
+    if mask.any():
+        reasons[mask] = reasons[mask] + values[mask].astype(str).radd(f"{values.name}: '") + f"' {message}; "
+
+
+def coerce_chunk(chunk, date_parsers=None):
+    """Types one raw chunk and splits off its malformed rows.
+
+    A row is malformed when a schema column holds a value that cannot be
+    converted: a non-number, a fractional or out-of-range count or ID, or
+    an unparseable date. Missing values are not malformed. Returns the
+    typed valid rows (categorical columns are left as raw strings, integer
+    columns as nullable Int32, so chunks can be combined) and the raw
+    malformed rows with a "Reason" column.
+    """
+    date_parsers = {} if date_parsers is None else date_parsers
+    reasons = pd.Series("", index=chunk.index, dtype=object)
+    typed = {}
+
+    for col in INT32_COLUMNS + FLOAT32_COLUMNS:
+        if col not in chunk.columns:
+            continue
+        raw = chunk[col]
+        values = pd.to_numeric(raw, errors='coerce')
+        _flag(reasons, (values.isna() & raw.notna()).to_numpy(), raw, "is not a number")
+        if col in INT32_COLUMNS:
+            fractional = (values % 1 != 0) & values.notna()
+            out_of_range = values.abs() > np.iinfo('int32').max
+            _flag(reasons, (fractional | out_of_range).to_numpy(), raw, "is not a whole number in range")
+            values = values.where(~(fractional | out_of_range))
+            typed[col] = values.astype('Int32')
+        else:
+            typed[col] = values.astype('float32')
+
+    for col in DATETIME_COLUMNS:
+        if col not in chunk.columns:
+            continue
+        raw = chunk[col]
+        values = date_parsers.setdefault(col, DateParser()).parse(raw)
+        _flag(reasons, (values.isna() & raw.notna()).to_numpy(), raw, "is not a date")
+        typed[col] = values
+
+    malformed = (reasons != "").to_numpy()
+    if not malformed.any():
+        return chunk.assign(**typed), chunk.iloc[:0].assign(Reason=reasons.iloc[:0])
+    valid = chunk.assign(**typed)[~malformed]
+    return valid, chunk[malformed].assign(Reason=reasons[malformed].str.rstrip("; "))
+
+
+def sniff_file(source, sniff_rows=SNIFF_ROWS, reject_fraction=REJECT_FRACTION):
+    """Reads only the header and first rows of a file and raises ValidationError if it can't be loaded.
+
+    Rejects a file that is empty or unreadable, lacks a REQUIRED_COLUMNS
+    column, or whose first rows are mostly malformed, before any full parse.
+    """
+    try:
+        head = next(iter(read_chunks(source, sniff_rows)), None)
+    except pd.errors.EmptyDataError:
+        raise ValidationError("The file is empty.") from None
+    except (pd.errors.ParserError, pa.ArrowException, OSError, EOFError, UnicodeDecodeError) as e:
+        raise ValidationError(f"The file is not a readable CSV or Parquet file: {e}") from None
+    finally:
+        _open(source)
+    if head is None:
+        raise ValidationError("The file has no rows.")
+
+    missing = [col for col in REQUIRED_COLUMNS if col not in head.columns]
+    if missing:
+        raise ValidationError(f"Missing required columns: {', '.join(missing)}.")
+
+    _, malformed = coerce_chunk(head)
+    if len(head) and len(malformed) > reject_fraction * len(head):
+        raise ValidationError(
+            f"{len(malformed) / len(head):.0%} of the first {len(head):,} rows are malformed, "
+            f"e.g. {malformed['Reason'].iloc[0]}."
+        )
+    return head.columns
+
+
+def row_hashes(chunk):
+    """64-bit hash of each typed row over all its columns (in name order), used to spot duplicate lines."""
+    return pd.util.hash_pandas_object(chunk[sorted(chunk.columns)], index=False).to_numpy()
+
+
+def _missing(dtype, rows):
+    # Values for rows of a file that lacks the column
+    if dtype.kind == 'M':
+        return np.full(rows, np.datetime64('NaT'), dtype=dtype)
+    if dtype.kind in 'fc':
+        return np.full(rows, np.nan, dtype=dtype)
+    return np.full(rows, None, dtype=object)
+
+
+class FrameBuilder:
+    """Assembles coerce_chunk outputs into one typed frame, column by column.
+
+    Categorical columns are encoded into int32 codes against a growing
+    category list as chunks arrive, so only codes are kept, and each column
+    is concatenated (and its chunks released) on its own in finish(). Peak
+    memory stays near the final typed frame plus one column, instead of
+    holding the raw frame and its typed copy at once. Builders of several
+    files are combined the same way by merge().
+    """
+
+    def __init__(self, hash_rows=False):
+        self.columns = []
+        self.rows = 0
+        self.hash_rows = hash_rows
+        self._parts = {}
+        self._categories = {}
+        self._hashes = []
+
+    def _encode(self, col, values):
+        codes, uniques = pd.factorize(values)
+        categories = self._categories.get(col, pd.Index([], dtype=object))
+        positions = categories.get_indexer(uniques)
+        new = positions == -1
+        if new.any():
+            positions[new] = np.arange(len(categories), len(categories) + int(new.sum()))
+            self._categories[col] = categories.append(pd.Index(uniques[new], dtype=object))
+        return np.append(positions, -1).astype('int32')[codes]
+
+    def append(self, chunk):
+        if not self.columns:
+            self.columns = list(chunk.columns)
+        for col in self.columns:
+            values = chunk[col]
+            if col in CATEGORY_COLUMNS:
+                part = self._encode(col, values)
+            elif col in INT32_COLUMNS:
+                part = (values.to_numpy(dtype='int32', na_value=0), values.isna().to_numpy())
+            else:
+                part = values.to_numpy()
+            self._parts.setdefault(col, []).append(part)
+        if self.hash_rows:
+            self._hashes.append(row_hashes(chunk))
+        self.rows += len(chunk)
+
+    def _take(self, col, keep):
+        # This builder's part of col, concatenated, filtered by keep, and released from the builder
+        parts = self._parts.pop(col)
+        if col in INT32_COLUMNS:
+            values = np.concatenate([part[0] for part in parts])[keep]
+            return values, np.concatenate([part[1] for part in parts])[keep]
+        return np.concatenate(parts)[keep]
+
+    @classmethod
+    def merge(cls, builders, deduplicate=False):
+        """Builds one typed frame from several builders' rows, in builder order.
+
+        With deduplicate, a row whose hash already occurred in an earlier
+        builder (an overlapping export) is dropped; repeats within one
+        builder are kept. Columns missing from some builders are filled
+        with missing values. Returns the frame and the number of rows dropped.
+        """
+        keeps = []
+        seen = np.empty(0, dtype='uint64')
+        for builder in builders:
+            if deduplicate and builder.hash_rows and builder._hashes:
+                hashes = np.concatenate(builder._hashes)
+                # pandas' hash tables: far faster than the sort-based np.isin/np.union1d on 64-bit keys
+                keeps.append(~pd.Series(hashes).isin(seen).to_numpy())
+                seen = np.concatenate([seen, pd.unique(hashes)])
+            else:
+                keeps.append(np.ones(builder.rows, dtype=bool))
+            builder._hashes = []
+        dropped = sum(len(keep) - int(keep.sum()) for keep in keeps)
+
+        columns = list(dict.fromkeys(col for builder in builders for col in builder.columns))
+        data = {}
+        for col in columns:
+            present = [(builder, keep) for builder, keep in zip(builders, keeps) if col in builder._parts]
+            if col in CATEGORY_COLUMNS:
+                # Sorted union of the builders' categories, as astype('category') gives
+                categories = pd.Index(sorted({
+                    str(value) for builder, _ in present for value in builder._categories.get(col, [])
+                }), dtype=object)
+                codes = []
+                for builder, keep in zip(builders, keeps):
+                    if col not in builder._parts:
+                        codes.append(np.full(int(keep.sum()), -1, dtype='int32'))
+                        continue
+                    own = builder._categories.get(col, pd.Index([], dtype=object)).astype(str)
+                    remap = np.append(categories.get_indexer(own), -1).astype('int32')
+                    codes.append(remap[builder._take(col, keep)])
+                data[col] = pd.Categorical.from_codes(np.concatenate(codes), categories)
+            elif col in INT32_COLUMNS:
+                values, masks = [], []
+                for builder, keep in zip(builders, keeps):
+                    if col in builder._parts:
+                        part_values, part_mask = builder._take(col, keep)
+                    else:
+                        part_values = np.zeros(int(keep.sum()), dtype='int32')
+                        part_mask = np.ones(int(keep.sum()), dtype=bool)
+                    values.append(part_values)
+                    masks.append(part_mask)
+                values, mask = np.concatenate(values), np.concatenate(masks)
+                # Missing IDs/quantities cannot live in a plain int32 column
+                data[col] = pd.arrays.IntegerArray(values, mask) if mask.any() else values
+            else:
+                parts = [
+                    builder._take(col, keep) if col in builder._parts else None
+                    for builder, keep in zip(builders, keeps)
+                ]
+                dtype = next(part.dtype for part in parts if part is not None)
+                data[col] = np.concatenate([
+                    part if part is not None else _missing(dtype, int(keep.sum()))
+                    for part, keep in zip(parts, keeps)
+                ])
+        return pd.DataFrame(data, copy=False), dropped
+
+    def finish(self):
+        """Returns the typed frame; the builder's chunks are released as each column is built."""
+        return FrameBuilder.merge([self])[0]
+
+
+def write_quarantine(malformed, path, header):
+    """Appends malformed rows (with their Reason) to a quarantine CSV, creating it with a header first."""
+    if malformed.empty:
+        return 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    malformed.to_csv(path, mode="w" if header else "a", header=header, index=False)
+    return len(malformed)
+
+
+def read_arrow(path):
+    """Memory-maps an uncompressed Arrow file back into a DataFrame."""
+    table = feather.read_table(path, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def write_arrow(df, path):
+    """Atomically writes a DataFrame as an uncompressed (memory-mappable) Arrow file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def _ingest_file(data, quarantine_path, chunk_rows, hash_rows):
+    """Reads, types and validates one file into a FrameBuilder; runs in an ingest worker."""
+    sniff_file(data)
+    builder = FrameBuilder(hash_rows)
+    date_parsers = {}
+    quarantined = 0
+    memory_before = 0
+    for chunk in read_chunks(data, chunk_rows):
+        memory_before += frame_memory(chunk)
+        valid, malformed = coerce_chunk(chunk, date_parsers)
+        builder.append(valid)
+        quarantined += write_quarantine(malformed, quarantine_path, header=quarantined == 0)
+        del chunk, valid, malformed
+    return builder, {
+        'format': detect_format(data),
+        'rows': builder.rows,
+        'memory_before': memory_before,
+        'dates': {col: parser.report() for col, parser in date_parsers.items()},
+        'quarantined': quarantined,
+        'quarantine_path': quarantine_path if quarantined else None,
+    }
+
+
+def _combine_dates(reports):
+    # One DateParser summary per column across files (formats listed once each)
+    dates = {}
+    for report in reports:
+        for col, date_report in report['dates'].items():
+            combined = dates.setdefault(col, {'format': None, 'rows': 0, 'missing': 0, 'unparsed': 0, 'seconds': 0.0})
+            formats = [fmt for fmt in (combined['format'] or "").split(", ") if fmt]
+            if date_report['format'] and date_report['format'] not in formats:
+                formats.append(date_report['format'])
+            combined['format'] = ", ".join(formats) or None
+            for key in ('rows', 'missing', 'unparsed', 'seconds'):
+                combined[key] += date_report[key]
+    return dates
+
+
+def ingest_files(files, cache_dir=CACHE_DIR, quarantine_dir=QUARANTINE_DIR, chunk_rows=CHUNK_ROWS,
+                 max_workers=MAX_INGEST_WORKERS):
+    """Loads one or more files (CSV, gzip/zstd CSV or Parquet bytes) as one typed DataFrame.
+
+    Each file is sniffed first (sniff_file), so a wrong file fails in
+    milliseconds with ValidationError, then read, typed and validated in
+    chunks by its own worker; malformed rows are left out and written with
+    their reasons to a quarantine CSV per file. The files' builders are
+    merged column by column in the given order, dropping lines already seen
+    in an earlier file (overlapping exports) by row hash. Each distinct set
+    of files is parsed only once: the result is cached as Arrow.
+
+    Returns the frame and a report with the fingerprint, whether the Arrow
+    cache was hit, parse/load time, memory of the raw and typed data,
+    duplicates dropped, and the per-file, date and quarantine results.
+    """
+    fingerprints = [content_hash(data) for data in files]
+    fingerprint = fingerprints[0] if len(files) == 1 else content_hash("|".join(fingerprints).encode())
+    path = os.path.join(cache_dir, f"{fingerprint}-v{SCHEMA_VERSION}.arrow")
+    start = time.perf_counter()
+
+    if os.path.exists(path):
+        df = read_arrow(path)
+        return df, {
+            'fingerprint': fingerprint,
+            'cache_hit': True,
+            'rows': len(df),
+            'seconds': time.perf_counter() - start,
+            'memory_before': None,
+            'memory_after': frame_memory(df),
+        }
+
+    hash_rows = len(files) > 1
+    jobs = [
+        (data, os.path.join(quarantine_dir, f"{file_fingerprint}.csv"), chunk_rows, hash_rows)
+        for data, file_fingerprint in zip(files, fingerprints)
+    ]
+    if len(jobs) == 1:
+        results = [_ingest_file(*jobs[0])]
+    else:
+        # Threads: decompression, CSV tokenizing and Parquet decoding release the GIL
+        with ThreadPoolExecutor(max_workers=min(len(jobs), max_workers), thread_name_prefix="ingest") as executor:
+            results = list(executor.map(lambda job: _ingest_file(*job), jobs))
+    builders, reports = [builder for builder, _ in results], [report for _, report in results]
+
+    df, duplicates = FrameBuilder.merge(builders, deduplicate=True)
+    del builders, results
+    seconds = time.perf_counter() - start
+    write_arrow(df, path)
+
+    quarantine_paths = [report['quarantine_path'] for report in reports if report['quarantine_path']]
+    return df, {
+        'fingerprint': fingerprint,
+        'cache_hit': False,
+        'rows': len(df),
+        'seconds': seconds,
+        'memory_before': sum(report['memory_before'] for report in reports),
+        'memory_after': frame_memory(df),
+        'files': reports,
+        'duplicates': duplicates,
+        'dates': _combine_dates(reports),
+        'quarantined': sum(report['quarantined'] for report in reports),
+        'quarantine_path': ", ".join(quarantine_paths) or None,
+    }
+
+
+def ingest_csv(data, cache_dir=CACHE_DIR, quarantine_dir=QUARANTINE_DIR, chunk_rows=CHUNK_ROWS):
+    """Loads one file's bytes as a typed DataFrame; see ingest_files."""
+    return ingest_files([data], cache_dir, quarantine_dir, chunk_rows)
+
+
+def format_report(report):
+    """Formats an ingest report as a short human-readable summary."""
+    mb = 1024 * 1024
+    if report['cache_hit']:
+        return (f"Loaded {report['rows']:,} rows from cache in {report['seconds']:.2f}s "
+                f"({report['memory_after'] / mb:,.1f} MB).")
+    files = f" from {len(report['files'])} files" if len(report.get('files', [])) > 1 else ""
+    duplicates = f" Dropped {report['duplicates']:,} duplicate lines." if report.get('duplicates') else ""
+    return (f"Parsed {report['rows']:,} rows{files} in {report['seconds']:.2f}s; "
+            f"memory {report['memory_before'] / mb:,.1f} MB → {report['memory_after'] / mb:,.1f} MB."
+            f"{format_date_report(report.get('dates'))}"
+            f"{duplicates}{format_quarantine_report(report)}")
+
+
+def format_date_report(dates):
+    """Summarizes DateParser reports by column, flagging dates that could not be parsed."""
+    parts = []
+    for col, date_report in (dates or {}).items():
+        parts.append(f" {col}: {date_report['format'] or 'inferred'} format")
+        if date_report['unparsed']:
+            parts.append(f", {date_report['unparsed']:,} unparsed")
+        parts.append(".")
+    return "".join(parts)
+
+
+def format_quarantine_report(report):
+    """Notes how many malformed rows were quarantined, and where."""
+    if not report.get('quarantined'):
+        return ""
+    return f" {report['quarantined']:,} malformed rows quarantined to {report['quarantine_path']}."
@@ -0,0 +1,199 @@
+import functools
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+# Structured events are appended to this file as JSON lines when CRM_METRICS_LOG names one (off by default)
+METRICS_LOG = os.environ.get("CRM_METRICS_LOG", "")
+
+# Size at which METRICS_LOG is rotated, and how many rotated files are kept
+METRICS_LOG_BYTES = 64 * 2**20
+METRICS_LOG_BACKUPS = 3
+
+# Recent events kept in memory for the debug panel
+MAX_EVENTS = 1000
+
+_events = deque(maxlen=MAX_EVENTS)
+_sequence = itertools.count()
+_lock = threading.Lock()
+_metrics_logger = None
+
+# Reruns started and not yet finished, across sessions; one that never finishes drops out when collected
+_in_flight = weakref.WeakSet()
+
+# Calls and misses of the Streamlit-cached loaders, by name (Streamlit itself exposes no counters)
+CACHE_CALLS = {}
+
+
+def _metrics_log():
+    """The logger writing METRICS_LOG, whose file is opened once on first use; None when the log is off."""
+    global _metrics_logger
+    if METRICS_LOG and _metrics_logger is None:
+        with _lock:
+            if _metrics_logger is None:
+                os.makedirs(os.path.dirname(os.path.abspath(METRICS_LOG)), exist_ok=True)
+                handler = RotatingFileHandler(METRICS_LOG, maxBytes=METRICS_LOG_BYTES, backupCount=METRICS_LOG_BACKUPS)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger = logging.getLogger("crm.metrics")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                logger.addHandler(handler)
+                _metrics_logger = logger
+    return _metrics_logger
+
+
+def emit(event, **fields):
+    """Records one structured event in memory and, when enabled, as a line of METRICS_LOG."""
+    record = {'ts': time.time(), 'event': event, 'thread': threading.current_thread().name, **fields}
+    with _lock:
+        record['seq'] = next(_sequence)
+        _events.append(record)
+    # The handler serializes its own writes, so file I/O stays outside the event lock
+    logger = _metrics_log()
+    if logger is not None:
+        logger.info(json.dumps(record, default=str))
+    return record
+
+
+@contextmanager
+def span(name, **fields):
+    """Times the enclosed block as a "span" event; fields added to the yielded dict are recorded too."""
+    extra = dict(fields)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield extra
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        emit('span', name=name, seconds=time.perf_counter() - start, error=error, **extra)
+
+
+def events_since(sequence):
+    """Returns the in-memory events recorded after sequence (from any thread)."""
+    with _lock:
+        return [record for record in _events if record['seq'] > sequence]
+
+
+def last_sequence():
+    with _lock:
+        return _events[-1]['seq'] if _events else -1
+
+
+def rss_mb():
+    """Current and peak resident set size of the whole process in MiB; the peak is reset by reset_peak_rss where supported."""
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        return int(status['VmRSS'].split()[0]) / 1024, int(status['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError):
+        # No /proc: only the lifetime peak is available (ru_maxrss is KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def reset_peak_rss():
+    """Resets the process peak RSS (Linux clear_refs), for every thread; returns False where that is not possible."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def tracked_cache(name, cache):
+    """Applies a Streamlit cache decorator while counting calls and misses under CACHE_CALLS[name].
+
+    The miss counter sits inside the cached function, so it only moves when
+    Streamlit actually runs it; hits are the calls that did not.
+    """
+    counts = CACHE_CALLS.setdefault(name, {'calls': 0, 'misses': 0})
+
+    def decorate(func):
+        @functools.wraps(func)
+        def body(*args, **kwargs):
+            counts['misses'] += 1
+            with span(name):
+                return func(*args, **kwargs)
+
+        cached = cache(body)
+
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            counts['calls'] += 1
+            return cached(*args, **kwargs)
+
+        call.clear = cached.clear
+        return call
+
+    return decorate
+
+
+def cache_stats(page_cache):
+    """Hit/miss counters of the page cache and the tracked Streamlit caches."""
+    stats = {
+        'page_cache': {
+            'hits': page_cache.hits,
+            'misses': page_cache.misses,
+            'waits': page_cache.waits,
+            'evictions': page_cache.evictions,
+            'entries': len(page_cache),
+            'mb': page_cache.bytes / 2**20,
+        }
+    }
+    for name, counts in CACHE_CALLS.items():
+        stats[name] = {'hits': counts['calls'] - counts['misses'], 'misses': counts['misses']}
+    return stats
+
+
+class Rerun:
+    """One script run: its wall time, the spans recorded meanwhile, peak memory and cache counters.
+
+    The peak is the process's, which sessions share. It is reset only when
+    no other rerun is in flight, so a run never clobbers another's peak, and
+    it is reported as this run's (peak_scope 'rerun') only when no other
+    run overlapped it; otherwise it is the process peak ('process').
+    """
+
+    def __init__(self, page=None):
+        self.page = page
+        with _lock:
+            alone = not _in_flight
+            for other in _in_flight:
+                other.overlapped = True
+            self.overlapped = not alone
+            _in_flight.add(self)
+        self.peak_reset = alone and reset_peak_rss()
+        self.start_sequence = last_sequence()
+        self.start = time.perf_counter()
+        self.summary = None
+
+    def finish(self, page_cache):
+        """Emits and returns the "rerun" event; spans from background threads overlapping the run are included."""
+        rss, peak = rss_mb()
+        with _lock:
+            _in_flight.discard(self)
+            own_peak = self.peak_reset and not self.overlapped
+        spans = [record for record in events_since(self.start_sequence) if record['event'] == 'span']
+        self.summary = emit(
+            'rerun',
+            page=self.page,
+            seconds=time.perf_counter() - self.start,
+            rss_mb=rss,
+            peak_rss_mb=peak,
+            peak_scope='rerun' if own_peak else 'process',
+            spans=len(spans),
+            cache=cache_stats(page_cache),
+        )
+        return self.summary, spans
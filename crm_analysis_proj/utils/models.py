@@ -1,16 +1,15 @@
 import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
+from utils.clustering import cluster_customers
+from utils.rfm import rfm_table
 
 def kmeans_segmentation(df_rfm, clusters=4):
-    """Performs K-Means clustering on RFM data."""
-    scaler = StandardScaler()
-    rfm_scaled = scaler.fit_transform(df_rfm[['Recency', 'Frequency', 'Monetary']])
-    
-    kmeans = KMeans(n_clusters=clusters, random_state=42, n_init=10)
-    df_rfm['Cluster'] = kmeans.fit_predict(rfm_scaled)
+    """Performs K-Means clustering on RFM data (or directly on a CustomerFacts table)."""
+    if 'Recency' not in df_rfm.columns:
+        df_rfm = rfm_table(df_rfm)
+
+    df_rfm['Cluster'], _ = cluster_customers(df_rfm, n_clusters=clusters, family="kmeans_segmentation")
     
     return df_rfm
 
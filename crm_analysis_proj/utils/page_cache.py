@@ -0,0 +1,170 @@
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+import plotly.io as pio
+
+from utils.instrumentation import span
+from utils.tables import PagedTable
+
+# Bounds of the shared page cache; the least recently used entries go first
+MAX_ENTRIES = 32
+MAX_BYTES = 512 * 2**20
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def cache_key(fingerprint, page, params=None):
+    """Identifies a page render by dataset content hash, page name and widget parameters."""
+    return fingerprint, page, _freeze(params or {})
+
+
+def _table_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, PagedTable):
+        return _table_bytes(value.frame)
+    if isinstance(value, (list, tuple)):
+        return sum(_table_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_table_bytes(item) for item in value.values())
+    return 0
+
+
+def make_entry(tables, figures):
+    """Packs a page's computed tables and its Plotly figures (serialized to JSON) into a cache entry."""
+    figures = {name: pio.to_json(figure, validate=False) for name, figure in figures.items() if figure is not None}
+    size = _table_bytes(tables) + sum(len(spec) for spec in figures.values())
+    return {'tables': tables, 'figures': figures, 'bytes': size}
+
+
+def load_figure(entry, name):
+    """Rebuilds a figure from its cached JSON, or returns None when the page had no such chart."""
+    spec = entry['figures'].get(name)
+    return pio.from_json(spec) if spec is not None else None
+
+
+class PageCache:
+    """Thread-safe LRU cache of page entries, bounded by entry count and approximate bytes.
+
+    Entries are shared between reruns and sessions, so callers must treat
+    the cached tables as read-only. get_or_build lets only one caller build a
+    missing entry; concurrent callers for the same key wait for its result.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.waits = 0
+        self._entries = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous['bytes']
+            self._entries[key] = entry
+            self.bytes += entry['bytes']
+
+            # Always keep the newest entry, even if it alone exceeds max_bytes
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted['bytes']
+                self.evictions += 1
+
+    def get_or_build(self, key, build, store=None):
+        """Returns the entry for key, calling build() on a miss unless another caller is already building it.
+
+        The built entry is kept only when store(entry) is true (always, if
+        store is None); callers waiting on the build get it either way, and
+        see its exception if it raised.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            future = self._building.get(key)
+            building = future is not None
+            if building:
+                self.waits += 1
+            else:
+                self.misses += 1
+                future = self._building[key] = Future()
+        if building:
+            return future.result()
+
+        try:
+            entry = build()
+        except BaseException as e:
+            with self._lock:
+                self._building.pop(key, None)
+            future.set_exception(e)
+            raise
+        if store is None or store(entry):
+            self.put(key, entry)
+        with self._lock:
+            self._building.pop(key, None)
+        future.set_result(entry)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+PAGE_CACHE = PageCache()
+
+
+def cached_page(dataset, page, params, compute, figures, complete=None, cache=PAGE_CACHE):
+    """Returns the cache entry for one page render, computing it on a miss.
+
+    compute(dataset, **params) returns the page's tables and figures(tables)
+    its Plotly figures by name. Results for which complete(tables) is False
+    (e.g. a forecast still fitting) are returned but not stored. A render
+    already being computed elsewhere (e.g. by the precompute scheduler) is
+    waited on rather than computed twice.
+    """
+    key = cache_key(dataset.fingerprint, page, params)
+
+    def build():
+        with span("compute", page=page):
+            tables = compute(dataset, **(params or {}))
+        with span("figures", page=page):
+            return make_entry(tables, figures(tables))
+
+    store = None if complete is None else (lambda entry: complete(entry['tables']))
+    return cache.get_or_build(key, build, store)
@@ -0,0 +1,328 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from functools import cached_property
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pads
+
+from utils.cube import CUBE_DIMENSIONS, CUBE_MEASURES, DISTINCT_COLUMNS, SKETCH_DIMENSIONS, Cube
+from utils.customer_facts import FACT_AGGREGATIONS
+from utils.dataset import add_derived_columns
+from utils.instrumentation import span
+from utils.rfm import build_rfm_sketches
+from utils.sketches import HLL_PRECISION, HLLSketches
+from utils.ingest import (
+    CACHE_ROOT, CATEGORY_COLUMNS, FLOAT32_COLUMNS, INT32_COLUMNS, QUARANTINE_DIR, SCHEMA_VERSION, coerce_chunk,
+    format_date_report, format_quarantine_report, read_chunks, sniff_file, write_quarantine,
+)
+
+# Converted datasets live here, one MonthKey-partitioned Parquet directory per distinct CSV content
+PARQUET_DIR = os.path.join(CACHE_ROOT, "parquet")
+
+# CSV rows parsed and written per step, which bounds ingest memory
+CHUNK_ROWS = 1_000_000
+
+HASH_BLOCK = 16 * 2**20
+
+# SQL for each pandas reduction used by FACT_AGGREGATIONS; pandas sums of empty groups are 0, not NULL
+SQL_AGGREGATIONS = {
+    'min': "min({})",
+    'max': "max({})",
+    'nunique': "count(DISTINCT {})",
+    'size': "count(*)",
+    'sum': "coalesce(sum({}), 0)",
+    'first': "any_value({})",
+}
+
+# HyperLogLog register and rank of a column's value, as utils.sketches.register_ranks computes them
+# from a 64-bit hash; DuckDB's hash() differs from the pandas one, so estimates differ within the error
+SQL_REGISTER = f"hash({{0}}) >> {64 - HLL_PRECISION}"
+SQL_RANK = (
+    f"bit_count(((hash({{0}}) | (1::UBIGINT << {64 - HLL_PRECISION})) - 1) "
+    f"& ~(hash({{0}}) | (1::UBIGINT << {64 - HLL_PRECISION}))) + 1"
+)
+
+
+def file_hash(path):
+    """Content hash of a file read in blocks, matching content_hash of its bytes."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_partitions(df, path, batch=0):
+    """Appends a typed frame (with derived columns) to a MonthKey-partitioned Parquet directory."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Categoricals go in as plain strings: Parquet then dictionary-encodes each file with only
+    # the values it holds, instead of repeating the frame's full category list in every partition
+    for index, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(index, field.name, table.column(index).cast(field.type.value_type))
+    pads.write_dataset(
+        table, path,
+        format='parquet', partitioning=['MonthKey'], partitioning_flavor='hive',
+        basename_template=f"part-{batch}-{{i}}.parquet", existing_data_behavior='overwrite_or_ignore',
+    )
+
+
+def convert_csv(source, fingerprint, directory=PARQUET_DIR, chunk_rows=CHUNK_ROWS, quarantine_dir=QUARANTINE_DIR):
+    """Streams a CSV (plain, gzip or zstd) or Parquet file (path or file object) into partitioned Parquet.
+
+    The file is sniffed first (sniff_file raises ValidationError for a wrong
+    file), then each chunk is typed and validated like ingest_csv, with
+    malformed rows quarantined, and gets its derived columns before it is
+    written, so the whole file is never in memory. Returns the dataset
+    directory and a report with the fingerprint, whether it was already
+    converted, the row count, the conversion time and, for a new
+    conversion, the date formats used, dates left unparsed and rows
+    quarantined.
+    """
+    path = os.path.join(directory, f"{fingerprint}-v{SCHEMA_VERSION}")
+    start = time.perf_counter()
+    if os.path.exists(path):
+        return path, {'fingerprint': fingerprint, 'cache_hit': True, 'seconds': time.perf_counter() - start}
+
+    sniff_file(source)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    # One parser per date column across all chunks: the format sniffed on the first chunk is kept
+    date_parsers = {}
+    quarantine_path = os.path.join(quarantine_dir, f"{fingerprint}.csv")
+    quarantined = 0
+    with span("ingest", backend="duckdb") as fields:
+        for batch, chunk in enumerate(read_chunks(source, chunk_rows)):
+            valid, malformed = coerce_chunk(chunk, date_parsers)
+            write_partitions(add_derived_columns(valid), tmp_path, batch)
+            quarantined += write_quarantine(malformed, quarantine_path, header=quarantined == 0)
+            fields['rows'] = fields.get('rows', 0) + len(valid)
+    os.replace(tmp_path, path)
+
+    return path, {
+        'fingerprint': fingerprint,
+        'cache_hit': False,
+        'seconds': time.perf_counter() - start,
+        'dates': {col: parser.report() for col, parser in date_parsers.items()},
+        'quarantined': quarantined,
+        'quarantine_path': quarantine_path if quarantined else None,
+    }
+
+
+def _cast(column, expression, func):
+    # Keep the pandas result dtypes: integer sums as int64, float32 sums as float32
+    if func == 'sum' and column in INT32_COLUMNS:
+        return f"CAST({expression} AS BIGINT)"
+    if func == 'sum' and column in FLOAT32_COLUMNS:
+        return f"CAST({expression} AS FLOAT)"
+    return expression
+
+
+class ParquetDataset:
+    """Out-of-core counterpart of Dataset over a partitioned Parquet directory.
+
+    Exposes the same aggregates pages read from a Dataset (customer facts,
+    customer months, monthly and product totals, the overview cube), each
+    computed by one DuckDB query with projection and partition push-down,
+    so only result-sized frames are loaded into pandas; the RFM sketches are
+    built from the customer facts, as in Dataset. There is no
+    line-item ``frame``. The aggregates equal the pandas ones, except that
+    a customer recorded under several names may keep a different one.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self._aggregates = {}
+        self._building = {}
+        pattern = os.path.join(path, "**", "*.parquet").replace("'", "''")
+        self._source = f"read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)"
+
+    def query(self, sql, params=None):
+        """Runs sql (with ? placeholders for params) against the line items, the view ``lines``; returns a DataFrame."""
+        import duckdb
+
+        connection = duckdb.connect()
+        try:
+            connection.execute(
+                f"CREATE VIEW lines AS SELECT * REPLACE (CAST(MonthKey AS INTEGER) AS MonthKey) FROM {self._source}"
+            )
+            return connection.execute(sql, params).df()
+        finally:
+            connection.close()
+
+    def _aggregate(self, name, build):
+        if name not in self._aggregates:
+            with self._building.setdefault(name, threading.Lock()):
+                if name not in self._aggregates:
+                    with span(f"aggregate.{name}", backend="duckdb"):
+                        self._aggregates[name] = build()
+        return self._aggregates[name]
+
+    @cached_property
+    def columns(self):
+        return pd.Index(self.query("DESCRIBE lines")['column_name'])
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def __len__(self):
+        return self._rows
+
+    @cached_property
+    def _rows(self):
+        return int(self.query("SELECT count(*) AS n FROM lines")['n'].iloc[0])
+
+    @cached_property
+    def reference_date(self):
+        """Latest invoice date in the dataset."""
+        return self.query("SELECT max(InvoiceDate) AS d FROM lines")['d'].iloc[0]
+
+    def _categories(self, df, columns):
+        for column in columns:
+            if column in df.columns and column in CATEGORY_COLUMNS:
+                df[column] = df[column].astype('category')
+        return df
+
+    @property
+    def customer_facts(self):
+        """The per-customer fact table."""
+        def build():
+            selects = [
+                f"{_cast(source, SQL_AGGREGATIONS[func].format(source), func)} AS {name}"
+                for name, source, func in FACT_AGGREGATIONS
+                if source in self.columns
+            ]
+            facts = self.query(
+                f"SELECT CustomerID, {', '.join(selects)} FROM lines "
+                "WHERE CustomerID IS NOT NULL GROUP BY CustomerID ORDER BY CustomerID"
+            )
+            return self._categories(facts, ['CustomerName']).set_index('CustomerID')
+        return self._aggregate('customer_facts', build)
+
+    @property
+    def customer_months(self):
+        """Line-item counts per (CustomerID, MonthKey)."""
+        def build():
+            counts = self.query(
+                "SELECT CustomerID, MonthKey, count(*) AS Lines FROM lines "
+                "WHERE CustomerID IS NOT NULL GROUP BY CustomerID, MonthKey ORDER BY CustomerID, MonthKey"
+            )
+            return counts.set_index(['CustomerID', 'MonthKey'])['Lines'].rename(None)
+        return self._aggregate('customer_months', build)
+
+    @property
+    def customer_days(self):
+        """Revenue per (CustomerID, Day) with a purchase, the purchase history behind the churn features."""
+        return self._aggregate('customer_days', lambda: self.query(
+            "SELECT CustomerID, CAST(date_trunc('day', InvoiceDate) AS TIMESTAMP) AS Day, "
+            "coalesce(sum(Revenue), 0) AS Revenue FROM lines "
+            "WHERE CustomerID IS NOT NULL AND InvoiceDate IS NOT NULL GROUP BY ALL ORDER BY CustomerID, Day"
+        ))
+
+    @property
+    def customer_categories(self):
+        """First purchase per (CustomerID, Category)."""
+        if 'Category' not in self.columns:
+            return self._aggregate('customer_categories', lambda: self.query(
+                "SELECT NULL::INTEGER AS CustomerID, NULL::VARCHAR AS Category, NULL::TIMESTAMP AS FirstPurchase LIMIT 0"
+            ))
+        return self._aggregate('customer_categories', lambda: self.query(
+            "SELECT CustomerID, Category, min(InvoiceDate) AS FirstPurchase FROM lines "
+            "WHERE CustomerID IS NOT NULL AND Category IS NOT NULL GROUP BY ALL ORDER BY CustomerID, Category"
+        ))
+
+    @property
+    def monthly_totals(self):
+        """Revenue, quantity, unit-price and line totals per MonthKey."""
+        return self._aggregate('monthly_totals', lambda: self.query(
+            "SELECT MonthKey, coalesce(sum(Revenue), 0) AS Revenue, "
+            "CAST(coalesce(sum(Quantity), 0) AS BIGINT) AS Quantity, "
+            "CAST(coalesce(sum(UnitPrice), 0) AS FLOAT) AS UnitPriceTotal, count(*) AS Lines "
+            "FROM lines GROUP BY MonthKey ORDER BY MonthKey"
+        ).set_index('MonthKey'))
+
+    @property
+    def product_totals(self):
+        """Quantity, revenue and line totals per (StockCode, Description)."""
+        return self._aggregate('product_totals', lambda: self._categories(self.query(
+            "SELECT StockCode, Description, CAST(coalesce(sum(Quantity), 0) AS BIGINT) AS Quantity, "
+            "coalesce(sum(Revenue), 0) AS Revenue, count(*) AS Lines FROM lines "
+            "WHERE StockCode IS NOT NULL AND Description IS NOT NULL "
+            "GROUP BY StockCode, Description ORDER BY StockCode, Description"
+        ), ['StockCode', 'Description']).set_index(['StockCode', 'Description']))
+
+    @property
+    def cube(self):
+        """Month x country x category x manufacturer cube serving the overview."""
+        def build():
+            dimensions = [dimension for dimension in CUBE_DIMENSIONS if dimension in self.columns]
+            keys = ", ".join(dimensions)
+            # One scan: the measures per (cell, customer), rolled up to cells here, also give the
+            # distinct (Cell, CustomerID) pairs, which is cheaper than a second pass joining cells back
+            pairs = self.query(
+                f"SELECT {keys}, CustomerID, coalesce(sum(Revenue), 0) AS Revenue, "
+                f"coalesce(sum(Profit), 0) AS Profit, CAST(coalesce(sum(Quantity), 0) AS BIGINT) AS Quantity, "
+                f"count(Revenue) AS Lines FROM lines GROUP BY {keys}, CustomerID"
+            )
+            grouped = pairs.groupby(dimensions, dropna=False, sort=True)
+            cells = grouped[CUBE_MEASURES].sum().reset_index()
+            cell_customers = pd.DataFrame({
+                'Cell': grouped.ngroup().to_numpy(),
+                'CustomerID': pairs['CustomerID'].to_numpy(),
+            })
+            sketches = {
+                column: self._sketches(column, [dimension for dimension in SKETCH_DIMENSIONS if dimension in dimensions])
+                for column in DISTINCT_COLUMNS.values()
+                if column in self.columns
+            }
+            return Cube(self._categories(cells, dimensions), cell_customers, dimensions, sketches, self.count_distinct)
+        return self._aggregate('cube', build)
+
+    @property
+    def rfm_sketches(self):
+        """Per-cohort quantile sketches of the RFM inputs, built from the customer facts."""
+        return self._aggregate('rfm_sketches', lambda: build_rfm_sketches(self.customer_facts))
+
+    def _sketches(self, column, dimensions):
+        # The registers are filled in DuckDB, so only the non-empty ones of each partition come back
+        keys = ", ".join(dimensions)
+        registers = self.query(
+            f"SELECT {keys}, {SQL_REGISTER.format(column)} AS Register, max({SQL_RANK.format(column)}) AS Rank "
+            f"FROM lines WHERE {column} IS NOT NULL GROUP BY ALL"
+        )
+        grouped = registers.groupby(dimensions, dropna=False, sort=True)
+        partitions = self._categories(grouped.size().reset_index()[dimensions], dimensions)
+        return HLLSketches.from_ranks(partitions, grouped.ngroup().to_numpy(), registers['Register'], registers['Rank'])
+
+    def count_distinct(self, column, filters=None):
+        """Exact distinct values of column over the line items matching filters ({dimension: value(s)})."""
+        conditions, params = [], []
+        for dimension, values in (filters or {}).items():
+            values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+            conditions.append(f"{dimension} IN ({', '.join('?' * len(values))})" if values else "FALSE")
+            params.extend(pd.Series(values).tolist())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return int(self.query(f"SELECT count(DISTINCT {column}) AS n FROM lines {where}", params)['n'].iloc[0])
+
+
+def open_csv(source, fingerprint, directory=PARQUET_DIR):
+    """Converts a CSV to partitioned Parquet (once per content) and returns it as a ParquetDataset and report."""
+    path, report = convert_csv(source, fingerprint, directory)
+    dataset = ParquetDataset(path, fingerprint)
+    report['rows'] = len(dataset)
+    return dataset, report
+
+
+def format_report(report):
+    """Formats an open_csv report as a short human-readable summary."""
+    if report['cache_hit']:
+        return f"Opened {report['rows']:,} rows of cached Parquet in {report['seconds']:.2f}s."
+    return (f"Converted {report['rows']:,} rows to partitioned Parquet in {report['seconds']:.2f}s."
+            f"{format_date_report(report.get('dates'))}{format_quarantine_report(report)}")
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Page jobs run in threads: they fill the in-process page cache, and the heavy
+# parts (pandas/NumPy kernels, KMeans) release the GIL or already run in a
+# process pool (ARIMA fits)
+PRECOMPUTE_WORKERS = 3
+
+# Datasets whose job status is remembered, matching the loaders' cache_resource entries
+MAX_DATASETS = 2
+
+_executor = None
+_jobs = OrderedDict()
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PRECOMPUTE_WORKERS, thread_name_prefix="precompute")
+    return _executor
+
+
+def schedule(dataset, jobs):
+    """Starts precomputing every page of dataset in the background, once per dataset fingerprint.
+
+    jobs maps a page name to a function taking the dataset and filling the
+    page cache (e.g. a page module's precompute). Jobs go through
+    cached_page, so a page opened while its job is running waits for that
+    job instead of computing the same result again. Returns the futures by
+    page name.
+    """
+    with _lock:
+        futures = _jobs.get(dataset.fingerprint)
+        if futures is None:
+            executor = _get_executor()
+            futures = {name: executor.submit(job, dataset) for name, job in jobs.items()}
+            _jobs[dataset.fingerprint] = futures
+            while len(_jobs) > MAX_DATASETS:
+                _jobs.popitem(last=False)
+        else:
+            _jobs.move_to_end(dataset.fingerprint)
+        return futures
+
+
+def progress(fingerprint):
+    """Returns {'done', 'total', 'failed': {page: error}, 'running': [pages]} for a dataset's jobs."""
+    with _lock:
+        futures = dict(_jobs.get(fingerprint, {}))
+    failed = {
+        name: future.exception()
+        for name, future in futures.items()
+        if future.done() and future.exception() is not None
+    }
+    return {
+        'done': sum(future.done() for future in futures.values()),
+        'total': len(futures),
+        'failed': failed,
+        'running': [name for name, future in futures.items() if not future.done()],
+    }
@@ -0,0 +1,261 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.churn import DEFAULT_CHURN_THRESHOLD
+from utils.incremental import STORE_DIR, IncrementalStore
+from utils.ingest import content_hash
+from utils.instrumentation import emit, span
+from utils.parquet_dataset import file_hash
+from utils.rfm import build_rfm_sketches, churn_flags, rfm_table, score_rfm, segment_labels
+from utils.scoring import aggregate_files
+
+# Ids are looked up in a dense array of row numbers while the id span is at most this many
+# times the customer count (or DENSE_MIN_SPAN); sparser ids are binary-searched instead
+DENSE_SPAN_FACTOR = 8
+DENSE_MIN_SPAN = 2**16
+
+# Seconds between checks of the source for changes
+REFRESH_INTERVAL = 10.0
+
+# Profile columns stored as numbers, with their dtypes
+NUMBER_COLUMNS = {
+    'Recency': np.int32,
+    'Frequency': np.int64,
+    'Monetary': np.float64,
+    'R': np.int8,
+    'F': np.int8,
+    'M': np.int8,
+    'RFM Score': np.int8,
+    'Churn': np.bool_,
+}
+
+# Profile columns stored as codes into a label array
+LABEL_COLUMNS = ['CustomerName', 'Segment']
+
+# Profile columns stored as days
+DATE_COLUMNS = ['FirstPurchase', 'LastPurchase']
+
+
+class ProfileStore:
+    """Per-customer profiles held as column arrays and indexed by CustomerID; never modified once built.
+
+    A profile is a customer's RFM values (Recency is days since the last
+    purchase, Monetary the lifetime revenue), R/F/M scores, segment, churn
+    flag and first and last purchase. An id maps to its row through a dense
+    array of row numbers (slot id - smallest id), so a lookup is one index
+    operation whatever the customer count; batches are gathered a column at
+    a time.
+    """
+
+    def __init__(self, ids, columns, fingerprint=None, reference_date=None):
+        order = np.argsort(ids, kind='stable')
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.fingerprint = fingerprint
+        self.reference_date = reference_date
+        self.built_at = time.time()
+        self._numbers = {name: np.asarray(columns[name], dtype=dtype)[order] for name, dtype in NUMBER_COLUMNS.items()}
+        self._dates = {name: columns[name].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')[order]
+                       for name in DATE_COLUMNS}
+        self._codes, self._labels = {}, {}
+        for name in LABEL_COLUMNS:
+            codes, labels = pd.factorize(columns[name])
+            self._codes[name] = codes.astype(np.int32)[order]
+            # Missing values have code -1, which picks the trailing None
+            self._labels[name] = np.append(np.asarray(labels, dtype=object), None)
+
+        self._slots = None
+        if len(self.ids):
+            self._base = int(self.ids[0])
+            span = int(self.ids[-1]) - self._base + 1
+            if span <= max(DENSE_SPAN_FACTOR * len(self.ids), DENSE_MIN_SPAN):
+                self._slots = np.full(span, -1, dtype=np.int32)
+                self._slots[self.ids - self._base] = np.arange(len(self.ids), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        arrays = [self.ids, *self._numbers.values(), *self._dates.values(), *self._codes.values()]
+        return sum(array.nbytes for array in arrays) + (self._slots.nbytes if self._slots is not None else 0)
+
+    def rows(self, customer_ids):
+        """Row of each id (an array of integers), -1 for ids without a profile."""
+        ids = np.asarray(customer_ids, dtype=np.int64)
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        if not len(self.ids):
+            return rows
+        if self._slots is not None:
+            offsets = ids - self._base
+            inside = (offsets >= 0) & (offsets < len(self._slots))
+            rows[inside] = self._slots[offsets[inside]]
+        else:
+            positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+            found = self.ids[positions] == ids
+            rows[found] = positions[found]
+        return rows
+
+    def profiles(self, rows):
+        """Profiles at rows (all existing) as dicts of JSON-ready values, in CustomerID, label, number, date order."""
+        values = {'CustomerID': self.ids[rows].tolist()}
+        for name, codes in self._codes.items():
+            values[name] = self._labels[name][codes[rows]].tolist()
+        for name, numbers in self._numbers.items():
+            values[name] = numbers[rows].tolist()
+        for name, days in self._dates.items():
+            values[name] = np.datetime_as_string(days[rows]).tolist()
+        return [dict(zip(values, row)) for row in zip(*values.values())]
+
+    def lookup(self, customer_ids):
+        """Profiles of customer_ids in order, None for unknown ids."""
+        rows = self.rows(customer_ids)
+        found = rows >= 0
+        profiles = iter(self.profiles(rows[found]))
+        return [next(profiles) if hit else None for hit in found.tolist()]
+
+    def get(self, customer_id):
+        """One customer's profile, or None."""
+        return self.lookup([customer_id])[0]
+
+    def summary(self):
+        """Fingerprint, size and age of the store, for a health check."""
+        return {
+            'fingerprint': self.fingerprint,
+            'customers': len(self),
+            'id_range': [int(self.ids[0]), int(self.ids[-1])] if len(self.ids) else None,
+            'reference_date': None if self.reference_date is None else str(self.reference_date.date()),
+            'built_at': self.built_at,
+            'index': 'dense' if self._slots is not None else 'sorted',
+            'bytes': self.nbytes,
+        }
+
+
+def build_profiles(facts, reference_date=None, churn_threshold=DEFAULT_CHURN_THRESHOLD, fingerprint=None,
+                   boundaries=None):
+    """Builds a ProfileStore from a CustomerFacts table.
+
+    Scores come from the RFM sketch boundaries, as on the RFM page, unless
+    boundaries are given; reference_date defaults to the latest purchase.
+    """
+    reference_date = facts['LastPurchase'].max() if reference_date is None else pd.Timestamp(reference_date)
+    rfm = rfm_table(facts, reference_date).dropna(subset=['Recency', 'Frequency', 'Monetary'])
+    if boundaries is None:
+        boundaries = build_rfm_sketches(facts).boundaries(reference_date)
+    rfm = score_rfm(rfm, boundaries=boundaries)
+    ids = rfm['CustomerID'].to_numpy(dtype=np.int64)
+    columns = {name: rfm[name].to_numpy() for name in ['Recency', 'Frequency', 'Monetary', 'R', 'F', 'M', 'RFM Score']}
+    columns['Segment'] = segment_labels(rfm['RFM Score'])
+    columns['Churn'] = churn_flags(rfm['Recency'], churn_threshold).astype(bool)
+    columns['CustomerName'] = (rfm['CustomerName'].to_numpy(dtype=object) if 'CustomerName' in rfm.columns
+                               else np.full(len(rfm), None, dtype=object))
+    dates = facts[DATE_COLUMNS].reindex(ids)
+    for name in DATE_COLUMNS:
+        columns[name] = dates[name]
+    return ProfileStore(ids, columns, fingerprint, None if pd.isna(reference_date) else reference_date)
+
+
+class FileSource:
+    """Line items in CSV (plain, gzip or zstd) or Parquet files, read with the batch scorer's process pool.
+
+    Changes are spotted from the files' sizes and modification times; the
+    fingerprint is the content hash the dashboard gives the same files.
+    """
+
+    def __init__(self, paths, workers=None):
+        self.paths = list(paths)
+        self.workers = workers
+
+    def version(self):
+        stats = [os.stat(path) for path in self.paths]
+        return tuple((stat.st_size, stat.st_mtime_ns) for stat in stats)
+
+    def load(self):
+        """Returns the CustomerFacts and the fingerprint."""
+        fingerprints = [file_hash(path) for path in self.paths]
+        fingerprint = fingerprints[0] if len(fingerprints) == 1 else content_hash("|".join(fingerprints).encode())
+        facts, _ = aggregate_files(self.paths, self.workers)
+        return facts, fingerprint
+
+
+class HistorySource:
+    """The dashboard's incremental history (IncrementalStore), whose checkpointed CustomerFacts are read as is.
+
+    The manifest is replaced on every append, so its modification time marks a change.
+    """
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+
+    def version(self):
+        path = os.path.join(self.path, "manifest.json")
+        return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+    def load(self):
+        store = IncrementalStore(self.path)
+        facts = store.aggregates.get('customer_facts')
+        if facts is None:
+            raise ValueError(f"No batches have been appended to the history at {self.path}")
+        return facts, store.fingerprint
+
+
+class ProfileService:
+    """Holds the current ProfileStore of a source and replaces it when the source changes.
+
+    A refresh builds the next store off to the side and swaps it in with one
+    assignment, so a reader that takes service.store once per request sees
+    either the old profiles or the new ones, never a mix. Refreshes are
+    serialized; one that fails keeps the old store and records the error.
+    """
+
+    def __init__(self, source, churn_threshold=DEFAULT_CHURN_THRESHOLD):
+        self.source = source
+        self.churn_threshold = churn_threshold
+        self.store = None
+        self.refreshes = 0
+        self.last_error = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Rebuilds the store if the source changed since the last build (or always, with force).
+
+        Returns whether a new store was swapped in.
+        """
+        with self._lock:
+            version = self.source.version()
+            if not force and self.store is not None and version == self._version:
+                return False
+            with span("profiles.refresh") as fields:
+                facts, fingerprint = self.source.load()
+                store = build_profiles(facts, churn_threshold=self.churn_threshold, fingerprint=fingerprint)
+                fields.update(customers=len(store), fingerprint=fingerprint)
+            self.store = store
+            self._version = version
+            self.refreshes += 1
+            self.last_error = None
+            return True
+
+    def watch(self, interval=REFRESH_INTERVAL):
+        """Checks the source every interval seconds from a daemon thread; returns the thread."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    emit("profiles.refresh_failed", error=self.last_error)
+
+        thread = threading.Thread(target=loop, name="profile-refresh", daemon=True)
+        thread.start()
+        return thread
+
+    def health(self):
+        """The current store's summary with the refresh count and last refresh error."""
+        store = self.store
+        summary = store.summary() if store is not None else {'customers': 0}
+        return {**summary, 'refreshes': self.refreshes, 'last_error': self.last_error}
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+from utils.sketches import KLLSketch
+
+# Segment rules as (minimum RFM score, label); scores below every threshold get DEFAULT_SEGMENT
+SEGMENT_RULES = [
+    (9, "Loyal Customers"),
+    (6, "New Customers"),
+    (4, "Hibernating"),
+]
+DEFAULT_SEGMENT = "Churned"
+
+# Customer facts sketched for each RFM metric; Recency comes from LastPurchase, so the
+# sketches don't depend on the reference date
+RFM_SKETCH_COLUMNS = {'Recency': 'LastPurchase', 'Frequency': 'Invoices', 'Monetary': 'Revenue'}
+
+DAY = pd.Timedelta(days=1)
+
+
+def rfm_table(facts, reference_date=None):
+    """Returns a new CustomerID/Recency/Frequency/Monetary frame derived from CustomerFacts."""
+    if reference_date is None:
+        reference_date = facts['LastPurchase'].max()
+
+    rfm = pd.DataFrame({
+        'Recency': (reference_date - facts['LastPurchase']).dt.days,
+        'Frequency': facts['Invoices'],
+        'Monetary': facts['Revenue'],
+    })
+    if 'CustomerName' in facts.columns:
+        rfm.insert(0, 'CustomerName', facts['CustomerName'])
+    return rfm.reset_index()
+
+
+def quantile_scores(values, boundaries, descending=False):
+    """Scores values 1..len(boundaries) + 1 against ascending bin boundaries.
+
+    A value scores one more than the number of boundaries below it, so a
+    value equal to a boundary falls in the lower bin, as with pd.qcut. Each
+    value is one binary search over the few boundaries. descending reverses
+    the scores (low Recency scores high).
+    """
+    bins = np.searchsorted(boundaries, np.asarray(values), side='left') + 1
+    return len(boundaries) + 2 - bins if descending else bins
+
+
+def score_rfm(rfm, quartiles=4, boundaries=None):
+    """Adds R/F/M quartile scores and their sum ('RFM Score') to an RFM frame.
+
+    By default the quartiles are exact, from pd.qcut over the whole frame
+    (Frequency and Monetary ties split by rank); this raises ValueError when
+    Recency has too few distinct values to form them. With boundaries
+    ({metric: ascending inner boundaries}, e.g. RFMSketches.boundaries) each
+    customer is scored on its own against them, and tied values share a score.
+    """
+    if boundaries is not None:
+        rfm['R'] = quantile_scores(rfm['Recency'], boundaries['Recency'], descending=True)
+        rfm['F'] = quantile_scores(rfm['Frequency'], boundaries['Frequency'])
+        rfm['M'] = quantile_scores(rfm['Monetary'], boundaries['Monetary'])
+    else:
+        ascending = list(range(1, quartiles + 1))
+        rfm['R'] = pd.qcut(rfm['Recency'], q=quartiles, labels=ascending[::-1]).astype(int)
+        rfm['F'] = pd.qcut(rfm['Frequency'].rank(method="first"), q=quartiles, labels=ascending).astype(int)
+        rfm['M'] = pd.qcut(rfm['Monetary'].rank(method="first"), q=quartiles, labels=ascending).astype(int)
+    rfm['RFM Score'] = rfm['R'].to_numpy() + rfm['F'].to_numpy() + rfm['M'].to_numpy()
+    return rfm
+
+
+class RFMSketches:
+    """Quantile sketches of the RFM inputs, one KLLSketch per metric and customer cohort.
+
+    Cohorts are first-purchase months (pandas Periods). Merging the sketches of
+    any set of cohorts gives that slice's quartile boundaries without
+    sorting its customers, and new customers are scored against the
+    boundaries one at a time (quantile_scores). Boundaries are approximate:
+    each sits within a fraction of a percent of its true rank.
+    """
+
+    def __init__(self, sketches):
+        self.sketches = sketches
+
+    @property
+    def cohorts(self):
+        return sorted(self.sketches)
+
+    def merged(self, cohorts=None):
+        """One KLLSketch per metric, merged over cohorts (all when None)."""
+        merged = {metric: KLLSketch() for metric in RFM_SKETCH_COLUMNS}
+        for cohort in self.cohorts if cohorts is None else cohorts:
+            for metric, sketch in self.sketches.get(cohort, {}).items():
+                merged[metric].merge(sketch)
+        return merged
+
+    def boundaries(self, reference_date, quartiles=4, cohorts=None):
+        """Inner quartile boundaries per metric ({'Recency', 'Frequency', 'Monetary'}), ascending."""
+        fractions = np.arange(1, quartiles) / quartiles
+        merged = self.merged(cohorts)
+        last_purchase = merged['Recency'].quantiles(fractions)
+        # Recency in whole days, as rfm_table computes it: late purchases are the low recencies
+        reference = (pd.Timestamp(reference_date) - pd.Timestamp(0)) / DAY
+        return {
+            'Recency': np.sort(np.floor(reference - last_purchase)),
+            'Frequency': merged['Frequency'].quantiles(fractions),
+            'Monetary': merged['Monetary'].quantiles(fractions),
+        }
+
+
+def build_rfm_sketches(facts):
+    """Sketches the RFM inputs of a CustomerFacts table per first-purchase month."""
+    values = pd.DataFrame({
+        metric: (facts[column] - pd.Timestamp(0)) / DAY if column == 'LastPurchase' else facts[column].astype('float64')
+        for metric, column in RFM_SKETCH_COLUMNS.items()
+    })
+    sketches = {}
+    for cohort, group in values.groupby(facts['FirstPurchase'].dt.to_period('M').to_numpy(), sort=True):
+        sketches[cohort] = {metric: KLLSketch.from_values(group[metric].to_numpy()) for metric in RFM_SKETCH_COLUMNS}
+    return RFMSketches(sketches)
+
+
+def update_rfm_sketches(sketches, facts, customers, previous=None):
+    """RFM sketches after the facts of customers changed, rebuilding only the cohorts they were or are in.
+
+    A quantile sketch can't take a customer's old values back out, so the
+    cohorts (first-purchase months) of the changed customers, before
+    (previous facts) and after (facts), are sketched afresh from facts and
+    the others are kept; the result equals build_rfm_sketches(facts).
+    """
+    if sketches is None:
+        return build_rfm_sketches(facts)
+    cohorts = facts['FirstPurchase'].dt.to_period('M')
+    changed = set(cohorts.reindex(customers).dropna())
+    if previous is not None:
+        changed |= set(previous['FirstPurchase'].dt.to_period('M').reindex(customers).dropna())
+    rebuilt = build_rfm_sketches(facts[cohorts.isin(changed).to_numpy()])
+    kept = {cohort: cohort_sketches for cohort, cohort_sketches in sketches.sketches.items() if cohort not in changed}
+    return RFMSketches({**kept, **rebuilt.sketches})
+
+
+def segment_labels(scores, rules=SEGMENT_RULES, default=DEFAULT_SEGMENT):
+    """Maps an array of RFM scores to segment labels using threshold rules."""
+    rules = sorted(rules)
+    thresholds = np.array([threshold for threshold, _ in rules])
+    labels = np.array([default] + [label for _, label in rules], dtype=object)
+    return labels[np.searchsorted(thresholds, np.asarray(scores), side='right')]
+
+
+def segment_customer(score, rules=SEGMENT_RULES, default=DEFAULT_SEGMENT):
+    """Returns the segment label for a single RFM score."""
+    return segment_labels([score], rules, default)[0]
+
+
+def churn_flags(days_since_last_purchase, threshold=90):
+    """Returns 1 where a customer has been inactive for more than threshold days, else 0."""
+    return (np.asarray(days_since_last_purchase) > threshold).astype(int)
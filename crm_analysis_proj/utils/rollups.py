@@ -0,0 +1,31 @@
+import pandas as pd
+
+
+def build_monthly_totals(df):
+    """Returns revenue, quantity, unit-price and line totals per MonthKey."""
+    return df.groupby('MonthKey').agg(
+        Revenue=('Revenue', 'sum'),
+        Quantity=('Quantity', 'sum'),
+        UnitPriceTotal=('UnitPrice', 'sum'),
+        Lines=('MonthKey', 'size'),
+    )
+
+
+def build_product_totals(df):
+    """Returns quantity, revenue and line totals per (StockCode, Description)."""
+    return df.groupby(['StockCode', 'Description'], observed=True).agg(
+        Quantity=('Quantity', 'sum'),
+        Revenue=('Revenue', 'sum'),
+        Lines=('Quantity', 'size'),
+    )
+
+
+def merge_totals(totals, delta):
+    """Adds a batch's additive rollup (monthly, product or customer-month) onto existing totals."""
+    if totals is None:
+        return delta
+    merged = totals.add(delta, fill_value=0)
+    # add() upcasts to float when keys are missing on either side; restore the count dtypes
+    if isinstance(totals, pd.DataFrame):
+        return merged.astype(totals.dtypes.to_dict())
+    return merged.astype(totals.dtype)
@@ -0,0 +1,319 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from utils.churn import DEFAULT_CHURN_THRESHOLD
+from utils.clustering import cluster_customers
+from utils.customer_facts import FACT_AGGREGATIONS, build_customer_facts, combine_customer_facts
+from utils.dataset import add_derived_columns
+from utils.dates import DateParser, sniff_format
+from utils.ingest import (
+    DATETIME_COLUMNS, SNIFF_ROWS, ValidationError, coerce_chunk, detect_format, read_chunks, sniff_file,
+    write_quarantine,
+)
+from utils.rfm import build_rfm_sketches, churn_flags, rfm_table, score_rfm, segment_labels
+
+# Bytes of a plain CSV read by one task (about 700k synthetic line items); parts end at a line end
+PART_BYTES = 64 * 2**20
+
+# Rows per task for Parquet (whole row groups) and for compressed CSVs, which can only be
+# decompressed from the start and so are read in the main process and handed out as frames
+PART_ROWS = 1_000_000
+
+# Tasks submitted but not yet collected, per worker; bounds the raw parts held in memory
+TASKS_PER_WORKER = 2
+
+# Partial fact rows collected before they are folded into the running fact table
+COMBINE_ROWS = 5_000_000
+
+# The only columns parsed: the customer facts' sources and what Revenue is derived from
+SCORE_COLUMNS = list(dict.fromkeys(['CustomerID', 'UnitPrice'] + [source for _, source, _ in FACT_AGGREGATIONS]))
+
+
+def plan_parts(path, part_bytes=PART_BYTES, part_rows=PART_ROWS):
+    """Yields the tasks a file is read in: byte ranges of a CSV, row groups of Parquet, or frames."""
+    file_format = detect_format(path)
+    if file_format == "parquet":
+        metadata = pq.ParquetFile(path).metadata
+        groups, rows = [], 0
+        for index in range(metadata.num_row_groups):
+            groups.append(index)
+            rows += metadata.row_group(index).num_rows
+            if rows >= part_rows:
+                yield ('row_groups', path, groups)
+                groups, rows = [], 0
+        if groups:
+            yield ('row_groups', path, groups)
+    elif file_format == "csv":
+        # Cut points are moved to the next line end; a quoted field spanning lines would be split
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            header = f.readline()
+            start = f.tell()
+            while start < size:
+                f.seek(min(start + part_bytes, size))
+                f.readline()
+                end = f.tell()
+                yield ('range', path, header, start, end)
+                start = end
+    else:
+        for chunk in read_chunks(path, part_rows, SCORE_COLUMNS):
+            yield ('frame', chunk)
+
+
+def _read_part(task):
+    kind = task[0]
+    if kind == 'range':
+        _, path, header, start, end = task
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = header + f.read(end - start)
+        yield from read_chunks(data, PART_ROWS, SCORE_COLUMNS)
+    elif kind == 'row_groups':
+        _, path, groups = task
+        parquet = pq.ParquetFile(path)
+        columns = [col for col in parquet.schema_arrow.names if col in SCORE_COLUMNS]
+        yield parquet.read_row_groups(groups, columns=columns).to_pandas()
+    else:
+        yield task[1]
+
+
+def _edges(valid):
+    # (CustomerID, InvoiceNo) of the first and last rows, to spot an invoice continuing across a cut
+    if 'InvoiceNo' not in valid.columns:
+        return None
+    keyed = valid[['CustomerID', 'InvoiceNo']].dropna()
+    if keyed.empty:
+        return None
+    first, last = keyed.iloc[0], keyed.iloc[-1]
+    return (int(first['CustomerID']), str(first['InvoiceNo'])), (int(last['CustomerID']), str(last['InvoiceNo']))
+
+
+def _run_heads(valid, previous=None):
+    # (CustomerID, InvoiceNo) of each run of consecutive lines, less the run continuing previous (the last key before)
+    if 'InvoiceNo' not in valid.columns:
+        return None
+    keyed = (valid['CustomerID'].notna() & valid['InvoiceNo'].notna()).to_numpy()
+    customers = valid['CustomerID'].to_numpy('int64', na_value=0)[keyed]
+    invoices = valid['InvoiceNo'].to_numpy()[keyed]
+    starts = np.ones(len(customers), dtype=bool)
+    starts[1:] = (customers[1:] != customers[:-1]) | (invoices[1:] != invoices[:-1])
+    if previous is not None and len(customers) and (int(customers[0]), str(invoices[0])) == previous:
+        starts[0] = False
+    return pd.DataFrame({'CustomerID': customers[starts], 'InvoiceNo': invoices[starts]})
+
+
+def split_invoices(edges):
+    """Customers of the invoices cut between consecutive parts, given each part's edges (None when empty).
+
+    Each such invoice was counted once in both parts; an invoice is taken to
+    be one run of lines, so a cut can only split the run at it. Parts report
+    invoices with more than one run (see score_part), so a file that breaks
+    this is rejected rather than overcounted.
+    """
+    edges = [edge for edge in edges if edge is not None]
+    return [before[1][0] for before, after in zip(edges, edges[1:]) if before[1] == after[0]]
+
+
+def score_part(task, date_format=None):
+    """Reads one part, validates it and reduces it to CustomerFacts; runs in a worker process.
+
+    date_format is the format sniffed from the start of the file, so every
+    part parses dates alike. Returns the facts, the malformed rows, the raw
+    and valid row counts, the part's edges, the customers of invoices split
+    between its own chunks, the number of chunks and the number of invoice
+    runs beyond each invoice's first (non-zero when an invoice's lines are
+    not contiguous).
+    """
+    date_parsers = {}
+    for col in DATETIME_COLUMNS:
+        date_parsers[col] = DateParser()
+        date_parsers[col].format = date_format
+    facts, malformed, edges, heads = [], [], [], []
+    rows = valid_rows = 0
+    for chunk in _read_part(task):
+        rows += len(chunk)
+        valid, bad = coerce_chunk(chunk, date_parsers)
+        del chunk
+        valid_rows += len(valid)
+        previous = next((edge[1] for edge in reversed(edges) if edge is not None), None)
+        heads.append(_run_heads(valid, previous))
+        edges.append(_edges(valid))
+        facts.append(build_customer_facts(add_derived_columns(valid)))
+        if len(bad):
+            malformed.append(bad)
+    present = [edge for edge in edges if edge is not None]
+    heads = [frame for frame in heads if frame is not None]
+    return {
+        'facts': combine_customer_facts(facts) if len(facts) > 1 else facts[0],
+        'malformed': pd.concat(malformed) if malformed else None,
+        'rows': rows,
+        'valid_rows': valid_rows,
+        'edges': (present[0][0], present[-1][1]) if present else None,
+        'split_invoices': split_invoices(edges),
+        'chunks': len(facts),
+        'scattered': int(pd.concat(heads).duplicated().sum()) if heads else 0,
+    }
+
+
+class FactsReducer:
+    """Folds part results into one CustomerFacts table as they arrive, in any order.
+
+    Partial facts are combined in batches of COMBINE_ROWS rows, so memory
+    holds the running table (one row per customer) plus one batch. Invoices
+    cut between parts are subtracted once all parts are in. That correction
+    needs each invoice's lines to be contiguous, so once a part reports an
+    invoice in several runs and more than one chunk is combined, add raises
+    ValidationError. An invoice split over non-adjacent parts while
+    contiguous within each is not detected.
+    """
+
+    def __init__(self, quarantine_path=None, combine_rows=COMBINE_ROWS):
+        self.quarantine_path = quarantine_path
+        self.combine_rows = combine_rows
+        self.facts = None
+        self.pending = []
+        self.pending_rows = 0
+        self.edges = {}
+        self.split = []
+        self.parts = 0
+        self.chunks = 0
+        self.scattered = 0
+        self.rows = 0
+        self.valid_rows = 0
+        self.quarantined = 0
+
+    def add(self, key, result):
+        """Takes the result of part key = (file index, part index)."""
+        self.chunks += result['chunks']
+        self.scattered += result['scattered']
+        if self.scattered and self.chunks > 1:
+            raise ValidationError(
+                f"Invoice lines are not contiguous ({self.scattered:,} runs of lines continue an invoice seen "
+                f"earlier), so invoices read in different chunks would be counted twice. Sort the file by "
+                f"InvoiceNo and score it again."
+            )
+        self.pending.append(result['facts'])
+        self.pending_rows += len(result['facts'])
+        if self.pending_rows >= self.combine_rows:
+            self._combine()
+        if result['malformed'] is not None and self.quarantine_path:
+            self.quarantined += write_quarantine(result['malformed'], self.quarantine_path, header=self.quarantined == 0)
+        elif result['malformed'] is not None:
+            self.quarantined += len(result['malformed'])
+        self.edges[key] = result['edges']
+        self.split.extend(result['split_invoices'])
+        self.parts += 1
+        self.rows += result['rows']
+        self.valid_rows += result['valid_rows']
+
+    def _combine(self):
+        parts = self.pending if self.facts is None else [self.facts] + self.pending
+        self.facts = combine_customer_facts(parts)
+        self.pending, self.pending_rows = [], 0
+
+    def finish(self):
+        """Returns the combined facts with the invoices cut between parts counted once."""
+        if self.pending or self.facts is None:
+            self._combine()
+        for file_index in sorted({file_index for file_index, _ in self.edges}):
+            parts = sorted(key for key in self.edges if key[0] == file_index)
+            self.split.extend(split_invoices([self.edges[key] for key in parts]))
+        if self.split and 'Invoices' in self.facts.columns:
+            counts = pd.Series(self.split).value_counts()
+            self.facts['Invoices'] -= counts.reindex(self.facts.index, fill_value=0).to_numpy()
+        return self.facts
+
+
+def _date_format(path):
+    head = next(iter(read_chunks(path, SNIFF_ROWS)))
+    dates = head[DATETIME_COLUMNS[0]].dropna() if DATETIME_COLUMNS[0] in head.columns else head.iloc[:0, 0]
+    return sniff_format(pd.Index(dates.astype(str).unique()))
+
+
+def aggregate_files(paths, workers=None, part_bytes=PART_BYTES, part_rows=PART_ROWS, quarantine_path=None,
+                    progress=None):
+    """Reduces the line items of one or more files (CSV, gzip/zstd CSV or Parquet paths) to CustomerFacts.
+
+    Every file is sniffed first (sniff_file raises ValidationError). Parts
+    are read, validated and reduced by a process pool, with at most
+    TASKS_PER_WORKER parts per worker in flight, so memory is bounded by the
+    parts in flight and the fact table, not the file size. Only
+    SCORE_COLUMNS are parsed; malformed rows go to quarantine_path with
+    those columns. Files are taken as disjoint (no cross-file
+    deduplication). progress, if given, is called with the FactsReducer
+    after each part. Returns the facts and a report of parts, rows,
+    quarantined rows and seconds.
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    formats = []
+    for path in paths:
+        sniff_file(path)
+        formats.append(_date_format(path))
+
+    reducer = FactsReducer(quarantine_path)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def collect(futures):
+            for future in futures:
+                reducer.add(pending.pop(future), future.result())
+                if progress is not None:
+                    progress(reducer)
+
+        for file_index, path in enumerate(paths):
+            for part_index, task in enumerate(plan_parts(path, part_bytes, part_rows)):
+                while len(pending) >= workers * TASKS_PER_WORKER:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                pending[executor.submit(score_part, task, formats[file_index])] = (file_index, part_index)
+        while pending:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+
+    facts = reducer.finish()
+    return facts, {
+        'files': len(paths),
+        'parts': reducer.parts,
+        'rows': reducer.rows,
+        'valid_rows': reducer.valid_rows,
+        'quarantined': reducer.quarantined,
+        'quarantine_path': quarantine_path if reducer.quarantined and quarantine_path else None,
+        'customers': len(facts),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def score_customers(facts, reference_date=None, n_clusters=4, churn_threshold=DEFAULT_CHURN_THRESHOLD, exact=False):
+    """Per-customer RFM scores, segment labels, KMeans clusters and churn flags from a CustomerFacts table.
+
+    Quartiles come from the RFM sketches unless exact is set (see
+    score_rfm); reference_date defaults to the latest purchase.
+    """
+    reference_date = facts['LastPurchase'].max() if reference_date is None else pd.Timestamp(reference_date)
+    scores = rfm_table(facts, reference_date).dropna(subset=['Recency', 'Frequency', 'Monetary'])
+    boundaries = None if exact else build_rfm_sketches(facts).boundaries(reference_date)
+    scores = score_rfm(scores, boundaries=boundaries)
+    scores['Segment'] = segment_labels(scores['RFM Score'])
+    # A handful of customers (e.g. a small test file) gets as many clusters as there are customers
+    n_clusters = min(n_clusters, len(scores))
+    if n_clusters:
+        clusters, fit = cluster_customers(scores, n_clusters=n_clusters, family="scoring")
+        scores['Cluster'] = clusters
+        scores['ClusterName'] = fit['names'][clusters]
+    else:
+        scores['Cluster'] = pd.Series(dtype='int32')
+        scores['ClusterName'] = pd.Series(dtype=object)
+    scores['Churn'] = churn_flags(scores['Recency'], churn_threshold)
+    return scores
+
+
+def write_scores(scores, path):
+    """Atomically writes the score table as Parquet."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    scores.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
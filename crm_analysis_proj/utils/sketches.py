@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+
+from utils.ingest import concat_typed
+
+# A sketch has 2**HLL_PRECISION one-byte registers; the estimate's relative
+# standard error is 1.04 / sqrt(2**HLL_PRECISION), 1.6% at 12
+HLL_PRECISION = 12
+
+# Items a KLL quantile sketch keeps per level; rank errors stay well under 1% at 256
+KLL_CAPACITY = 256
+
+
+def standard_error(precision=HLL_PRECISION):
+    """Relative standard error of a HyperLogLog estimate with 2**precision registers."""
+    return 1.04 / np.sqrt(2 ** precision)
+
+
+def hash_values(values):
+    """64-bit hashes of values; categoricals hash by value, so equal values hash alike whatever the dtype."""
+    return pd.util.hash_pandas_object(pd.Series(values, copy=False), index=False).to_numpy()
+
+
+def _trailing_zeros(values):
+    """Trailing zero bits of each nonzero uint64."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count((values - np.uint64(1)) & ~values)
+    # NumPy 1 has no popcount: isolate the lowest set bit, whose float exponent is its position plus one
+    return np.frexp((values & (~values + np.uint64(1))).astype(np.float64))[1] - 1
+
+
+def register_ranks(hashes, precision=HLL_PRECISION):
+    """Splits 64-bit hashes into the register each one updates and its rank there.
+
+    The top precision bits pick the register; the rank is one more than the
+    trailing zeros of the remaining bits. A sentinel bit just below the
+    register bits caps the rank at 64 - precision + 1.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    registers = (hashes >> np.uint64(64 - precision)).astype(np.uint16)
+    rest = hashes | (np.uint64(1) << np.uint64(64 - precision))
+    ranks = _trailing_zeros(rest).astype(np.uint8) + np.uint8(1)
+    return registers, ranks
+
+
+def _sigma(x):
+    if x == 1.0:
+        return float('inf')
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x == 0.0 or x == 1.0:
+        return 0.0
+    y, z = 1.0, 1.0 - x
+    while True:
+        x = np.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1.0 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+def estimate(registers, precision=HLL_PRECISION):
+    """HyperLogLog estimate of the distinct values behind one dense register array.
+
+    Uses Ertl's improved estimator (2017), which corrects the raw estimate
+    from the histogram of register values, so the error stays near the
+    standard error across the whole range; the classic estimator with a
+    linear-counting switch is biased by several percent around 2.5 * m.
+    """
+    m = len(registers)
+    q = 64 - precision
+    counts = np.bincount(registers, minlength=q + 2).astype(np.float64)
+    if counts[0] == m:
+        return 0.0
+    z = m * _tau(1.0 - counts[q + 1] / m)
+    for k in range(q, 0, -1):
+        z = 0.5 * (z + counts[k])
+    z += m * _sigma(counts[0] / m)
+    return m * m / (2 * np.log(2) * z)
+
+
+class HLLSketches:
+    """HyperLogLog distinct-count sketches of one column, one per partition.
+
+    keys holds the dimension values of each partition, one row per
+    partition. Only non-empty registers are kept, as (partition, register,
+    rank) rows, so a partition with a handful of distinct values costs a
+    handful of rows rather than 2**precision bytes. Sketches merge by taking
+    the highest rank per register, so the distinct count of any set of
+    partitions comes from merging theirs, without revisiting the values;
+    estimates have a relative standard error of standard_error(precision).
+    """
+
+    def __init__(self, keys, partitions, registers, ranks, precision=HLL_PRECISION):
+        self.keys = keys
+        self.precision = precision
+        self._partitions = partitions
+        self._registers = registers
+        self._ranks = ranks
+        self._total = None
+
+    @classmethod
+    def from_ranks(cls, keys, partitions, registers, ranks, precision=HLL_PRECISION):
+        """Builds the sketches from (partition, register, rank) rows, which may repeat and come in any order."""
+        slots = np.asarray(partitions, dtype=np.int64) << precision | np.asarray(registers, dtype=np.int64)
+        highest = pd.Series(np.asarray(ranks, dtype=np.uint8)).groupby(slots, sort=True).max()
+        slots = highest.index.to_numpy()
+        return cls(
+            keys,
+            (slots >> precision).astype(np.int32),
+            (slots & ((1 << precision) - 1)).astype(np.uint16),
+            highest.to_numpy(dtype=np.uint8),
+            precision,
+        )
+
+    @classmethod
+    def from_values(cls, keys, partitions, values, precision=HLL_PRECISION):
+        """Sketches values (a Series aligned with partitions, each row's partition number); nulls are not counted."""
+        present = values.notna().to_numpy()
+        registers, ranks = register_ranks(hash_values(values[present]), precision)
+        return cls.from_ranks(keys, np.asarray(partitions)[present], registers, ranks, precision)
+
+    @classmethod
+    def union(cls, sketches):
+        """Combines sketches of one column, over the same key columns, into one; partitions with equal keys merge.
+
+        None entries are skipped. Partitions are renumbered in key order, as
+        a single from_values over all the values would number them.
+        """
+        sketches = [sketch for sketch in sketches if sketch is not None]
+        keys = concat_typed([sketch.keys for sketch in sketches]).reset_index(drop=True)
+        columns = list(keys.columns)
+        grouped = keys.groupby(columns, observed=True, dropna=False, sort=True)
+        renumbered = grouped.ngroup().to_numpy()
+        offsets = np.cumsum([0] + [len(sketch.keys) for sketch in sketches[:-1]])
+        return cls.from_ranks(
+            grouped.size().reset_index()[columns],
+            np.concatenate([renumbered[offset + sketch._partitions] for offset, sketch in zip(offsets, sketches)]),
+            np.concatenate([sketch._registers for sketch in sketches]),
+            np.concatenate([sketch._ranks for sketch in sketches]),
+            sketches[0].precision,
+        )
+
+    def merge(self, mask=None):
+        """Dense registers of the union of the partitions selected by mask (booleans over keys; all when None)."""
+        registers, ranks = self._registers, self._ranks
+        if mask is not None:
+            rows = np.asarray(mask)[self._partitions]
+            registers, ranks = registers[rows], ranks[rows]
+        dense = np.zeros(1 << self.precision, dtype=np.uint8)
+        np.maximum.at(dense, registers, ranks)
+        return dense
+
+    def count(self, mask=None):
+        """Estimated distinct values across the partitions selected by mask; the all-partition count is memoized."""
+        if mask is not None:
+            return int(round(estimate(self.merge(mask), self.precision)))
+        if self._total is None:
+            self._total = int(round(estimate(self.merge(), self.precision)))
+        return self._total
+
+
+class KLLSketch:
+    """Mergeable quantile sketch: a stack of KLL compactors with equal capacities.
+
+    Level h holds items standing for 2**h values each. A level over capacity
+    is sorted and every other item, from a random start, moves up a level,
+    which moves any rank by at most 2**h; the total weight stays equal to
+    the number of values. Merging two sketches appends their levels and
+    compacts, so the sketch of a union of partitions is the merge of theirs.
+    The random starts come from seed, so equal inputs give equal sketches.
+    """
+
+    def __init__(self, capacity=KLL_CAPACITY, seed=0):
+        self.capacity = capacity
+        self.count = 0
+        self.levels = []
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_values(cls, values, capacity=KLL_CAPACITY, seed=0):
+        sketch = cls(capacity, seed)
+        sketch.update(values)
+        return sketch
+
+    def update(self, values):
+        """Adds an array of values; NaN is skipped."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self._add(0, values)
+        self._compact()
+        return self
+
+    def merge(self, other):
+        """Folds other into this sketch in place and returns it."""
+        for level, items in enumerate(other.levels):
+            self._add(level, items)
+        self.count += other.count
+        self._compact()
+        return self
+
+    def _add(self, level, items):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty(0, dtype=np.float64))
+        self.levels[level] = np.concatenate([self.levels[level], items])
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity:
+                items = np.sort(items)
+                # An odd item out stays at this level, so the weight is kept
+                kept = items[len(items) - len(items) % 2:]
+                self.levels[level] = kept
+                self._add(level + 1, items[self._rng.integers(2):len(items) - len(kept):2])
+            level += 1
+
+    def _cumulative(self):
+        levels = self.levels or [np.empty(0, dtype=np.float64)]
+        items = np.concatenate(levels)
+        weights = np.concatenate([np.full(len(level_items), 2.0 ** level) for level, level_items in enumerate(levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self, fractions):
+        """Values at the given fractions (0-1) of the sorted values; NaN for an empty sketch."""
+        fractions = np.asarray(fractions, dtype=np.float64)
+        if not self.count:
+            return np.full(fractions.shape, np.nan)
+        items, cumulative = self._cumulative()
+        positions = np.searchsorted(cumulative, fractions * cumulative[-1], side='left')
+        return items[np.minimum(positions, len(items) - 1)]
+
+    def rank(self, values):
+        """Estimated fraction of the values less than or equal to each of values."""
+        items, cumulative = self._cumulative()
+        positions = np.searchsorted(items, np.asarray(values, dtype=np.float64), side='right')
+        return np.append(0.0, cumulative)[positions] / max(self.count, 1)
@@ -0,0 +1,108 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+# Distinct search strings remembered per table
+SEARCH_CACHE_SIZE = 8
+
+
+class PagedTable:
+    """A read-only frame served one page at a time, sorted and searched on the server.
+
+    Sort orders are computed once per (column, direction) and kept, so
+    re-sorting or paging a large table only slices positions; only the rows
+    of the requested page are ever materialized.
+    """
+
+    def __init__(self, frame, search_columns=(), sort_by=None, ascending=True):
+        self.frame = frame.reset_index(drop=True)
+        self.search_columns = [column for column in search_columns if column in self.frame.columns]
+        self.sort_by = sort_by
+        self.ascending = ascending
+        self._orders = {}
+        self._matches = {}
+        self._search_text = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def columns(self):
+        return list(self.frame.columns)
+
+    def order(self, column, ascending=True):
+        """Row positions sorted by column (missing values last), computed once per direction."""
+        key = (column, ascending)
+        if key not in self._orders:
+            ordered = self.frame[column].sort_values(ascending=ascending, kind='stable', na_position='last')
+            self._orders[key] = ordered.index.to_numpy()
+        return self._orders[key]
+
+    def _column_matches(self, column, query):
+        values = self.frame[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Match the categories once and broadcast through the codes (code -1, missing, never matches)
+            hits = np.asarray(values.cat.categories.astype(str).str.lower().str.contains(query, regex=False), dtype=bool)
+            return np.append(hits, False)[values.cat.codes.to_numpy()]
+        if column not in self._search_text:
+            self._search_text[column] = values.astype(str).str.lower()
+        return self._search_text[column].str.contains(query, regex=False).to_numpy()
+
+    def matches(self, query):
+        """Boolean mask of the rows where any search column contains query (case-insensitive)."""
+        query = query.strip().lower()
+        with self._lock:
+            if query in self._matches:
+                return self._matches[query]
+            mask = np.zeros(len(self.frame), dtype=bool)
+            for column in self.search_columns:
+                mask |= self._column_matches(column, query)
+            if len(self._matches) >= SEARCH_CACHE_SIZE:
+                self._matches.pop(next(iter(self._matches)))
+            self._matches[query] = mask
+            return mask
+
+    def page(self, number, size, sort_by=None, ascending=None, query=""):
+        """Returns (rows of page number, 0-based, of the sorted/filtered table, number of matching rows)."""
+        sort_by = sort_by or self.sort_by
+        ascending = self.ascending if ascending is None else ascending
+        positions = self.order(sort_by, ascending) if sort_by else np.arange(len(self.frame))
+
+        if query.strip() and self.search_columns:
+            positions = positions[self.matches(query)[positions]]
+
+        start = number * size
+        return self.frame.take(positions[start:start + size]), len(positions)
+
+
+def show_paged_table(table, key, page_size=25):
+    """Renders a PagedTable with search, sort and paging controls; returns the visible rows."""
+    search, sort_column, direction, size = st.columns([3, 2, 1, 1])
+    query = search.text_input("🔍 Search", key=f"{key}-search", placeholder=", ".join(table.search_columns))
+    sort_by = sort_column.selectbox(
+        "Sort by", table.columns, key=f"{key}-sort",
+        index=table.columns.index(table.sort_by) if table.sort_by in table.columns else 0,
+    )
+    ascending = direction.selectbox(
+        "Order", ["Ascending", "Descending"], key=f"{key}-order",
+        index=0 if table.ascending else 1,
+    ) == "Ascending"
+    page_size = size.selectbox("Rows", PAGE_SIZES, key=f"{key}-size",
+                               index=PAGE_SIZES.index(page_size) if page_size in PAGE_SIZES else 0)
+
+    # No max_value: a search can shrink the page count below the current page, which is clamped instead
+    number = int(st.number_input("Page", min_value=1, value=1, step=1, key=f"{key}-page")) - 1
+    total = len(table) if not query.strip() or not table.search_columns else int(table.matches(query).sum())
+    pages = max((total + page_size - 1) // page_size, 1)
+    number = min(number, pages - 1)
+
+    rows, total = table.page(number, page_size, sort_by, ascending, query)
+    st.dataframe(rows, hide_index=True, use_container_width=True)
+    first = number * page_size + 1 if total else 0
+    st.caption(f"Rows {first:,}–{number * page_size + len(rows):,} of {total:,} (page {number + 1} of {pages})")
+    return rows
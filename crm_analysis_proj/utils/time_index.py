@@ -0,0 +1,106 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.dataset import date_order
+from utils.sketches import HLLSketches
+
+
+class TimeIndex:
+    """Date-range and country filters over line items, with prebuilt positions into the frame.
+
+    A date range resolves to a contiguous row slice by binary search, and a
+    country narrows it with that country's sorted row positions, so filtering
+    never scans the full frame. The index holds the frame itself, not a
+    copy: a frame already in date order (as prepare_dataset leaves it) is
+    sliced directly, any other is read through an array of row positions in
+    date order. Rows without a date sort last and are never selected by a
+    date range. Each of sketch_columns also gets HyperLogLog
+    sketches per (day, country), so distinct counts over a filter merge a
+    few sketches instead of hashing every selected row.
+    """
+
+    def __init__(self, df, sketch_columns=()):
+        self.frame = df
+        dates = df['InvoiceDate'].to_numpy()
+        self._order = date_order(dates)
+        if self._order is not None:
+            dates = dates[self._order]
+        self._dates = dates[:len(dates) - int(np.isnat(dates).sum())]
+
+        countries = self._rows(df['Country']).astype('category')
+        codes = countries.cat.codes.to_numpy()
+        # A stable sort by country keeps each country's positions in date order
+        by_country = np.argsort(codes, kind='stable')
+        sorted_codes = codes[by_country]
+        starts = np.searchsorted(sorted_codes, np.arange(len(countries.cat.categories)), side='left')
+        stops = np.searchsorted(sorted_codes, np.arange(len(countries.cat.categories)), side='right')
+        self._country_positions = {
+            country: by_country[start:stop]
+            for country, start, stop in zip(countries.cat.categories, starts, stops)
+            if stop > start
+        }
+
+        # Partition of each dated row: its day since the first date and its country code (+1, so no country is 0)
+        self._country_codes = {country: code + 1 for code, country in enumerate(countries.cat.categories)}
+        width = len(countries.cat.categories) + 1
+        days = (self._dates.astype('datetime64[D]') - self._dates[:1].astype('datetime64[D]')).astype('int64')
+        partitions = days * width + codes[:len(days)] + 1
+        day_count = int(days[-1]) + 1 if len(days) else 0
+        keys = pd.DataFrame({'Day': np.repeat(np.arange(day_count), width), 'Country': np.tile(np.arange(width), day_count)})
+        self._sketches = {
+            column: HLLSketches.from_values(keys, partitions, self._rows(df[column]).iloc[:len(days)])
+            for column in sketch_columns
+        }
+
+    def _rows(self, values, rows=slice(None)):
+        """The rows (a slice or positions, in date order) of a frame or series."""
+        if self._order is None:
+            return values.iloc[rows] if isinstance(rows, slice) else values.take(rows)
+        return values.take(self._order[rows])
+
+    @property
+    def countries(self):
+        return list(self._country_positions)
+
+    @property
+    def min_date(self):
+        return pd.Timestamp(self._dates[0]) if len(self._dates) else None
+
+    @property
+    def max_date(self):
+        return pd.Timestamp(self._dates[-1]) if len(self._dates) else None
+
+    def date_slice(self, start_date, end_date):
+        """Returns the row slice covering start_date..end_date inclusive (dates or timestamps)."""
+        lower = np.datetime64(pd.Timestamp(start_date).normalize())
+        upper = np.datetime64(pd.Timestamp(end_date).normalize() + datetime.timedelta(days=1))
+        return slice(
+            int(np.searchsorted(self._dates, lower, side='left')),
+            int(np.searchsorted(self._dates, upper, side='left')),
+        )
+
+    def distinct(self, column, start_date, end_date, country=None):
+        """Estimated distinct values of a sketched column in the date range (and country)."""
+        sketch = self._sketches[column]
+        if not len(self._dates):
+            return 0
+        first = pd.Timestamp(self._dates[0]).normalize()
+        lower = (pd.Timestamp(start_date).normalize() - first).days
+        upper = (pd.Timestamp(end_date).normalize() - first).days
+        day = sketch.keys['Day'].to_numpy()
+        mask = (day >= lower) & (day <= upper)
+        if country is not None:
+            mask &= sketch.keys['Country'].to_numpy() == self._country_codes.get(country, -1)
+        return sketch.count(mask)
+
+    def select(self, start_date, end_date, country=None):
+        """Returns the rows in the date range (and country), without copying when no country is given."""
+        rows = self.date_slice(start_date, end_date)
+        if country is None:
+            return self._rows(self.frame, rows)
+
+        positions = self._country_positions.get(country, np.empty(0, dtype='int64'))
+        lo, hi = np.searchsorted(positions, [rows.start, rows.stop], side='left')
+        return self._rows(self.frame, positions[lo:hi])
@@ -1,4 +1,13 @@
+import numpy as np
+import pandas as pd
 import plotly.express as px
+import plotly.io as pio
+
+# Chart preparation defaults: categories shown before the tail becomes "Other",
+# and points kept per downsampled line
+TOP_N = 15
+OTHER_LABEL = "Other"
+MAX_LINE_POINTS = 1000
 
 def revenue_chart(df):
     """Creates a revenue bar chart by category."""
@@ -16,3 +25,78 @@ def churn_pie_chart(df):
     churn_data = df.groupby('CustomerID')['Days_Since_Last_Purchase'].max().reset_index()
     churn_data['Churn'] = churn_data['Days_Since_Last_Purchase'] > 90
     return px.pie(churn_data, names='Churn', title="Churn Distribution")
+
+def top_n(df, label, value, n=TOP_N, by=(), aggregations=None, other_label=OTHER_LABEL):
+    """Keeps the n labels with the largest total value and folds the rest into one other_label bucket.
+
+    Rows are regrouped by label (and the by columns), summing the remaining
+    columns unless aggregations ({column: func}) says otherwise. The result
+    is ordered by descending value with the bucket last; frames with at most
+    n labels are returned unchanged.
+    """
+    totals = df.groupby(label, observed=True)[value].sum()
+    if len(totals) <= n:
+        return df
+
+    keep = totals.nlargest(n).index
+    keys = [label] + list(by)
+    measures = aggregations or {column: 'sum' for column in df.columns if column not in keys}
+    labels = df[label].astype(object).where(df[label].isin(keep), other_label)
+    bucketed = df.assign(**{label: labels}).groupby(keys, sort=False, observed=True).agg(measures).reset_index()
+
+    rank = {name: i for i, name in enumerate(list(keep) + [other_label])}
+    return bucketed.sort_values(label, key=lambda s: s.map(rank), kind='stable').reset_index(drop=True)
+
+def _numeric(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype('int64').astype('float64')
+    if not np.issubdtype(values.dtype, np.number):
+        # Sorted labels such as 'YYYY-MM' months: use their positions
+        return np.arange(len(values), dtype='float64')
+    return values.astype('float64')
+
+def lttb(x, y, threshold=MAX_LINE_POINTS):
+    """Largest-Triangle-Three-Buckets downsampling; returns the positions of the points to keep.
+
+    Keeps the first and last points and, from each of threshold - 2 equal
+    buckets in between, the point forming the largest triangle with the
+    previously kept point and the next bucket's average, which preserves
+    peaks and troughs that plain striding would drop. x must be sorted.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x, y = _numeric(x), _numeric(y)
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')
+    keep = np.empty(threshold, dtype='int64')
+    keep[0], keep[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        if bucket == threshold - 3:
+            next_x, next_y = x[n - 1], y[n - 1]
+        else:
+            next_x, next_y = x[stop:edges[bucket + 2]].mean(), y[stop:edges[bucket + 2]].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        keep[bucket + 1] = previous
+    return keep
+
+def downsample(df, x, y, max_points=MAX_LINE_POINTS, by=None):
+    """Downsamples each line (one per by value) of a long-format frame to max_points with LTTB."""
+    groups = df.groupby(by, sort=False, observed=True) if by else [(None, df)]
+    parts = []
+    for _, line in groups:
+        line = line.sort_values(x, kind='stable')
+        parts.append(line.iloc[lttb(line[x], line[y], max_points)])
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts) if parts else df
+
+def figure_bytes(fig):
+    """Size of the figure's JSON payload as sent to the browser."""
+    return len(pio.to_json(fig, validate=False))